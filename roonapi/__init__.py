@@ -1,4 +1,13 @@
 # flake8: noqa
 from .constants import LOGGER
 from .roonapi import RoonApi, split_media_path
-from .discovery import RoonDiscovery
+from .discovery import (
+    RoonCore,
+    RoonDiscovery,
+    RoonDiscoveryService,
+    discover_async,
+)
+from .browse import BrowseItem, BrowseSessionTimeout
+from .images import ImageClient, ImageProxy
+from .library import LibraryCrawler, LibraryIndex
+from .playqueue import QueueModel
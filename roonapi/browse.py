@@ -0,0 +1,523 @@
+"""
+Module defining helpers for the roon browse service.
+
+The browse service keeps a stack of levels per session, so callers that browse
+at the same time need their own session to not move each other's level.
+"""
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from .constants import (
+    BROWSE_SESSION_TIMEOUT,
+    LOGGER,
+    MAX_PAGE_SIZE,
+    MIN_PAGE_SIZE,
+    PAGE_LATENCY,
+    PAGE_SIZE,
+)
+
+BROWSE_SESSION_PREFIX = "pyroon-"
+
+EXACT_MATCH = 3
+PREFIX_MATCH = 2
+PARTIAL_MATCH = 1
+# Added to the score of items with a context word in their subtitle
+CONTEXT_MATCH = 0.5
+
+# Levels of the browse hierarchy that have a category of the same name in search results
+SEARCH_CATEGORIES = ("Artists", "Albums", "Tracks", "Composers", "Playlists")
+
+
+def search_terms(path):
+    """
+    Work out where to look for the last element of a browse path in search results.
+
+    eg ["Library", "Artists", "Neil Young"] is an artist and
+    ["Library", "Artists", "Neil Young", "Harvest"] an album by Neil Young.
+    returns: a tuple of (search category or None, list of words expected in the subtitle)
+    """
+    if len(path) >= 2 and path[-2] in SEARCH_CATEGORIES:
+        return path[-2], []
+    if len(path) >= 3 and path[-3] == "Artists":
+        return "Albums", [path[-2]]
+    return None, []
+
+
+def _normalise(text):
+    return " ".join(text.casefold().split())
+
+
+def rank_items(items, title, context=None):
+    """
+    Rank browse items by how well their title matches title.
+
+    Exact matches (ignoring case and spacing) rank first, then titles starting
+    with title, then titles containing it. Items with one of the context words in
+    their subtitle (eg the artist of an album) rank above others that match as well.
+    Items that rank the same keep their order.
+    returns: a list of (score, item) tuples of the matching items, best first
+    """
+    title = _normalise(title)
+    context = [_normalise(word) for word in context or []]
+    ranked = []
+    for item in items:
+        item_title = _normalise(item.get("title", ""))
+        if item_title == title:
+            score = EXACT_MATCH
+        elif item_title.startswith(title):
+            score = PREFIX_MATCH
+        elif title in item_title:
+            score = PARTIAL_MATCH
+        else:
+            continue
+        subtitle = _normalise(item.get("subtitle") or "")
+        if any(word in subtitle for word in context):
+            score += CONTEXT_MATCH
+        ranked.append((score, item))
+    ranked.sort(key=lambda match: -match[0])
+    return ranked
+
+
+class BrowseItem:
+    """
+    Class to store a browse item compactly.
+
+    Large levels hold many items with the same subtitle, hint or image key, so
+    those strings are interned and items use slots instead of a dict each.
+    Items can be read like the item dicts (item["title"], item.get("hint")).
+    """
+
+    __slots__ = (
+        "title",
+        "subtitle",
+        "image_key",
+        "item_key",
+        "hint",
+        "input_prompt",
+        "extra",
+    )
+
+    def __init__(
+        self,
+        title,
+        subtitle=None,
+        image_key=None,
+        item_key=None,
+        hint=None,
+        input_prompt=None,
+        extra=None,
+    ):  # pylint: disable=too-many-arguments
+        """Create an item from the fields of a browse item dict."""
+        self.title = title
+        self.subtitle = sys.intern(subtitle) if subtitle else subtitle
+        self.image_key = sys.intern(image_key) if image_key else image_key
+        self.item_key = item_key
+        self.hint = sys.intern(hint) if hint else hint
+        self.input_prompt = input_prompt
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, item):
+        """Create an item from a browse item dict."""
+        fields = {key: item.get(key) for key in cls.__slots__[:-1]}
+        extra = {key: value for key, value in item.items() if key not in fields}
+        return cls(extra=extra or None, **fields)
+
+    def as_dict(self):
+        """Return the item as a browse item dict."""
+        item = {
+            key: getattr(self, key)
+            for key in self.__slots__[:-1]
+            if getattr(self, key) is not None
+        }
+        if self.extra:
+            item.update(self.extra)
+        return item
+
+    def get(self, key, default=None):
+        """Return a field of the item, like dict.get."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        """Return a field of the item, like a browse item dict."""
+        if key in self.__slots__[:-1]:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        """Compare with another item or an item dict."""
+        if isinstance(other, BrowseItem):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    # Items compare equal to item dicts, which can not be hashed, so items are not
+    # hashable either (use item_key to key them)
+    __hash__ = None
+
+    def __repr__(self):
+        """Print class and fields."""
+        return f"<{self.__class__.__name__} {self.as_dict()!r}>"
+
+
+class BrowseSessionTimeout(Exception):
+    """Exception raised when no browse session becomes free in time."""
+
+
+class BrowseSessionPool:
+    """Class to hand out browse sessions (multi_session_key values) to one caller at a time."""
+
+    def __init__(self, size=4):
+        """
+        Create the pool.
+
+        size: the maximum number of browse sessions open on the core at once
+        """
+        self._size = size
+        self._created = 0
+        self._free = []
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        """Return the maximum number of sessions."""
+        return self._size
+
+    def acquire(self, timeout=None):
+        """
+        Take a session out of the pool, waiting until one is free.
+
+        returns: the multi_session_key of the session, or None on timeout
+        """
+        with self._condition:
+            if not self._free and self._created < self._size:
+                self._created += 1
+                return BROWSE_SESSION_PREFIX + str(self._created)
+            if not self._condition.wait_for(lambda: self._free, timeout):
+                return None
+            return self._free.pop()
+
+    def release(self, multi_session_key):
+        """Return a session to the pool."""
+        with self._condition:
+            self._free.append(multi_session_key)
+            self._condition.notify()
+
+    @contextmanager
+    def session(self, timeout=BROWSE_SESSION_TIMEOUT):
+        """
+        Use a session for the duration of a with block.
+
+        Raises BrowseSessionTimeout if no session is free within timeout seconds.
+        """
+        multi_session_key = self.acquire(timeout)
+        if multi_session_key is None:
+            raise BrowseSessionTimeout(
+                "No browse session became free in %s seconds, all %s are in use. "
+                "Sessions are held by browse_items and iter_media until they are "
+                "exhausted or closed, and by nested browse calls."
+                % (timeout, self._size)
+            )
+        try:
+            yield multi_session_key
+        finally:
+            self.release(multi_session_key)
+
+
+class BrowsePageSizer:
+    """Class to choose how many items to load per browse page from the measured latency."""
+
+    def __init__(
+        self,
+        min_size=MIN_PAGE_SIZE,
+        max_size=MAX_PAGE_SIZE,
+        target_latency=PAGE_LATENCY,
+    ):
+        """
+        Create the page sizer.
+
+        min_size: the smallest page to load, unless fewer items are wanted
+        max_size: the largest page to load
+        target_latency: the time in seconds a page load should take
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self._size = PAGE_SIZE
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "pages": 0, "items": 0, "last_call_pages": 0}
+
+    @property
+    def stats(self):
+        """Return the number of load calls, pages and items loaded so far."""
+        with self._lock:
+            return dict(self._stats, page_size=self._size)
+
+    def page_size(self, remaining, find=False, page=0):
+        """
+        Choose the number of items to load in the next page.
+
+        params:
+            remaining: the number of items still wanted from the level
+            find: True when looking for one item, the first pages are kept small
+                  and grow while the item is not found
+            page: the number of pages loaded before in this call
+        """
+        with self._lock:
+            size = self._size
+        if find:
+            size = min(size, PAGE_SIZE << page)
+        size = max(self.min_size, min(self.max_size, size))
+        if remaining <= size + size // 4:
+            # Don't leave a small last page
+            return min(remaining, self.max_size)
+        return size
+
+    def record_page(self, latency, items):
+        """Adjust the page size to a page that took latency seconds to load."""
+        with self._lock:
+            self._stats["pages"] += 1
+            self._stats["items"] += items
+            if items and latency > 0:
+                ideal = self.target_latency * items / latency
+                size = int((self._size + ideal) / 2)
+                self._size = max(self.min_size, min(self.max_size, size))
+
+    def record_call(self, pages):
+        """Count a call that loaded pages pages."""
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["last_call_pages"] = pages
+
+
+class BrowseCursor:
+    """Class to track the level of a browse session, so the next navigation can start from it."""
+
+    def __init__(
+        self, roonapi, multi_session_key=None, hierarchy="browse", page_sizer=None
+    ):
+        """
+        Create a cursor for a browse session.
+
+        roonapi: the RoonApi to browse with
+        multi_session_key: the browse session, None for the default session
+        hierarchy: the browse hierarchy, eg "browse" or "search"
+        page_sizer: the BrowsePageSizer to choose page sizes, pages of PAGE_SIZE are loaded if not set
+        """
+        self._roonapi = roonapi
+        self._page_sizer = page_sizer
+        self._multi_session_key = multi_session_key
+        self._hierarchy = hierarchy
+        self._path = None
+        self._list_titles = []
+        self._count = 0
+        self._item = None
+
+    @property
+    def path(self):
+        """Return the titles leading to the current level, None if the level is unknown."""
+        return None if self._path is None else list(self._path)
+
+    @property
+    def count(self):
+        """Return the number of items in the current level."""
+        return self._count
+
+    @property
+    def item(self):
+        """Return the last item browsed into, None at the top level."""
+        return self._item
+
+    def reset(self):
+        """Forget the current level, the next navigation starts from the top."""
+        self._path = None
+        self._item = None
+
+    def opts(self, zone_or_output_id, **extra):
+        """Return the opts for a browse_browse or browse_load call in this session."""
+        opts = {"hierarchy": self._hierarchy}
+        if zone_or_output_id is not None:
+            opts["zone_or_output_id"] = zone_or_output_id
+        if self._multi_session_key is not None:
+            opts["multi_session_key"] = self._multi_session_key
+        opts.update(extra)
+        return opts
+
+    def navigate(self, zone_or_output_id, path, report_error=True):
+        """
+        Move to the level at path.
+
+        Levels shared with the current path are kept, the session only pops back
+        to the nearest common level instead of returning to the top.
+
+        params:
+            zone_or_output_id: the zone or output to browse for
+            path: a list of titles leading to the level, eg ["Library", "Artists"]
+            report_error: log an error if an element of the path can not be found
+        returns: True if the level was reached
+        """
+        reused = self._path is not None
+        depth = self._pop_to_common_level(zone_or_output_id, path)
+        if depth is None:
+            return False
+        self._item = None
+        for element in path[depth:]:
+            LOGGER.debug("Looking for %s", element)
+            found = self.find(zone_or_output_id, element)
+            if found is None:
+                if report_error:
+                    LOGGER.error("Could not find media path element '%s'", element)
+                else:
+                    LOGGER.debug("Could not find media path element '%s'", element)
+                return False
+            result = self.browse_item(zone_or_output_id, found)
+            if found.get("hint") == "action":
+                break
+            if result is None:
+                if reused:
+                    # The core no longer knows the level we started from
+                    self.reset()
+                    return self.navigate(zone_or_output_id, path, report_error)
+                LOGGER.error("Exception trying to browse to '%s'", element)
+                return False
+        return True
+
+    def search(self, zone_or_output_id, text):
+        """
+        Start a search, its results become the top level of the session.
+
+        returns: True if the core returned search results
+        """
+        result = self._roonapi.browse_browse(
+            self.opts(zone_or_output_id, pop_all=True, input=text)
+        )
+        return self._at_top(result)
+
+    def browse_item(self, zone_or_output_id, item):
+        """
+        Browse into an item of the current level, or take its action.
+
+        returns: the browse result, or None if it did not open a level
+        """
+        self._item = item
+        result = self._roonapi.browse_browse(
+            self.opts(zone_or_output_id, item_key=item["item_key"])
+        )
+        if item.get("hint") == "action":
+            return result
+        try:
+            browse_list = result["list"]
+        except (KeyError, TypeError):
+            self.reset()
+            return None
+        if self._path is not None:
+            self._path.append(item["title"])
+            self._list_titles.append(browse_list.get("title"))
+        self._count = browse_list["count"]
+        return result
+
+    def find(self, zone_or_output_id, title):
+        """Page through the current level until an item matches title."""
+        for item in self.items(zone_or_output_id, find=True):
+            if item["title"] == title:
+                return item
+        return None
+
+    def items(self, zone_or_output_id, count=None, find=False, page_size=None):
+        """
+        Load the items of the current level a page at a time.
+
+        params:
+            zone_or_output_id: the zone or output to browse for
+            count: optional maximum number of items to load
+            find: True when the caller stops at the first item it is looking for
+            page_size: optional fixed number of items per page, instead of the page sizer
+        """
+        load_opts = self.opts(zone_or_output_id)
+        limit = self._count if count is None else min(count, self._count)
+        offset = 0
+        pages = 0
+        try:
+            while offset < limit:
+                load_opts["offset"] = offset
+                if self._page_sizer is None or page_size is not None:
+                    load_opts["count"] = min(page_size or PAGE_SIZE, limit - offset)
+                else:
+                    load_opts["count"] = self._page_sizer.page_size(
+                        limit - offset, find, pages
+                    )
+                started = time.monotonic()
+                result = self._roonapi.browse_load(load_opts)
+                items = result.get("items") if result else None
+                pages += 1
+                if self._page_sizer is not None and items:
+                    self._page_sizer.record_page(time.monotonic() - started, len(items))
+                if not items:
+                    return
+                for item in items[: limit - offset]:
+                    yield item
+                offset += len(items)
+        finally:
+            if self._page_sizer is not None:
+                self._page_sizer.record_call(pages)
+            LOGGER.debug("Loaded %s items of %s in %s pages", offset, self._path, pages)
+
+    def _pop_to_common_level(self, zone_or_output_id, path):
+        """Pop back to the deepest level shared with path, return its depth."""
+        if self._path is not None:
+            depth = 0
+            for current, wanted in zip(self._path, path):
+                if current != wanted:
+                    break
+                depth += 1
+            levels = len(self._path) - depth
+            if levels:
+                opts = self.opts(zone_or_output_id, pop_levels=levels)
+            else:
+                opts = self.opts(zone_or_output_id, refresh_list=True)
+            result = self._roonapi.browse_browse(opts)
+            if self._at_level(result, depth):
+                del self._path[depth:]
+                del self._list_titles[depth + 1 :]
+                self._count = result["list"]["count"]
+                return depth
+            LOGGER.debug("Browse level is stale, returning to the top")
+
+        result = self._roonapi.browse_browse(self.opts(zone_or_output_id, pop_all=True))
+        if not self._at_top(result):
+            LOGGER.error("Could not browse to the top level: %s", result)
+            return None
+        return 0
+
+    def _at_top(self, result):
+        """Start tracking from the top level returned by a browse call."""
+        try:
+            browse_list = result["list"]
+        except (KeyError, TypeError):
+            self.reset()
+            return False
+        self._path = []
+        self._list_titles = [browse_list.get("title")]
+        self._count = browse_list["count"]
+        self._item = None
+        return True
+
+    def _at_level(self, result, depth):
+        """Check the core reports the level we expect to be at."""
+        try:
+            browse_list = result["list"]
+        except (KeyError, TypeError):
+            return False
+        return (
+            browse_list.get("level") == depth
+            and browse_list.get("title") == self._list_titles[depth]
+        )
@@ -23,6 +23,12 @@ MESSAGE_COMPLETE = "COMPLETE"
 MESSAGE_CONTINUE = "CONTINUE"
 
 PAGE_SIZE = 100
+MIN_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+PAGE_LATENCY = 0.25
+BROWSE_SESSION_TIMEOUT = 30
+
+CONTROL_UPDATE_INTERVAL = 0.1
 
 LOG_FORMAT = logging.Formatter(
     "%(asctime)-15s %(levelname)-5s  %(module)s -- %(message)s"
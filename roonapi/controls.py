@@ -0,0 +1,193 @@
+"""
+Module defining helpers for the controls (volume, source) this extension provides to roon.
+
+Changes to the controls are reported to the core with CONTINUE messages on the
+subscription the core opened. ControlUpdateBuffer collects them for a short
+interval, so many updates are sent as one message with one entry per control.
+
+Requests from the core (eg set_volume) are handled by ControlDispatcher on
+worker threads, so slow hardware does not hold up the websocket thread.
+"""
+
+import copy
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import CONTROL_UPDATE_INTERVAL, LOGGER
+
+ADDED = "controls_added"
+CHANGED = "controls_changed"
+REMOVED = "controls_removed"
+
+
+class ControlUpdateBuffer(threading.Thread):
+    """Class to merge control updates per control_key and send them together."""
+
+    def __init__(self, send, interval=CONTROL_UPDATE_INTERVAL):
+        """
+        Create the buffer, call start to begin sending.
+
+        send: function to send a message body, eg {"controls_changed": [...]}, to the core
+        interval: seconds to collect updates before sending them
+        """
+        self._send = send
+        self._interval = interval
+        self._pending = {}
+        self._first_update = None
+        self._condition = threading.Condition()
+        self._exit = False
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def add(self, control_key, control_data):
+        """Report a new control."""
+        with self._condition:
+            pending = self._pending.get(control_key, [None])[0]
+            # A control that is removed and added again before sending is only changed
+            update = CHANGED if pending in (CHANGED, REMOVED) else ADDED
+            self._update(control_key, update, control_data)
+
+    def change(self, control_key, control_data):
+        """Report the new state of a control, replacing a change that is not sent yet."""
+        with self._condition:
+            update = self._pending.get(control_key, [CHANGED])[0]
+            self._update(
+                control_key, ADDED if update == ADDED else CHANGED, control_data
+            )
+
+    def remove(self, control_key):
+        """Report that a control is gone."""
+        with self._condition:
+            if self._pending.get(control_key, [None])[0] == ADDED:
+                # The core never heard of it
+                del self._pending[control_key]
+                return
+            self._update(control_key, REMOVED, {"control_key": control_key})
+
+    def clear(self):
+        """Drop the updates that are not sent, eg when the core subscribes again."""
+        with self._condition:
+            self._pending.clear()
+            self._first_update = None
+
+    def flush(self):
+        """Send the pending updates now."""
+        with self._condition:
+            data = self._take()
+        if data:
+            self._send(data)
+
+    def run(self):
+        """Send the pending updates every interval until stopped."""
+        while True:
+            with self._condition:
+                while not self._exit and (
+                    self._first_update is None
+                    or time.monotonic() - self._first_update < self._interval
+                ):
+                    wait = None
+                    if self._first_update is not None:
+                        wait = self._first_update + self._interval - time.monotonic()
+                    self._condition.wait(wait)
+                if self._exit:
+                    return
+                data = self._take()
+            if data:
+                try:
+                    self._send(data)
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Could not send control updates")
+
+    def stop(self):
+        """Stop sending, call flush first to send the pending updates."""
+        with self._condition:
+            self._exit = True
+            self._condition.notify()
+
+    def _update(self, control_key, update, control_data):
+        self._pending[control_key] = [update, control_data]
+        if self._first_update is None:
+            self._first_update = time.monotonic()
+            self._condition.notify()
+
+    def _take(self):
+        """Return the message for the pending updates and forget them."""
+        data = {}
+        for update, control_data in self._pending.values():
+            data.setdefault(update, []).append(copy.copy(control_data))
+        self._pending.clear()
+        self._first_update = None
+        return data
+
+
+class ControlDispatcher:
+    """Class to run the handlers of control requests on worker threads, in order per control."""
+
+    def __init__(self, complete, max_workers=4):
+        """
+        Create the dispatcher.
+
+        complete: function called with the request id and "Success" or "Error" when a
+                  request is handled, to report it to the core
+        max_workers: the number of requests handled at the same time (for different controls)
+        """
+        self._complete = complete
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    # pylint: disable=too-many-arguments
+    def submit(self, control_key, request_id, handler, data, merge=None):
+        """
+        Handle a request after the requests of the control that came before it.
+
+        params:
+            control_key: the control the request is for
+            request_id: the id of the request, passed to complete
+            handler: function called with data to handle the request
+            data: what the handler needs to handle the request
+            merge: optional function called with the data of the last waiting request of the
+                   control and data, that returns the data of both merged or None. A merged
+                   request replaces the waiting one, which is completed right away.
+        """
+        superseded = None
+        with self._lock:
+            queue = self._queues.get(control_key)
+            start = queue is None
+            if start:
+                queue = self._queues[control_key] = deque()
+            merged = None
+            if merge is not None and queue:
+                merged = merge(queue[-1][2], data)
+            if merged is not None:
+                superseded = queue[-1][0]
+                queue[-1] = (request_id, handler, merged)
+            else:
+                queue.append((request_id, handler, data))
+        if superseded is not None:
+            self._complete(superseded, "Success")
+        if start:
+            self._executor.submit(self._run, control_key)
+
+    def stop(self):
+        """Stop handling requests."""
+        self._executor.shutdown(wait=False)
+
+    def _run(self, control_key):
+        """Handle the requests of a control until none are waiting."""
+        while True:
+            with self._lock:
+                queue = self._queues[control_key]
+                if not queue:
+                    del self._queues[control_key]
+                    return
+                request_id, handler, data = queue.popleft()
+            try:
+                handler(data)
+                result = "Success"
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Error in control callback for %s", control_key)
+                result = "Error"
+            self._complete(request_id, result)
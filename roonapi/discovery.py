@@ -3,29 +3,280 @@ Module defining a class to discover Roon servers.
 
 If multiple servers are available on the network, the first to be discovered
 is selected. This may not be the one you have enabled the plugin for.
+
+RoonDiscoveryService keeps listening instead, so the cores on the network are
+known at once when they are needed. discover_async does the same as
+RoonDiscovery for asyncio applications.
 """
 
-import os.path
+import asyncio
+import collections
+import ipaddress
+import select
 import socket
+import struct
 import threading
+import time
+
+import ifaddr
 
+from . import soodmessage
 from .soodmessage import FormatException, SOODMessage
 from .constants import SOOD_PORT, SOOD_MULTICAST_IP, LOGGER
 
 
+def interfaces():
+    """
+    Return the IPv4 interfaces to query, except loopback.
+
+    returns: list of (address, broadcast address) tuples
+    """
+    found = []
+    for adapter in ifaddr.get_adapters():
+        for ip in adapter.ips:
+            if not ip.is_IPv4 or ipaddress.IPv4Address(ip.ip).is_loopback:
+                continue
+            network = ipaddress.IPv4Interface("%s/%s" % (ip.ip, ip.network_prefix))
+            found.append((ip.ip, str(network.network.broadcast_address)))
+    return found
+
+
+def _query_socket(address):
+    """Return a socket to send queries from the interface with address, or None."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 32)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind((address, 0))
+        sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address)
+        )
+    except OSError as exc:
+        LOGGER.debug("Could not query from %s: %s", address, exc)
+        sock.close()
+        return None
+    return sock
+
+
+class RoonCore:  # pylint: disable=too-few-public-methods
+    """Class to hold a roon core found by discovery."""
+
+    __slots__ = ("unique_id", "host", "port", "name", "display_version", "last_seen")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, unique_id, host, port, name=None, display_version=None):
+        """Create a core that was seen now."""
+        self.unique_id = unique_id
+        self.host = host
+        self.port = port
+        self.name = name
+        self.display_version = display_version
+        self.last_seen = time.monotonic()
+
+    @property
+    def address(self):
+        """Return the (host, port) to connect RoonApi to."""
+        return self.host, self.port
+
+    def __repr__(self):
+        """Show the name and address of the core."""
+        return "RoonCore(%r, %s:%s)" % (self.name, self.host, self.port)
+
+
+def core_from_response(data, address, tids=None):
+    """
+    Parse a SOOD message.
+
+    params:
+        data: the received message
+        address: the (host, port) the message came from
+        tids: optional transaction ids of the queries sent, to ignore answers to other queries
+    returns: the RoonCore that sent the message, or None if it is not a response from a core
+    """
+    try:
+        message_type, properties = soodmessage.decode(data)
+    except FormatException as exc:
+        LOGGER.debug("Ignoring invalid SOOD message from %s: %s", address[0], exc)
+        return None
+    if (
+        message_type != SOODMessage.SOODMessageType.RESPONSE
+        or "unique_id" not in properties
+        or "http_port" not in properties
+    ):
+        return None
+    if tids is not None and not soodmessage.answers(properties, tids):
+        LOGGER.debug("Ignoring answer to another query from %s", address[0])
+        return None
+    return RoonCore(
+        properties["unique_id"],
+        address[0],
+        properties["http_port"],
+        properties.get("name"),
+        properties.get("display_version"),
+    )
+
+
+class RoonDiscoveryService(threading.Thread):
+    """Class to keep track of the Roon Servers in the network."""
+
+    def __init__(self, interval=60, ttl=None):
+        """
+        Create the service, call start to begin discovering.
+
+        interval: seconds between queries, queries are sent more often right after starting
+        ttl: seconds after which a core that was not seen again is forgotten, 3 intervals if not set
+        """
+        self._interval = interval
+        self._ttl = ttl if ttl is not None else 3 * interval
+        self._cores = {}
+        # Answers to the last few queries are accepted, they may cross a new query
+        self._tids = collections.deque(maxlen=4)
+        self._condition = threading.Condition()
+        self._query_now = threading.Event()
+        self._exit = threading.Event()
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    @property
+    def cores(self):
+        """Return a dict of unique_id to RoonCore of the cores seen within the ttl."""
+        with self._condition:
+            self._expire()
+            return dict(self._cores)
+
+    def get(self, core_id=None):
+        """Return the RoonCore with the unique_id core_id (or any core if not set), or None."""
+        with self._condition:
+            self._expire()
+            return self._find(core_id)
+
+    def wait_for(self, core_id=None, timeout=None):
+        """
+        Wait until a core is found.
+
+        params:
+            core_id: the unique_id of the core to wait for, any core if not set
+            timeout: seconds to wait at most
+        returns: the RoonCore, or None if it was not found in time
+        """
+        with self._condition:
+            self._expire()
+            core = self._find(core_id)
+            if core is None:
+                self._query_now.set()
+                self._condition.wait_for(lambda: self._find(core_id), timeout)
+                core = self._find(core_id)
+        return core
+
+    def query(self):
+        """Send a query right away, eg when a core was lost."""
+        self._query_now.set()
+
+    def run(self):
+        """Query and listen for answers until stopped."""
+        backoff = 1
+        next_query = 0
+        with self._open_socket() as sock:
+            while not self._exit.is_set():
+                if time.monotonic() >= next_query or self._query_now.is_set():
+                    self._query_now.clear()
+                    self._send_query(sock)
+                    next_query = time.monotonic() + backoff
+                    backoff = min(backoff * 2, self._interval)
+                try:
+                    data, address = sock.recvfrom(2048)
+                except socket.timeout:
+                    continue
+                except OSError as exc:
+                    LOGGER.warning("Error while listening for roon cores: %s", exc)
+                    self._exit.wait(1)
+                    continue
+                self._answered(data, address)
+
+    def stop(self):
+        """Stop discovering."""
+        self._exit.set()
+
+    def _answered(self, data, address):
+        core = core_from_response(data, address, set(self._tids))
+        if core is not None:
+            self._seen(core)
+
+    def _seen(self, core):
+        with self._condition:
+            if core.unique_id not in self._cores:
+                LOGGER.debug("Discovered %s", core)
+            self._cores[core.unique_id] = core
+            self._condition.notify_all()
+
+    def _find(self, core_id):
+        if core_id is None:
+            return next(iter(self._cores.values()), None)
+        return self._cores.get(core_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        for unique_id, core in list(self._cores.items()):
+            if now - core.last_seen > self._ttl:
+                LOGGER.debug("Lost %s", core)
+                del self._cores[unique_id]
+
+    @staticmethod
+    def _open_socket():
+        """Open a socket on the SOOD port in the SOOD multicast group."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 32)
+        try:
+            sock.bind(("", SOOD_PORT))
+            membership = struct.pack(
+                "4s4s", socket.inet_aton(SOOD_MULTICAST_IP), socket.inet_aton("0.0.0.0")
+            )
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as exc:
+            LOGGER.warning("Could not join the SOOD multicast group: %s", exc)
+        sock.settimeout(0.5)
+        return sock
+
+    def _send_query(self, sock):
+        msg, tid = soodmessage.query()
+        self._tids.append(tid)
+        for address, broadcast in interfaces() or [("0.0.0.0", "<broadcast>")]:
+            try:
+                sock.setsockopt(
+                    socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address)
+                )
+                sock.sendto(msg, (SOOD_MULTICAST_IP, SOOD_PORT))
+                sock.sendto(msg, (broadcast, SOOD_PORT))
+            except OSError as exc:
+                LOGGER.debug("Could not send SOOD query from %s: %s", address, exc)
+
+
 class RoonDiscovery(threading.Thread):
     """Class to discover Roon Servers connected in the network."""
 
-    def __init__(self, core_id=None):
-        """Discover Roon Servers connected in the network."""
+    def __init__(self, core_id=None, timeout=5, settle=None):
+        """
+        Discover Roon Servers connected in the network.
+
+        core_id: only look for the core with this unique_id
+        timeout: seconds to wait for answers
+        settle: when looking for all cores, stop waiting this many seconds after the
+                first answer instead of at the timeout (None waits for the timeout)
+        """
         self._exit = threading.Event()
         self._core_id = core_id
+        self._timeout = timeout
+        self._settle = settle
         threading.Thread.__init__(self)
         self.daemon = True
 
     def run(self):
         """Run discovery until server found."""
-        while not self._exit.isSet():
+        while not self._exit.is_set():
             host, _ = self.first()
             if host:
                 self.stop()
@@ -35,7 +286,12 @@ class RoonDiscovery(threading.Thread):
         self._exit.set()
 
     def all(self):
-        """Scan and return all found entries as a list. Each server is a tuple of host,port."""
+        """
+        Scan and return all found entries as a list. Each server is a tuple of host,port.
+
+        Waits for answers until the timeout, or until settle seconds after the first
+        answer when settle is set.
+        """
         return self._discover(first_only=False)
 
     def first(self):
@@ -43,50 +299,139 @@ class RoonDiscovery(threading.Thread):
         all_servers = self._discover(first_only=True)
         return all_servers[0] if all_servers else (None, None)
 
-    # pylint: disable=too-many-locals,unspecified-encoding
     def _discover(self, first_only=False):
-        """Update the server entry with details."""
-        this_dir = os.path.dirname(os.path.abspath(__file__))
-        sood_file = os.path.join(this_dir, ".soodmsg")
-        with open(sood_file) as sood_query_file:
-            msg = sood_query_file.read()
-        msg = msg.encode()
-        entries = []
-
-        with socket.socket(
-            socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP
-        ) as sock:
-            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 32)
-            sock.sendto(msg, (SOOD_MULTICAST_IP, SOOD_PORT))
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(msg, ("<broadcast>", SOOD_PORT))
-            sock.settimeout(5)
-            while not self._exit.isSet():
-                try:
-                    data, server = sock.recvfrom(1024)
-                    message = SOODMessage(data).as_dictionary
-
-                    host = server[0]
-                    port = message["properties"]["http_port"]
-                    unique_id = message["properties"]["unique_id"]
-                    LOGGER.debug("Discovered %s", message)
-
-                    if self._core_id is not None and self._core_id != unique_id:
+        """Query from all interfaces at once and collect the answers, one per core."""
+        msg, tid = soodmessage.query()
+        sockets = self._query_sockets(msg)
+        found = {}
+        deadline = time.monotonic() + self._timeout
+        try:
+            while sockets and not self._exit.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    LOGGER.debug("Timeout")
+                    break
+                readable, _, _ = select.select(sockets, [], [], min(remaining, 0.5))
+                for sock in readable:
+                    try:
+                        data, server = sock.recvfrom(1024)
+                    except OSError:
+                        continue
+                    core = core_from_response(data, server, {tid})
+                    if core is None or core.unique_id in found:
+                        continue
+                    if self._core_id is not None and self._core_id != core.unique_id:
                         LOGGER.debug(
                             "Ignoring server with id %s, because we're looking for %s",
-                            unique_id,
+                            core.unique_id,
                             self._core_id,
                         )
                         continue
+                    LOGGER.debug("Discovered %s", core)
+                    found[core.unique_id] = core
+                    if first_only or self._core_id is not None:
+                        # we're only interested in the first (or the wanted) server
+                        return [core.address]
+                    if self._settle is not None:
+                        deadline = min(deadline, time.monotonic() + self._settle)
+        finally:
+            for sock in sockets:
+                sock.close()
+        return [core.address for core in found.values()]
 
-                    entries.append((host, port))
-                    if first_only:
-                        # we're only interested in the first server found
-                        break
-                except socket.timeout:
-                    LOGGER.debug("Timeout")
-                    break
-                except FormatException as format_exception:
-                    LOGGER.error("Format exception %s", format_exception.message)
-                    break
-        return entries
+    @staticmethod
+    def _query_sockets(msg):
+        """Send the query from every interface, returns the sockets to read the answers from."""
+        sockets = []
+        for address, broadcast in interfaces() or [("0.0.0.0", "<broadcast>")]:
+            sock = _query_socket(address)
+            if sock is None:
+                continue
+            sent = False
+            for destination in (SOOD_MULTICAST_IP, broadcast):
+                try:
+                    sock.sendto(msg, (destination, SOOD_PORT))
+                    sent = True
+                except OSError as exc:
+                    LOGGER.debug(
+                        "Could not send SOOD query to %s: %s", destination, exc
+                    )
+            if sent:
+                sockets.append(sock)
+            else:
+                sock.close()
+        return sockets
+
+
+class SOODDiscoveryProtocol(asyncio.DatagramProtocol):
+    """Protocol to receive the answers to SOOD queries with asyncio."""
+
+    def __init__(self, on_core, tids=None):
+        """
+        Create the protocol.
+
+        on_core: function called with each RoonCore that answers
+        tids: optional transaction ids of the queries sent, to ignore answers to other queries
+        """
+        self._on_core = on_core
+        self._tids = tids
+
+    def datagram_received(self, data, addr):
+        """Pass the core that sent an answer on."""
+        core = core_from_response(data, addr, self._tids)
+        if core is not None:
+            self._on_core(core)
+
+    def error_received(self, exc):
+        """Log errors, answers can still arrive on the other interfaces."""
+        LOGGER.debug("SOOD query failed: %s", exc)
+
+
+async def discover_async(core_id=None, timeout=5):
+    """
+    Query all interfaces and yield the cores as they answer, each once.
+
+    Use with async for, stop iterating or cancel the task to stop waiting. The
+    sockets are closed when the iteration ends.
+
+    params:
+        core_id: only look for the core with this unique_id, stop when it answers
+        timeout: seconds to wait for answers
+    """
+    loop = asyncio.get_running_loop()
+    cores = asyncio.Queue()
+    transports = []
+    msg, tid = soodmessage.query()
+    try:
+        for address, broadcast in interfaces() or [("0.0.0.0", "<broadcast>")]:
+            sock = _query_socket(address)
+            if sock is None:
+                continue
+            sock.setblocking(False)
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: SOODDiscoveryProtocol(cores.put_nowait, {tid}), sock=sock
+            )
+            transports.append(transport)
+            for destination in (SOOD_MULTICAST_IP, broadcast):
+                transport.sendto(msg, (destination, SOOD_PORT))
+
+        deadline = loop.time() + timeout
+        seen = set()
+        while transports:
+            try:
+                core = await asyncio.wait_for(cores.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                LOGGER.debug("Timeout")
+                return
+            if core.unique_id in seen:
+                continue
+            if core_id is not None and core_id != core.unique_id:
+                continue
+            seen.add(core.unique_id)
+            LOGGER.debug("Discovered %s", core)
+            yield core
+            if core_id is not None:
+                return
+    finally:
+        for transport in transports:
+            transport.close()
@@ -0,0 +1,504 @@
+"""
+Module defining a client to fetch images from the roon core.
+
+Images are fetched over a pooled http session and cached in memory and,
+optionally, on disk, so the same album art is only downloaded once. The cache
+can be shared with other devices through a small http proxy.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .constants import LOGGER
+
+
+class CachedImage:  # pylint: disable=too-few-public-methods
+    """Class to hold the data of a fetched image and what is needed to revalidate it."""
+
+    __slots__ = ("data", "content_type", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, data, content_type, etag=None, last_modified=None):
+        """Create a cache entry for an image fetched now."""
+        self.data = data
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.time()
+
+
+class ImageClient:  # pylint: disable=too-many-instance-attributes
+    """Class to fetch images from the roon core with caching."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        roonapi,
+        cache_dir=None,
+        memory_size=32 * 1024 * 1024,
+        disk_size=256 * 1024 * 1024,
+        max_age=24 * 3600,
+        max_workers=4,
+        timeout=10,
+    ):
+        """
+        Create the image client.
+
+        roonapi: the RoonApi to build image urls with
+        cache_dir: directory to cache images on disk, images are only cached in memory if not set
+        memory_size: the number of bytes of images to keep in memory
+        disk_size: the number of bytes of images to keep in cache_dir, the least recently
+                   used images are removed first
+        max_age: seconds after which a cached image is revalidated with the core
+        max_workers: the number of images fetched at the same time
+        timeout: seconds to wait for the core to respond
+        """
+        self._roonapi = roonapi
+        self._cache_dir = cache_dir
+        self._memory_size = memory_size
+        self._max_age = max_age
+        self._timeout = timeout
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_size = disk_size
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        self._in_flight = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0}
+        self._lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers)
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan_disk()
+
+    def get(self, image_key, scale="fit", width=500, height=500):
+        """
+        Get the data of an image.
+
+        params: as for RoonApi.get_image
+        returns: the image as bytes, or None if it could not be fetched
+        """
+        image = self.get_image(image_key, scale, width, height)
+        return image.data if image is not None else None
+
+    def get_image(self, image_key, scale="fit", width=500, height=500):
+        """
+        Get an image with its content type.
+
+        returns: a CachedImage, or None if it could not be fetched
+        """
+        key = (image_key, scale, width, height)
+        cached = self._from_memory(key)
+        if cached is None:
+            cached = self._from_disk(key)
+            if cached is not None:
+                self._to_memory(key, cached)
+        if cached is not None and time.time() - cached.fetched_at < self._max_age:
+            with self._lock:
+                self._stats["hits"] += 1
+            return cached
+        return self._fetch_once(key, cached)
+
+    def fetch(self, image_key, scale="fit", width=500, height=500):
+        """Get an image in the background, returns a Future of the image data."""
+        return self._executor.submit(self.get, image_key, scale, width, height)
+
+    def fetch_many(self, image_keys, scale="fit", width=500, height=500):
+        """
+        Get several images at the same time.
+
+        returns: a dict of image key to image data (None for images that failed)
+        """
+        futures = {
+            image_key: self.fetch(image_key, scale, width, height)
+            for image_key in set(image_keys)
+        }
+        return {image_key: future.result() for image_key, future in futures.items()}
+
+    def is_cached(self, image_key, scale="fit", width=500, height=500):
+        """Return whether an image is in the memory or disk cache."""
+        key = (image_key, scale, width, height)
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self._cache_dir is not None and os.path.exists(self._disk_path(key))
+
+    @property
+    def stats(self):
+        """
+        Return the cache statistics.
+
+        returns: dict with the number of hits (served from the cache), misses (fetched
+        from the core) and coalesced (waited for a fetch of the same image) requests
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        """Stop fetching and close the http connections."""
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def _fetch_once(self, key, cached):
+        """Fetch an image, callers that want the same image meanwhile wait for this fetch."""
+        with self._lock:
+            pending = self._in_flight.get(key)
+            if pending is None:
+                future = self._in_flight[key] = Future()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        if pending is not None:
+            return pending.result()
+        image = None
+        try:
+            image = self._fetch(key, cached)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_result(image)
+        return image
+
+    def _fetch(self, key, cached):
+        """Fetch an image from the core, revalidating the cached copy if there is one."""
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        try:
+            response = self._session.get(
+                self._roonapi.get_image(*key), headers=headers, timeout=self._timeout
+            )
+        except requests.RequestException as exc:
+            LOGGER.warning("Could not fetch image %s: %s", key[0], exc)
+            return cached
+
+        if response.status_code == 304 and cached is not None:
+            cached.fetched_at = time.time()
+            self._to_disk(key, cached, metadata_only=True)
+            return cached
+        if response.status_code != 200:
+            LOGGER.warning(
+                "Could not fetch image %s: status %s", key[0], response.status_code
+            )
+            return cached
+
+        image = CachedImage(
+            response.content,
+            response.headers.get("Content-Type"),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        self._to_memory(key, image)
+        self._to_disk(key, image)
+        return image
+
+    def _from_memory(self, key):
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+            return image
+
+    def _to_memory(self, key, image):
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= len(previous.data)
+            self._memory[key] = image
+            self._memory_used += len(image.data)
+            while self._memory_used > self._memory_size and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted.data)
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self._cache_dir, name)
+
+    def _from_disk(self, key):
+        if self._cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path + ".json", encoding="utf-8") as metadata_file:
+                metadata = json.load(metadata_file)
+            with open(path, "rb") as data_file:
+                data = data_file.read()
+        except (OSError, ValueError):
+            return None
+        image = CachedImage(
+            data,
+            metadata.get("content_type"),
+            metadata.get("etag"),
+            metadata.get("last_modified"),
+        )
+        image.fetched_at = metadata.get("fetched_at", 0)
+        with self._lock:
+            if path in self._disk:
+                self._disk.move_to_end(path)
+        try:
+            # The modification time keeps the order of use for the next client
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def _to_disk(self, key, image, metadata_only=False):
+        if self._cache_dir is None:
+            return
+        path = self._disk_path(key)
+        metadata = {
+            "content_type": image.content_type,
+            "etag": image.etag,
+            "last_modified": image.last_modified,
+            "fetched_at": image.fetched_at,
+        }
+        try:
+            if not metadata_only:
+                self._write(path, image.data)
+            self._write(path + ".json", json.dumps(metadata).encode())
+        except OSError as exc:
+            LOGGER.warning("Could not cache image %s: %s", key[0], exc)
+            return
+        if not metadata_only:
+            self._disk_added(path, len(image.data))
+
+    def _scan_disk(self):
+        """Find the images cached on disk before, least recently used first."""
+        files = []
+        for entry in os.scandir(self._cache_dir):
+            if entry.is_file() and "." not in entry.name:
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._disk[path] = size
+            self._disk_used += size
+        self._disk_added(None, 0)
+
+    def _disk_added(self, path, size):
+        """Account for an image written to disk, remove the least recently used over disk_size."""
+        evicted = []
+        with self._lock:
+            if path is not None:
+                self._disk_used += size - self._disk.pop(path, 0)
+                self._disk[path] = size
+            while self._disk_used > self._disk_size and len(self._disk) > 1:
+                evicted_path, evicted_size = self._disk.popitem(last=False)
+                self._disk_used -= evicted_size
+                evicted.append(evicted_path)
+        for evicted_path in evicted:
+            for name in (evicted_path, evicted_path + ".json"):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _write(path, data):
+        """Write a file so readers never see it half written."""
+        temp_path = "%s.%s.tmp" % (path, threading.get_ident())
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+
+class ImageProxy(threading.Thread):
+    """Class to serve images from the cache of an ImageClient over http."""
+
+    def __init__(self, image_client, host="0.0.0.0", port=0):
+        """
+        Create the proxy, call start to begin serving.
+
+        The proxy serves the same urls as the core, eg
+        http://host:port/api/image/<image_key>?scale=fit&width=500&height=500,
+        so devices can use it in place of the core.
+
+        image_client: the ImageClient to get the images from
+        host: the address to listen on
+        port: the port to listen on, a free port is chosen if not set
+        """
+        self._server = ThreadingHTTPServer((host, port), _ImageRequestHandler)
+        self._server.daemon_threads = True
+        self._server.image_client = image_client
+        self._server.stats = {"requests": 0, "not_found": 0}
+        self._server.lock = threading.Lock()
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    @property
+    def port(self):
+        """Return the port the proxy listens on."""
+        return self._server.server_address[1]
+
+    @property
+    def stats(self):
+        """Return the request counts of the proxy and the cache statistics of its client."""
+        with self._server.lock:
+            stats = dict(self._server.stats)
+        stats.update(self._server.image_client.stats)
+        return stats
+
+    def run(self):
+        """Serve requests until stopped."""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _ImageRequestHandler(BaseHTTPRequestHandler):
+    """Handler for image requests to the ImageProxy."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve an image from the cache, fetching it from the core if needed."""
+        url = urlsplit(self.path)
+        parts = url.path.split("/")
+        query = parse_qs(url.query)
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+        if len(parts) != 4 or parts[:3] != ["", "api", "image"] or not parts[3]:
+            self._not_found()
+            return
+        try:
+            image = self.server.image_client.get_image(
+                parts[3],
+                query.get("scale", ["fit"])[0],
+                int(query.get("width", [500])[0]),
+                int(query.get("height", [500])[0]),
+            )
+        except ValueError:
+            self.send_error(400)
+            return
+        if image is None:
+            self._not_found()
+            return
+        if image.etag and self.headers.get("If-None-Match") == image.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", image.content_type or "image/jpeg")
+        self.send_header("Content-Length", str(len(image.data)))
+        if image.etag:
+            self.send_header("ETag", image.etag)
+        self.end_headers()
+        self.wfile.write(image.data)
+
+    def _not_found(self):
+        with self.server.lock:
+            self.server.stats["not_found"] += 1
+        self.send_error(404)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests at debug level rather than to stderr."""
+        LOGGER.debug("Image proxy: " + format, *args)
+
+
+class ImagePrefetcher:
+    """Class to warm the image cache with the art of the playing and upcoming tracks."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, roonapi, image_client, sizes=None, queue_items=3, max_concurrent=2
+    ):
+        """
+        Create the prefetcher, call start to begin watching the zones.
+
+        roonapi: the RoonApi whose zones and queues to watch
+        image_client: the ImageClient whose cache to warm
+        sizes: list of (scale, width, height) to fetch each image in, default [("fit", 500, 500)]
+        queue_items: the number of upcoming queue items to fetch art for
+        max_concurrent: the number of images fetched at the same time
+        """
+        self._roonapi = roonapi
+        self._image_client = image_client
+        self._sizes = sizes or [("fit", 500, 500)]
+        self._queue_items = queue_items
+        self._executor = ThreadPoolExecutor(max_concurrent)
+        self._pending = set()
+        self._queue_zones = set()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        """Start prefetching for all zones, and zones that are added later."""
+        self._running = True
+        self._roonapi.register_state_callback(self._on_zones_changed, "zones_changed")
+        self._on_zones_changed("zones_changed", list(self._roonapi.zones))
+
+    def stop(self):
+        """Stop prefetching, and end the zone and queue subscriptions."""
+        self._running = False
+        self._roonapi.unregister_state_callback(self._on_zones_changed)
+        with self._lock:
+            zone_ids = list(self._queue_zones)
+            self._queue_zones.clear()
+        for zone_id in zone_ids:
+            self._roonapi.unsubscribe_queue(zone_id, self._on_queue_changed)
+        self._executor.shutdown(wait=False)
+
+    def prefetch(self, image_key):
+        """Fetch an image in all sizes in the background, unless it is cached."""
+        if not image_key or not self._running:
+            return
+        for scale, width, height in self._sizes:
+            key = (image_key, scale, width, height)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            if self._image_client.is_cached(*key):
+                self._done(key)
+                continue
+            LOGGER.debug("Prefetching image %s", image_key)
+            self._executor.submit(self._fetch, key)
+
+    def _fetch(self, key):
+        try:
+            self._image_client.get(*key)
+        finally:
+            self._done(key)
+
+    def _done(self, key):
+        with self._lock:
+            self._pending.discard(key)
+
+    def _on_zones_changed(self, _event, changed_ids):
+        if not self._running:
+            return
+        for zone_id in changed_ids:
+            zone = self._roonapi.zones.get(zone_id)
+            if zone is None:
+                continue
+            self.prefetch(zone.get("now_playing", {}).get("image_key"))
+            with self._lock:
+                if zone_id in self._queue_zones or not self._running:
+                    continue
+                self._queue_zones.add(zone_id)
+            # Only the first queue items are prefetched, so don't load the rest
+            self._roonapi.subscribe_queue(
+                zone_id, self._on_queue_changed, max_item_count=self._queue_items
+            )
+
+    def _on_queue_changed(self, queue, _operations):
+        if not self._running:
+            return
+        for item in queue.items(0, self._queue_items):
+            self.prefetch(item.get("image_key"))
@@ -0,0 +1,353 @@
+"""
+Module defining a local, searchable index of the Roon library.
+
+The index is filled by a crawler thread that walks the browse hierarchy in the
+background, so media can be found by a (partial) title without paging through
+the browse service at the time of the request.
+"""
+
+import difflib
+import json
+import sqlite3
+import threading
+import time
+
+from .constants import LOGGER, PAGE_SIZE
+
+DEFAULT_SECTIONS = {
+    "Artists": (["Library", "Artists"], 1),
+    "Albums": (["Library", "Albums"], 1),
+    "Genres": (["Genres"], 2),
+    "Playlists": (["Playlists"], 1),
+    "Internet Radio": (["My Live Radio"], 1),
+}
+
+_COLUMNS = (
+    "section",
+    "path",
+    "title",
+    "subtitle",
+    "hint",
+    "image_key",
+    "item_key",
+    "position",
+)
+
+
+class LibraryIndex:
+    """Class to store browse items and search them by title."""
+
+    def __init__(self, database=":memory:"):
+        """
+        Open (or create) the index.
+
+        database: the sqlite file to store the index in, by default the index is kept in memory
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        # Titles are not unique within a level (eg albums of different artists),
+        # so items are stored by the position in their level
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "id INTEGER PRIMARY KEY, section TEXT, parent TEXT, position INTEGER, "
+            "path TEXT, title TEXT, sort_title TEXT, subtitle TEXT, hint TEXT, "
+            "image_key TEXT, item_key TEXT, generation INTEGER, "
+            "UNIQUE (section, parent, position))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS items_sort_title ON items (sort_title)"
+        )
+        self._fts = self._create_fts()
+        self._db.commit()
+
+    def _create_fts(self):
+        """Create the full text index if this sqlite build supports FTS5."""
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+                "title, subtitle, content='items', content_rowid='id')"
+            )
+        except sqlite3.OperationalError:
+            LOGGER.info("sqlite has no FTS5 support, library search will be slower")
+            return False
+        self._db.executescript(
+            """
+            CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+                INSERT INTO items_fts (rowid, title, subtitle)
+                VALUES (new.id, new.title, new.subtitle);
+            END;
+            CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+                INSERT INTO items_fts (items_fts, rowid, title, subtitle)
+                VALUES ('delete', old.id, old.title, old.subtitle);
+            END;
+            CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE OF title, subtitle ON items BEGIN
+                INSERT INTO items_fts (items_fts, rowid, title, subtitle)
+                VALUES ('delete', old.id, old.title, old.subtitle);
+                INSERT INTO items_fts (rowid, title, subtitle)
+                VALUES (new.id, new.title, new.subtitle);
+            END;
+            """
+        )
+        return True
+
+    def __len__(self):
+        """Return the number of indexed items."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
+
+    # pylint: disable=too-many-arguments
+    def update(self, section, path, items, generation=0, offset=0):
+        """
+        Add or update the items of one browse level.
+
+        params:
+            section: the name of the crawled section the items belong to
+            path: the list of titles leading to the level the items were loaded from
+            items: the browse item dicts of the level
+            generation: the crawl pass the items were seen in (used by prune)
+            offset: the position of the first of items in the level
+        """
+        parent = json.dumps(list(path))
+        with self._lock, self._db:
+            for position, item in enumerate(items, offset):
+                values = (
+                    json.dumps(list(path) + [item["title"]]),
+                    item["title"],
+                    item["title"].casefold(),
+                    item.get("subtitle"),
+                    item.get("hint"),
+                    item.get("image_key"),
+                    item.get("item_key"),
+                    generation,
+                    section,
+                    parent,
+                    position,
+                )
+                updated = self._db.execute(
+                    "UPDATE items SET path = ?, title = ?, sort_title = ?, "
+                    "subtitle = ?, hint = ?, image_key = ?, item_key = ?, "
+                    "generation = ? WHERE section = ? AND parent = ? AND position = ?",
+                    values,
+                )
+                if not updated.rowcount:
+                    self._db.execute(
+                        "INSERT INTO items (path, title, sort_title, subtitle, "
+                        "hint, image_key, item_key, generation, section, parent, "
+                        "position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        values,
+                    )
+
+    def prune(self, section, generation):
+        """Remove the items of a section that were not seen since the given crawl pass."""
+        with self._lock, self._db:
+            removed = self._db.execute(
+                "DELETE FROM items WHERE section = ? AND generation < ?",
+                (section, generation),
+            )
+        return removed.rowcount
+
+    def search(self, text, limit=20, section=None):
+        """
+        Search the index for items by title or subtitle.
+
+        Every word of text is matched as a prefix, if nothing matches the titles
+        closest to text are returned instead.
+
+        params:
+            text: the text to search for, eg "neil yo"
+            limit: the maximum number of results
+            section: optionally only search this section, eg "Artists"
+        returns: a list of dicts with section, path, title, subtitle, hint, image_key, item_key
+                 and position (in the level of the item)
+        """
+        words = text.split()
+        if not words:
+            return []
+        with self._lock:
+            rows = self._search_words(words, limit, section)
+            if not rows:
+                rows = self._search_close(text, limit, section)
+        return [self._entry(row) for row in rows]
+
+    def _search_words(self, words, limit, section):
+        select = (
+            "SELECT items.section, items.path, items.title, items.subtitle, "
+            "items.hint, items.image_key, items.item_key, items.position FROM items"
+        )
+        params = []
+        if self._fts:
+            query = " ".join('"%s"*' % word.replace('"', '""') for word in words)
+            sql = (
+                select
+                + " JOIN items_fts ON items_fts.rowid = items.id WHERE items_fts MATCH ?"
+            )
+            params.append(query)
+        else:
+            sql = (
+                select
+                + " WHERE "
+                + " AND ".join("(sort_title LIKE ? OR subtitle LIKE ?)" for _ in words)
+            )
+            for word in words:
+                params.extend(["%" + word + "%"] * 2)
+        if section is not None:
+            sql += " AND items.section = ?"
+            params.append(section)
+        sql += " ORDER BY %s LIMIT ?" % (
+            "bm25(items_fts)" if self._fts else "sort_title"
+        )
+        params.append(limit)
+        return self._db.execute(sql, params).fetchall()
+
+    def _search_close(self, text, limit, section):
+        """Rank titles starting with the same letter by similarity to text."""
+        text = text.strip().casefold()
+        sql = (
+            "SELECT section, path, title, subtitle, hint, image_key, item_key, position, "
+            "sort_title "
+            "FROM items WHERE sort_title >= ? AND sort_title < ?"
+        )
+        params = [text[0], chr(ord(text[0]) + 1)]
+        if section is not None:
+            sql += " AND section = ?"
+            params.append(section)
+        matcher = difflib.SequenceMatcher(b=text)
+        scored = []
+        for row in self._db.execute(sql, params):
+            matcher.set_seq1(row[8])
+            if matcher.real_quick_ratio() >= 0.6 and matcher.ratio() >= 0.6:
+                scored.append((matcher.ratio(), row[:8]))
+        scored.sort(key=lambda score: -score[0])
+        return [row for _, row in scored[:limit]]
+
+    @staticmethod
+    def _entry(row):
+        entry = dict(zip(_COLUMNS, row))
+        entry["path"] = json.loads(entry["path"])
+        return entry
+
+
+class LibraryCrawler(threading.Thread):
+    """Class to crawl the browse hierarchy in the background and keep an index up to date."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        roonapi,
+        zone_or_output_id,
+        index=None,
+        sections=None,
+        delay=0.5,
+        interval=3600,
+    ):
+        """
+        Crawl the library of the roon core into an index.
+
+        roonapi: the RoonApi to browse with
+        zone_or_output_id: the zone or output to browse for
+        index: the LibraryIndex to fill, an in memory index is created if not set
+        sections: dict of section name to (path, depth) to crawl, eg {"Artists": (["Library", "Artists"], 1)}
+        delay: seconds to wait after each page load of PAGE_SIZE items, to limit the load
+               on the core
+        interval: seconds between crawl passes
+        """
+        self._roonapi = roonapi
+        self._zone_or_output_id = zone_or_output_id
+        self._index = index if index is not None else LibraryIndex()
+        self._sections = sections if sections is not None else DEFAULT_SECTIONS
+        self._delay = delay
+        self._interval = interval
+        self._exit = threading.Event()
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    @property
+    def index(self):
+        """Return the index the crawler fills."""
+        return self._index
+
+    def run(self):
+        """Crawl every interval until stopped."""
+        while not self._exit.is_set():
+            generation = int(time.time())
+            for section, (path, depth) in self._sections.items():
+                try:
+                    complete = self._crawl(section, list(path), depth, generation)
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Error while crawling %s", section)
+                    complete = False
+                if complete:
+                    removed = self._index.prune(section, generation)
+                    LOGGER.debug("Crawled %s, removed %s items", section, removed)
+                if self._exit.is_set():
+                    return
+            self._exit.wait(self._interval)
+
+    def stop(self):
+        """Stop crawling."""
+        self._exit.set()
+
+    def resolve(self, entry, multi_session_key):
+        """
+        Get an item key for an index entry that play_id can act on.
+
+        Item keys are only valid for the browse level and session they were loaded in,
+        so this browses to the level of the entry to get a fresh key. The item at the
+        indexed position is used if it still has the title and subtitle of the entry,
+        else the first item that has them. Pass the same multi_session_key to play_id, eg
+
+            with roonapi.browse_session() as session_key:
+                item_key = crawler.resolve(entry, session_key)
+                roonapi.play_id(zone_id, item_key, session_key)
+        """
+        found = None
+        for position, item in enumerate(
+            self._roonapi.browse_items(
+                self._zone_or_output_id, entry["path"][:-1], None, multi_session_key
+            )
+        ):
+            if item["title"] != entry["title"] or item.get("subtitle") != entry.get(
+                "subtitle"
+            ):
+                continue
+            if position == entry.get("position"):
+                return item["item_key"]
+            if found is None:
+                found = item["item_key"]
+            if entry.get("position") is None or position > entry["position"]:
+                break
+        return found
+
+    def _crawl(self, section, path, depth, generation):
+        """Index a level and the levels below it, return whether it was crawled completely."""
+        items = []
+        page = []
+        # Pages of a fixed size, so the delay follows every page load
+        for item in self._roonapi.browse_items(
+            self._zone_or_output_id, path, compact=True, page_size=PAGE_SIZE
+        ):
+            items.append(item)
+            page.append(item)
+            if len(page) == PAGE_SIZE:
+                self._index.update(
+                    section, path, page, generation, len(items) - len(page)
+                )
+                page = []
+                if self._exit.wait(self._delay):
+                    return False
+        if page:
+            self._index.update(section, path, page, generation, len(items) - len(page))
+            if self._exit.wait(self._delay):
+                return False
+        if depth > 1:
+            for item in items:
+                if item.get("hint") == "list" and not self._crawl(
+                    section, path + [item["title"]], depth - 1, generation
+                ):
+                    return False
+        return True
@@ -0,0 +1,148 @@
+"""
+Module defining the bookkeeping for optimistic updates of zones and outputs.
+
+With optimistic updates a command changes the local zone or output state at
+once, to what the core is expected to report. The replaced values are kept
+until the command succeeds or the core sends the changed keys, so they can be
+restored if the command fails. Values that are not settled are forgotten
+after max_age, eg when a command is never sent.
+"""
+
+import threading
+import time
+
+_MISSING = object()
+
+
+class _Change:  # pylint: disable=too-few-public-methods
+    """A value written to the local state that the core has not confirmed yet."""
+
+    __slots__ = ("kind", "state", "obj_id", "path", "previous", "applied_at")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, kind, state, obj_id, path, previous, applied_at):
+        self.kind = kind
+        self.state = state
+        self.obj_id = obj_id
+        self.path = path
+        self.previous = previous
+        self.applied_at = applied_at
+
+
+def _parent(obj, path):
+    """Return the dict (or list) holding the last key of path, or None if it is missing."""
+    for key in path[:-1]:
+        try:
+            obj = obj[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return obj if isinstance(obj, (dict, list)) else None
+
+
+def _get_path(obj, path, default=None):
+    """Return the value at a key path in nested dicts and lists."""
+    parent = _parent(obj, path)
+    try:
+        return parent[path[-1]]
+    except (KeyError, IndexError, TypeError):
+        return default
+
+
+class OptimisticState:
+    """Class to track changes applied to local state before the core confirms them."""
+
+    def __init__(self, max_age=30, clock=time.monotonic):
+        """
+        Create the tracker without pending changes.
+
+        max_age: seconds after which a change that is not settled is forgotten
+        clock: function returning the time in seconds
+        """
+        self._max_age = max_age
+        self._clock = clock
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Return the number of changes waiting for the core."""
+        return len(self._pending)
+
+    def apply(self, kind, state, obj_id, changes):
+        """
+        Apply changes to a zone or output and remember the values they replace.
+
+        params:
+            kind: "zones" or "outputs"
+            state: the dict of zones or outputs
+            obj_id: the id of the zone or output in state
+            changes: dict of key path tuple to new value, eg {("settings", "shuffle"): True}
+        returns: list of the applied changes, to pass to rollback
+        """
+        applied = []
+        with self._lock:
+            now = self._clock()
+            self._pending = [
+                change
+                for change in self._pending
+                if now - change.applied_at <= self._max_age
+            ]
+            obj = state.get(obj_id)
+            for path, value in changes.items():
+                parent = _parent(obj, path)
+                if parent is None:
+                    continue
+                previous = _get_path(obj, path, _MISSING)
+                if previous is _MISSING and isinstance(parent, list):
+                    continue
+                parent[path[-1]] = value
+                change = _Change(kind, state, obj_id, path, previous, now)
+                applied.append(change)
+                self._pending.append(change)
+        return applied
+
+    def confirm(self, kind, obj_id, keys):
+        """Forget the pending changes to keys of a zone or output the core sent values for."""
+        with self._lock:
+            self._pending = [
+                change
+                for change in self._pending
+                if not (
+                    change.kind == kind
+                    and change.obj_id == obj_id
+                    and change.path[0] in keys
+                )
+            ]
+
+    def forget(self, applied):
+        """Forget changes of a command that succeeded, they will not be rolled back."""
+        with self._lock:
+            self._pending = [
+                pending
+                for pending in self._pending
+                if not any(pending is change for change in applied)
+            ]
+
+    def rollback(self, applied):
+        """
+        Restore the values replaced by changes the core has not confirmed.
+
+        returns: set of (kind, id) of the zones and outputs that were restored
+        """
+        restored = set()
+        with self._lock:
+            for change in reversed(applied):
+                if not any(pending is change for pending in self._pending):
+                    continue
+                self._pending = [
+                    pending for pending in self._pending if pending is not change
+                ]
+                parent = _parent(change.state.get(change.obj_id), change.path)
+                if parent is None:
+                    continue
+                if change.previous is _MISSING:
+                    parent.pop(change.path[-1], None)
+                else:
+                    parent[change.path[-1]] = change.previous
+                restored.add((change.kind, change.obj_id))
+        return restored
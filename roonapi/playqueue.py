@@ -0,0 +1,234 @@
+"""
+Module defining a local model of the play queue of a zone.
+
+The queue subscription sends the whole queue once and after that only the
+changes to it, as insert and remove operations at an index. The model applies
+these to a list of chunks, so a change in the middle of a long queue only
+moves the items of one chunk. For long queues the subscription can be limited
+to a window of the first items.
+"""
+
+import threading
+
+from .constants import LOGGER
+
+CHUNK_SIZE = 128
+
+
+class ChunkedList:
+    """Class to hold a list as chunks, for fast inserts and removals at any index."""
+
+    def __init__(self, items=(), chunk_size=CHUNK_SIZE):
+        """Create the list with the given items."""
+        self._chunk_size = chunk_size
+        items = list(items)
+        self._chunks = [
+            items[start : start + chunk_size]
+            for start in range(0, len(items), chunk_size)
+        ]
+        self._length = len(items)
+
+    def __len__(self):
+        """Return the number of items."""
+        return self._length
+
+    def __iter__(self):
+        """Iterate over the items."""
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __getitem__(self, index):
+        """Return the item at an index, or a list of items for a slice."""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return list(self)[index]
+            return self.range(start, stop - start)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ChunkedList index out of range")
+        chunk_index, offset = self._locate(index)
+        return self._chunks[chunk_index][offset]
+
+    def range(self, start, count):
+        """Return a list of (at most) count items from index start."""
+        items = []
+        if start >= self._length or count <= 0:
+            return items
+        chunk_index, offset = self._locate(start)
+        for chunk in self._chunks[chunk_index:]:
+            items.extend(chunk[offset : offset + count - len(items)])
+            offset = 0
+            if len(items) >= count:
+                break
+        return items
+
+    def insert(self, index, items):
+        """Insert items before index."""
+        items = list(items)
+        if not items:
+            return
+        if not self._chunks:
+            self._chunks.append([])
+        chunk_index, offset = self._locate(max(0, min(index, self._length)))
+        chunk = self._chunks[chunk_index]
+        chunk[offset:offset] = items
+        self._length += len(items)
+        if len(chunk) > 2 * self._chunk_size:
+            self._chunks[chunk_index : chunk_index + 1] = [
+                chunk[start : start + self._chunk_size]
+                for start in range(0, len(chunk), self._chunk_size)
+            ]
+
+    def remove(self, index, count):
+        """Remove count items from index."""
+        while count > 0 and 0 <= index < self._length:
+            chunk_index, offset = self._locate(index)
+            chunk = self._chunks[chunk_index]
+            removed = min(count, len(chunk) - offset)
+            del chunk[offset : offset + removed]
+            self._length -= removed
+            count -= removed
+            if not chunk:
+                del self._chunks[chunk_index]
+            elif (
+                chunk_index + 1 < len(self._chunks)
+                and len(chunk) + len(self._chunks[chunk_index + 1]) <= self._chunk_size
+            ):
+                chunk.extend(self._chunks.pop(chunk_index + 1))
+
+    def _locate(self, index):
+        """Return the chunk and the offset in it of an index, the end for len(self)."""
+        for chunk_index, chunk in enumerate(self._chunks):
+            if index < len(chunk):
+                return chunk_index, index
+            index -= len(chunk)
+        return len(self._chunks) - 1, len(self._chunks[-1])
+
+
+class QueueModel:
+    """Class to hold the play queue of a zone, kept up to date by the queue subscription."""
+
+    def __init__(self, zone_or_output_id, max_item_count=None):
+        """
+        Create an empty queue for a zone or output.
+
+        zone_or_output_id: the id of the zone or output
+        max_item_count: the number of items at the start of the queue to keep, all if not set
+        """
+        self.zone_or_output_id = zone_or_output_id
+        self.max_item_count = max_item_count
+        self._items = ChunkedList()
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self._loaded = threading.Condition(self._lock)
+        self._resets = 0
+        self.loaded = False
+
+    @property
+    def resets(self):
+        """Return the number of times the whole queue was received."""
+        return self._resets
+
+    def wait_for_reset(self, resets, timeout=None):
+        """
+        Wait until the whole queue is received again, eg after changing the window.
+
+        params:
+            resets: the value of the resets property before the change
+            timeout: seconds to wait at most
+        returns: whether the queue was received
+        """
+        with self._loaded:
+            return self._loaded.wait_for(lambda: self._resets > resets, timeout)
+
+    def __len__(self):
+        """Return the number of items in the queue."""
+        return len(self._items)
+
+    def __getitem__(self, index):
+        """Return the queue item at an index, or a list of items for a slice."""
+        with self._lock:
+            return self._items[index]
+
+    def items(self, start=0, count=None):
+        """
+        Get a range of the queue.
+
+        params:
+            start: the index of the first item
+            count: the maximum number of items, all items from start if not set
+        returns: a list of queue item dicts (with queue_item_id, image_key, one_line, ...)
+        """
+        with self._lock:
+            if count is None:
+                count = len(self._items)
+            return self._items.range(start, count)
+
+    def register_callback(self, callback, replay=False):
+        """
+        Be informed about changes to the queue.
+
+        callback: function called with the QueueModel and a list of the applied operations,
+                  dicts with "operation" ("reset", "insert" or "remove") and "index" and "items"
+                  or "count" as sent by roon
+        replay: if the queue is already loaded, call callback with a reset to the current items first
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+            if replay and self.loaded:
+                callback(self, [self._reset_operation(list(self._items))])
+
+    @property
+    def callbacks(self):
+        """Return the number of registered callbacks."""
+        return len(self._callbacks)
+
+    def unregister_callback(self, callback):
+        """Stop informing a callback about changes."""
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def apply(self, body):
+        """
+        Apply a message of the queue subscription.
+
+        returns: the list of applied operations
+        """
+        if not isinstance(body, dict):
+            return []
+        operations = []
+        # Callbacks are called with the lock held, so a callback that is registered
+        # with replay gets every change exactly once
+        with self._lock:
+            if "items" in body:
+                self._items = ChunkedList(body["items"])
+                self.loaded = True
+                self._resets += 1
+                self._loaded.notify_all()
+                operations.append(self._reset_operation(body["items"]))
+            for change in body.get("changes", []):
+                if change.get("operation") == "insert":
+                    self._items.insert(change["index"], change["items"])
+                elif change.get("operation") == "remove":
+                    self._items.remove(change["index"], change["count"])
+                else:
+                    LOGGER.warning("Unknown queue change %s", change)
+                    continue
+                operations.append(change)
+            if self.max_item_count is not None:
+                # Items pushed out of the window are not kept up to date
+                self._items.remove(
+                    self.max_item_count, len(self._items) - self.max_item_count
+                )
+            for callback in list(self._callbacks):
+                try:
+                    callback(self, operations)
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Error in queue callback")
+        return operations
+
+    @staticmethod
+    def _reset_operation(items):
+        return {"operation": "reset", "index": 0, "items": items}
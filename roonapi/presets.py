@@ -0,0 +1,208 @@
+"""
+Module defining a registry of presets: named browse paths that can be played quickly.
+
+Each preset keeps its own browse session parked at the level of its play action,
+so in the common case playing it takes a single browse call.
+"""
+
+import threading
+import time
+from collections import deque
+
+from .browse import BrowseCursor
+from .constants import LOGGER, PAGE_SIZE
+
+PRESET_SESSION_PREFIX = "pyroon-preset-"
+
+
+class Preset:  # pylint: disable=too-few-public-methods
+    """Class to hold a preset and the play action it resolved to."""
+
+    def __init__(self, name, path, action, cursor):
+        """Create a preset that still has to be resolved."""
+        self.name = name
+        self.path = list(path)
+        self.action = action
+        self.cursor = cursor
+        self.action_item = None
+        self.resolved_at = None
+        self.lock = threading.Lock()
+
+
+class PresetRegistry(threading.Thread):
+    """Class to resolve the play actions of presets in the background and play them."""
+
+    def __init__(self, roonapi, max_age=3600, delay=0.2):
+        """
+        Create the registry.
+
+        roonapi: the RoonApi to browse with
+        max_age: seconds after which a resolved preset is resolved again
+        delay: seconds to wait between resolving presets, to limit the load on the core
+        """
+        self._roonapi = roonapi
+        self._max_age = max_age
+        self._delay = delay
+        self._presets = {}
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._exit = False
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    @property
+    def names(self):
+        """Return the names of all presets."""
+        return list(self._presets)
+
+    def add(self, name, path, action=None):
+        """
+        Add (or replace) a preset, it is resolved in the background.
+
+        params:
+            name: the name to play the preset by
+            path: a list allowing roon to find the media, as for play_media
+            action: the roon action to take - leave blank to choose the roon default
+        """
+        cursor = BrowseCursor(self._roonapi, PRESET_SESSION_PREFIX + name)
+        with self._condition:
+            self._presets[name] = Preset(name, path, action, cursor)
+        self.invalidate(name)
+
+    def remove(self, name):
+        """Remove a preset."""
+        with self._condition:
+            self._presets.pop(name, None)
+            if name in self._pending:
+                self._pending.remove(name)
+
+    def invalidate(self, name=None):
+        """Resolve a preset again in the background, or all presets if name is not set."""
+        with self._condition:
+            names = [name] if name is not None else list(self._presets)
+            for preset_name in names:
+                preset = self._presets.get(preset_name)
+                if preset is None:
+                    continue
+                preset.action_item = None
+                if preset_name not in self._pending:
+                    self._pending.append(preset_name)
+            self._condition.notify()
+
+    def play(self, zone_or_output_id, name):
+        """
+        Play a preset.
+
+        The resolved play action is kept for the next time. It is only resolved
+        again when taking it fails, eg because the core no longer knows its level.
+
+        returns: True if the play action was taken, False if it failed and None for an unknown preset
+        """
+        preset = self._presets.get(name)
+        if preset is None:
+            LOGGER.error("Unknown preset '%s'", name)
+            return None
+        with preset.lock:
+            played = False
+            if preset.action_item is not None:
+                played = self._take_action(preset, zone_or_output_id)
+            if not played:
+                LOGGER.debug("Preset '%s' is not resolved, resolving now", name)
+                played = self._resolve(preset) and self._take_action(
+                    preset, zone_or_output_id
+                )
+        if not played:
+            # Try again in the background, so the next play is quick
+            self.invalidate(name)
+        return played
+
+    def run(self):
+        """Resolve invalidated and expired presets until stopped."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending or self._exit, self._max_age / 10
+                )
+                if self._exit:
+                    return
+                self._queue_expired()
+                name = self._pending.popleft() if self._pending else None
+                preset = self._presets.get(name)
+            if preset is None:
+                continue
+            with preset.lock:
+                if preset.action_item is None:
+                    self._resolve(preset)
+            time.sleep(self._delay)
+
+    def stop(self):
+        """Stop resolving presets."""
+        with self._condition:
+            self._exit = True
+            self._condition.notify()
+
+    def _queue_expired(self):
+        now = time.monotonic()
+        for preset in self._presets.values():
+            if (
+                preset.resolved_at is not None
+                and now - preset.resolved_at > self._max_age
+                and preset.name not in self._pending
+            ):
+                preset.action_item = None
+                self._pending.append(preset.name)
+
+    def _resolve(self, preset):
+        """Browse to the play action of a preset and keep the session there."""
+        preset.action_item = None
+        cursor = preset.cursor
+        if not preset.path or not cursor.navigate(None, preset.path[:-1], False):
+            LOGGER.error("Could not resolve preset '%s'", preset.name)
+            return False
+        found = cursor.find(None, preset.path[-1])
+        if found is None:
+            LOGGER.error("Could not find '%s' for preset", preset.path)
+            return False
+        if found.get("hint") != "action":
+            # Open the media, then its action list (eg Play Album)
+            cursor.browse_item(None, found)
+            items = list(cursor.items(None, PAGE_SIZE))
+            if items and items[0].get("hint") == "action_list":
+                cursor.browse_item(None, items[0])
+                items = list(cursor.items(None, PAGE_SIZE))
+            found = self._choose_action(preset, items)
+            if found is None:
+                return False
+        preset.action_item = found
+        preset.resolved_at = time.monotonic()
+        LOGGER.debug("Resolved preset '%s' to '%s'", preset.name, found["title"])
+        return True
+
+    @staticmethod
+    def _choose_action(preset, items):
+        actions = [item for item in items if item.get("hint") == "action"]
+        if preset.action is not None:
+            actions = [item for item in actions if item["title"] == preset.action]
+        if not actions:
+            LOGGER.error(
+                "Could not find play action '%s' for preset '%s' in %s",
+                preset.action,
+                preset.name,
+                [item["title"] for item in items],
+            )
+            return None
+        return actions[0]
+
+    def _take_action(self, preset, zone_or_output_id):
+        action_item = preset.action_item
+        result = self._roonapi.browse_browse(
+            preset.cursor.opts(zone_or_output_id, item_key=action_item["item_key"])
+        )
+        if not isinstance(result, dict) or (
+            result.get("action") == "message" and result.get("is_error")
+        ):
+            LOGGER.debug("Play action of preset '%s' failed: %s", preset.name, result)
+            preset.action_item = None
+            return False
+        LOGGER.info("Played preset '%s' with '%s'", preset.name, action_item["title"])
+        return True
@@ -3,15 +3,35 @@ from __future__ import unicode_literals
 import threading
 import time
 import csv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from .constants import (
     LOGGER,
     PAGE_SIZE,
     SERVICE_BROWSE,
+    SERVICE_IMAGE,
     SERVICE_REGISTRY,
     SERVICE_TRANSPORT,
+    CONTROL_SOURCE,
     CONTROL_VOLUME,
 )
+from .controls import ControlDispatcher, ControlUpdateBuffer
+from .browse import (
+    CONTEXT_MATCH,
+    EXACT_MATCH,
+    BrowseCursor,
+    BrowseItem,
+    BrowsePageSizer,
+    BrowseSessionPool,
+    rank_items,
+    search_terms,
+)
+from .images import ImageClient, ImagePrefetcher, ImageProxy
+from .playqueue import QueueModel
+from .optimistic import OptimisticState
+from .presets import PresetRegistry
+from .volume import VolumeCoalescer
 from .roonapisocket import RoonApiWebSocket
 
 
@@ -55,7 +75,18 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
     ready = False
 
     _volume_controls_request_id = None
-    _volume_controls = {}
+    _volume_control_updates = None
+    _volume_control_dispatcher = None
+    _source_controls_request_id = None
+    _source_control_updates = None
+    _source_control_dispatcher = None
+    _presets = None
+    _image_client = None
+    _image_prefetcher = None
+    _image_proxy = None
+    _volume_coalescer = None
+    # Set to apply the expected result of commands to zones and outputs right away
+    optimistic_updates = False
 
     @property
     def token(self):
@@ -77,6 +108,59 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         """Return the roon core name."""
         return self._core_name
 
+    @property
+    def image_client(self):
+        """Return the client to fetch (cached) images from the roon core."""
+        if self._image_client is None:
+            self._image_client = ImageClient(self)
+        return self._image_client
+
+    @image_client.setter
+    def image_client(self, image_client):
+        """Use an ImageClient with other settings, eg to cache images on disk."""
+        self._image_client = image_client
+
+    def enable_image_prefetch(self, sizes=None, queue_items=3, max_concurrent=2):
+        """
+        Fetch the art of the playing and upcoming tracks into the image cache in advance.
+
+        params:
+            sizes: list of (scale, width, height) to fetch each image in, default [("fit", 500, 500)]
+            queue_items: the number of upcoming queue items per zone to fetch art for
+            max_concurrent: the number of images fetched at the same time
+        """
+        self.disable_image_prefetch()
+        self._image_prefetcher = ImagePrefetcher(
+            self, self.image_client, sizes, queue_items, max_concurrent
+        )
+        self._image_prefetcher.start()
+
+    def disable_image_prefetch(self):
+        """Stop fetching art in advance."""
+        if self._image_prefetcher is not None:
+            self._image_prefetcher.stop()
+            self._image_prefetcher = None
+
+    def start_image_proxy(self, host="0.0.0.0", port=0):
+        """
+        Serve the image cache over http, so other devices need not each fetch images from the core.
+
+        params:
+            host: the address to listen on
+            port: the port to listen on, a free port is chosen if not set
+        returns: the ImageProxy, its port and stats properties give the port and the cache statistics
+        """
+        self.stop_image_proxy()
+        self._image_proxy = ImageProxy(self.image_client, host, port)
+        self._image_proxy.start()
+        return self._image_proxy
+
+    def stop_image_proxy(self):
+        """Stop serving the image cache."""
+        if self._image_proxy is not None:
+            self._image_proxy.stop()
+            self._image_proxy = None
+
     @property
     def zones(self):
         """Return All zones as a dict."""
@@ -194,6 +278,32 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             height,
         )
 
+    # pylint: disable=too-many-arguments
+    def get_image_bytes(
+        self, image_key, scale="fit", width=500, height=500, image_format=None
+    ):
+        """
+        Get an image over the roon connection, without a separate http request.
+
+        params:
+            image_key: the key for the image as retrieved in other api calls
+            scale: optional (value of fit, fill or stretch)
+            width: the width of the image (required if scale is specified)
+            height: the height of the image (required if scale is set)
+            image_format: optional (value of image/jpeg or image/png)
+        returns: tuple of content type and a memoryview of the image data, or None
+        """
+        data = {"image_key": image_key}
+        if scale:
+            data.update({"scale": scale, "width": width, "height": height})
+        if image_format:
+            data["format"] = image_format
+        result = self._request(SERVICE_IMAGE + "/get_image", data)
+        if not isinstance(result, tuple):
+            LOGGER.error("Could not get image %s: %s", image_key, result)
+            return None
+        return result
+
     def playback_control(self, zone_or_output_id, control="play"):
         """
         Send player command to the specified zone.
@@ -209,8 +319,17 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
                  * "previous" - Go to the start of the current track, or to the previous track
                  * "next" - Advance to the next track
         """
+        zone = self._zones.get(self._zone_id(zone_or_output_id), {})
+        state = {"play": "playing", "pause": "paused", "stop": "stopped"}.get(control)
+        if control == "playpause":
+            state = (
+                "paused" if zone.get("state") in ("playing", "loading") else "playing"
+            )
+        applied = self._optimistic_zone(zone_or_output_id, {("state",): state})
         data = {"zone_or_output_id": zone_or_output_id, "control": control}
-        return self._request(SERVICE_TRANSPORT + "/control", data)
+        return self._confirm_optimistic(
+            applied, self._request(SERVICE_TRANSPORT + "/control", data)
+        )
 
     def pause_all(self):
         """Pause all zones."""
@@ -250,11 +369,36 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             output_id: the id of the output that should be muted/unmuted
             mute: bool if the output should be muted. Will unmute if set to False
         """
+        applied = self._optimistic_output(output_id, {("volume", "is_muted"): mute})
         how = "mute" if mute else "unmute"
         data = {"output_id": output_id, "how": how}
-        return self._request(SERVICE_TRANSPORT + "/mute", data)
+        return self._confirm_optimistic(
+            applied, self._request(SERVICE_TRANSPORT + "/mute", data)
+        )
 
-    def set_volume_percent(self, output_id, absolute_value):
+    @property
+    def volume_coalescer(self):
+        """Return the VolumeCoalescer used for volume changes with coalesce set."""
+        if self._volume_coalescer is None:
+            self.configure_volume_coalescer()
+        return self._volume_coalescer
+
+    def configure_volume_coalescer(self, max_rate=10, max_workers=4):
+        """
+        Set how coalesced volume changes are sent, see VolumeCoalescer.
+
+        params:
+            max_rate: the maximum number of volume changes sent per second for an output
+            max_workers: the number of outputs sent to at the same time
+        """
+        if self._volume_coalescer is not None:
+            self._volume_coalescer.stop()
+        self._volume_coalescer = VolumeCoalescer(
+            self._send_coalesced_volume, max_rate, max_workers
+        )
+        self._volume_coalescer.start()
+
+    def set_volume_percent(self, output_id, absolute_value, coalesce=False):
         """
         Set the volume of an output to a 0-100 value.
 
@@ -263,6 +407,7 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
 
         params:
             output_id: the id of the output
+            coalesce: see change_volume_raw
         """
         volume_data = self._outputs[output_id].get("volume")
 
@@ -281,9 +426,9 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         if int(volume_step) == volume_step:
             percentage_volume = int(round(percentage_volume))
 
-        return self.change_volume_raw(output_id, percentage_volume)
+        return self.change_volume_raw(output_id, percentage_volume, coalesce=coalesce)
 
-    def change_volume_percent(self, output_id, relative_value):
+    def change_volume_percent(self, output_id, relative_value, coalesce=False):
         """
 
         Change the volume of an output by a relative amount.
@@ -294,6 +439,7 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         params:
             output_id: the id of the output
             relative_value: How much to increase or decrease the volume
+            coalesce: see change_volume_raw
         """
         volume_data = self._outputs[output_id].get("volume")
 
@@ -307,7 +453,9 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         volume_percentage_factor = volume_range / 100
 
         volume_percentage_change = int(round(relative_value * volume_percentage_factor))
-        return self.change_volume_raw(output_id, volume_percentage_change, "relative")
+        return self.change_volume_raw(
+            output_id, volume_percentage_change, "relative", coalesce
+        )
 
     def get_volume_percent(self, output_id):
         """
@@ -338,7 +486,7 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         percent_level = (raw_level - volume_min) / volume_percentage_factor
         return int(round(percent_level))
 
-    def change_volume_raw(self, output_id, value, method="absolute"):
+    def change_volume_raw(self, output_id, value, method="absolute", coalesce=False):
         """
         Change the volume of an output.
 
@@ -349,19 +497,91 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             output_id: the id of the output
             value: The new volume value, or the increment value or step
             method: How to interpret the volume ('absolute'|'relative'|'relative_step')
+            coalesce: return at once and send the change from the background, merged with
+                      other changes of the output that are still waiting (eg for a volume knob)
         """
         if "volume" not in self._outputs[output_id]:
             LOGGER.info("This endpoint has fixed volume.")
             return None
+        volume_data = self._outputs[output_id]["volume"]
+        applied = self._optimistic_output(
+            output_id,
+            {("volume", "value"): self._expected_volume(volume_data, value, method)},
+        )
+        if coalesce:
+            if method == "relative_step":
+                value, method = value * volume_data["step"], "relative"
+            self.volume_coalescer.change(output_id, value, method, volume_data, applied)
+            return None
         # Home assistant was catching this - so catch here
         # to try and diagnose what needs to be checked.
         try:
             data = {"output_id": output_id, "how": method, "value": value}
-            return self._request(SERVICE_TRANSPORT + "/change_volume", data)
+            return self._confirm_optimistic(
+                applied, self._request(SERVICE_TRANSPORT + "/change_volume", data)
+            )
         except Exception as exc:  # pylint: disable=broad-except
             LOGGER.error("set_volume_level failed for entity %s.", str(exc))
+            self._confirm_optimistic(applied, None)
             return None
 
+    def _send_coalesced_volume(self, output_id, value, method, applied):
+        """Send a change merged by the VolumeCoalescer, and settle its optimistic changes."""
+        data = {"output_id": output_id, "how": method, "value": value}
+        try:
+            result = self._request(SERVICE_TRANSPORT + "/change_volume", data)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Could not change the volume of %s", output_id)
+            result = None
+        return self._confirm_optimistic(applied, result)
+
+    def set_volumes(self, volumes, percent=True, max_workers=8):
+        """
+        Set the volume of several outputs at the same time.
+
+        params:
+            volumes: dict of output id to the new volume
+            percent: if the volumes are 0-100 values (scaled with the volume min, max and step
+                     of each output), otherwise they are raw values in the scale of the output
+            max_workers: the number of requests sent at the same time
+        returns: dict of output id to the result of the request as returned by the core
+                 (which may be an error reply), or None if sending it raised an exception
+        """
+        method = self.set_volume_percent if percent else self.change_volume_raw
+        return self._dispatch_outputs(method, volumes, max_workers)
+
+    def mute_outputs(self, mutes, max_workers=8):
+        """
+        Mute or unmute several outputs at the same time.
+
+        params:
+            mutes: dict of output id to True to mute or False to unmute the output,
+                   eg {output_id: output_id != kitchen_id for output_id in roonapi.outputs}
+            max_workers: the number of requests sent at the same time
+        returns: dict of output id to the result of the request as returned by the core
+                 (which may be an error reply), or None if sending it raised an exception
+        """
+        return self._dispatch_outputs(self.mute, mutes, max_workers)
+
+    @staticmethod
+    def _dispatch_outputs(method, targets, max_workers):
+        """Call method(output_id, target) for all targets concurrently, returns the results."""
+        if not targets:
+            return {}
+        results = {}
+        with ThreadPoolExecutor(min(max_workers, len(targets))) as executor:
+            futures = {
+                output_id: executor.submit(method, output_id, target)
+                for output_id, target in targets.items()
+            }
+            for output_id, future in futures.items():
+                try:
+                    results[output_id] = future.result()
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Could not change output %s", output_id)
+                    results[output_id] = None
+        return results
+
     def seek(self, zone_or_output_id, seconds, method="absolute"):
         """
         Seek to a time position within the now playing media.
@@ -386,8 +606,13 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             zone_or_output_id: the id of the output or zone
             shuffle: bool if shuffle should be enabled. False will disable shuffle
         """
+        applied = self._optimistic_zone(
+            zone_or_output_id, {("settings", "shuffle"): shuffle}
+        )
         data = {"zone_or_output_id": zone_or_output_id, "shuffle": shuffle}
-        return self._request(SERVICE_TRANSPORT + "/change_settings", data)
+        return self._confirm_optimistic(
+            applied, self._request(SERVICE_TRANSPORT + "/change_settings", data)
+        )
 
     def repeat(self, zone_or_output_id, repeat="loop"):
         """
@@ -404,8 +629,11 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         else:
             loop = "loop" if repeat else "disabled"
 
+        applied = self._optimistic_zone(zone_or_output_id, {("settings", "loop"): loop})
         data = {"zone_or_output_id": zone_or_output_id, "loop": loop}
-        return self._request(SERVICE_TRANSPORT + "/change_settings", data)
+        return self._confirm_optimistic(
+            applied, self._request(SERVICE_TRANSPORT + "/change_settings", data)
+        )
 
     def transfer_zone(self, from_zone_or_output_id, to_zone_or_output_id):
         """
@@ -449,6 +677,8 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             callback: method to be called when state changes occur, it will be passed an event param as string and a list of changed objects
                       callback will be called with params:
                       - event: string with name of the event ("zones_changed", "zones_seek_changed", "outputs_changed")
+                        with optimistic_updates set, also "zones_changed_provisional" and
+                        "outputs_changed_provisional" for expected changes the core has not confirmed yet
                       - a list with the zone or output id's that changed
             event_filter: only callback if the event is in this list
             id_filter: one or more zone or output id's or names to filter on (list or string)
@@ -463,18 +693,163 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             id_filter = [id_filter]
         self._state_callbacks.append((callback, event_filter, id_filter))
 
+    def unregister_state_callback(self, callback):
+        """Stop calling a callback registered with register_state_callback."""
+        self._state_callbacks = [
+            item for item in self._state_callbacks if item[0] != callback
+        ]
+
     def register_queue_callback(self, callback, zone_or_output_id=""):
         """
         Subscribe to queue change events.
 
+        Callbacks for the same zone share one subscription with the core, a callback
+        registered after the queue was loaded first gets the current items.
+
         callback: function which will be called with the updated data (provided as dict object
         zone_or_output_id: If provided, only listen for updates for this zone or output
         """
-        if zone_or_output_id:
-            opt_data = {"zone_or_output_id": zone_or_output_id}
-        else:
-            opt_data = None
-        self._roonsocket.subscribe(SERVICE_TRANSPORT, "queue", callback, opt_data)
+        if not zone_or_output_id:
+            self._roonsocket.subscribe(SERVICE_TRANSPORT, "queue", callback)
+            return
+
+        def forward(_queue, operations):
+            data = {}
+            for operation in operations:
+                if operation["operation"] == "reset":
+                    data["items"] = operation["items"]
+                else:
+                    data.setdefault("changes", []).append(operation)
+            callback(data)
+
+        self._queue_callbacks[(zone_or_output_id, callback)] = forward
+        self.subscribe_queue(zone_or_output_id, forward)
+
+    def unregister_queue_callback(self, callback, zone_or_output_id=""):
+        """Stop calling a callback registered with register_queue_callback."""
+        if not zone_or_output_id:
+            self._roonsocket.unsubscribe(SERVICE_TRANSPORT, "queue", callback)
+            return
+        forward = self._queue_callbacks.pop((zone_or_output_id, callback), None)
+        if forward is not None:
+            self.unsubscribe_queue(zone_or_output_id, forward)
+
+    def subscribe_queue(self, zone_or_output_id, callback=None, max_item_count=None):
+        """
+        Keep a local model of the play queue of a zone or output up to date.
+
+        Every call should be matched by a call to unsubscribe_queue, the subscription
+        with the core ends when the last one is made.
+
+        params:
+            zone_or_output_id: the id of the zone or output
+            callback: optional, called with the QueueModel and the list of applied operations
+                      after every change, see QueueModel.register_callback. If the queue is
+                      already loaded it is first called with the current items.
+            max_item_count: optional, only keep this many items from the start of the queue,
+                            if the queue is not subscribed to yet. See set_queue_window.
+        returns: the QueueModel, which gives indexed access to the queue items
+        """
+        model = self._queues.get(zone_or_output_id)
+        if model is None:
+            model = QueueModel(zone_or_output_id, max_item_count)
+            self._queues[zone_or_output_id] = model
+            self._queue_references[zone_or_output_id] = 0
+            self._subscribe_queue_model(model)
+        self._queue_references[zone_or_output_id] += 1
+        if callback is not None:
+            model.register_callback(callback, replay=True)
+        return model
+
+    def unsubscribe_queue(self, zone_or_output_id, callback=None):
+        """Undo a call to subscribe_queue, with the same callback."""
+        model = self._queues.get(zone_or_output_id)
+        if model is None:
+            return
+        if callback is not None:
+            model.unregister_callback(callback)
+        self._queue_references[zone_or_output_id] -= 1
+        if self._queue_references[zone_or_output_id] <= 0:
+            del self._queues[zone_or_output_id]
+            del self._queue_references[zone_or_output_id]
+            self._roonsocket.unsubscribe(
+                SERVICE_TRANSPORT, "queue", model.apply, self._queue_opts(model)
+            )
+
+    def queue(self, zone_or_output_id):
+        """Return the QueueModel of a zone or output, or None if it is not subscribed to."""
+        return self._queues.get(zone_or_output_id)
+
+    def set_queue_window(self, zone_or_output_id, max_item_count, timeout=5):
+        """
+        Change the number of items kept from the start of a subscribed queue.
+
+        The queue service only sends the first max_item_count items, so a small window
+        keeps the subscription cheap for long queues. Changing it subscribes again and
+        waits for the items in the new window.
+
+        Callbacks run on the socket thread, which receives the items, so when called
+        from a callback this does not wait. The queue callbacks are called when the
+        items arrive.
+
+        params:
+            zone_or_output_id: the id of the zone or output
+            max_item_count: the number of items to keep, None for the whole queue
+            timeout: seconds to wait for the items, 0 to not wait
+        returns: whether the items in the new window were received
+        """
+        model = self._queues.get(zone_or_output_id)
+        if model is None:
+            LOGGER.error("Queue of %s is not subscribed to", zone_or_output_id)
+            return False
+        if model.max_item_count == max_item_count:
+            return True
+        resets = model.resets
+        self._roonsocket.unsubscribe(
+            SERVICE_TRANSPORT, "queue", model.apply, self._queue_opts(model)
+        )
+        model.max_item_count = max_item_count
+        self._subscribe_queue_model(model)
+        if threading.current_thread() is self._roonsocket:
+            LOGGER.debug(
+                "Not waiting for the queue of %s in a callback", zone_or_output_id
+            )
+            return False
+        return model.wait_for_reset(resets, timeout)
+
+    def queue_items(self, zone_or_output_id, start=0, count=PAGE_SIZE, timeout=5):
+        """
+        Get a range of a subscribed queue, growing its window if needed.
+
+        params:
+            zone_or_output_id: the id of the zone or output
+            start: the index of the first item
+            count: the maximum number of items
+            timeout: seconds to wait if the window has to grow, in a callback the
+                     items that are loaded already are returned at once
+        returns: a list of queue item dicts, or None if the queue is not subscribed to
+        """
+        model = self._queues.get(zone_or_output_id)
+        if model is None:
+            return None
+        window = model.max_item_count
+        if window is not None and start + count > window:
+            # Grow by whole pages, so scrolling does not subscribe again for every item
+            pages = -(-(start + count) // PAGE_SIZE)
+            self.set_queue_window(zone_or_output_id, pages * PAGE_SIZE, timeout)
+        return model.items(start, count)
+
+    @staticmethod
+    def _queue_opts(model):
+        opts = {"zone_or_output_id": model.zone_or_output_id}
+        if model.max_item_count is not None:
+            opts["max_item_count"] = model.max_item_count
+        return opts
+
+    def _subscribe_queue_model(self, model):
+        self._roonsocket.subscribe(
+            SERVICE_TRANSPORT, "queue", model.apply, self._queue_opts(model)
+        )
 
     def browse_browse(self, opts):
         """
@@ -492,90 +867,122 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         """
         return self._request(SERVICE_BROWSE + "/load", opts)
 
-    def list_media(self, zone_or_output_id, path):
+    @contextmanager
+    def browse_session(self, multi_session_key=None):
         """
-        List the media specified.
+        Use a browse session of its own for a series of browse calls.
 
-        params:
-            zone_or_output_id: where to play the media
-            path: a list allowing roon to find the media
-                  eg ["Library", "Artists", "Neil Young", "Harvest"] or ["My Live Radio", "BBC Radio 4"]
-        """
+        Each session has its own browse level, so browsing in one session does not
+        disturb other threads. Item keys are only valid in the session they were loaded in.
 
-        opts = {
-            "zone_or_output_id": zone_or_output_id,
-            "hierarchy": "browse",
-            "count": PAGE_SIZE,
-            "pop_all": True,
-        }
+        Pooled sessions are limited, BrowseSessionTimeout is raised if none becomes
+        free within BROWSE_SESSION_TIMEOUT seconds.
 
-        total_count = self.browse_browse(opts)["list"]["count"]
-        del opts["pop_all"]
+        params:
+            multi_session_key: use this session instead of one from the pool
+        returns: the multi_session_key to add to browse_browse/browse_load opts,
+                 or to pass to browse_items, iter_media and play_id
+        """
+        if multi_session_key is not None:
+            yield multi_session_key
+            return
+        with self._browse_sessions.session() as pooled_session_key:
+            yield pooled_session_key
 
-        load_opts = {
-            "zone_or_output_id": zone_or_output_id,
-            "hierarchy": "browse",
-            "count": PAGE_SIZE,
-            "offset": 0,
-        }
-        items = []
-        searchterm = path[-1]
-        path.pop()
-        for element in path:
-            load_opts["offset"] = 0
-            found = None
-            searched = 0
-
-            LOGGER.debug("Looking for %s", element)
-            while searched < total_count and found is None:
-                items = self.browse_load(load_opts)["items"]
-
-                for item in items:
-                    searched += 1
-                    if item["title"] == element:
-                        found = item
-                        break
-
-                load_opts["offset"] += PAGE_SIZE
-            if searched >= total_count and found is None:
-                LOGGER.debug(
-                    "Could not find media path element '%s' in %s",
-                    element,
-                    [item["title"] for item in items],
-                )
-                return None
+    # pylint: disable=too-many-arguments
+    def browse_items(
+        self,
+        zone_or_output_id,
+        path=None,
+        count=None,
+        multi_session_key=None,
+        compact=False,
+        page_size=None,
+    ):
+        """
+        Iterate over the items at a level of the browse hierarchy.
 
-            opts["item_key"] = found["item_key"]
-            load_opts["item_key"] = found["item_key"]
+        Items are loaded a page at a time and yielded as they arrive, so the caller
+        can stop early without the rest of the level being fetched. Without a
+        multi_session_key the generator holds a pooled session until it is exhausted
+        or closed, so close it when stopping early (eg use contextlib.closing).
 
-            total_count = self.browse_browse(opts)["list"]["count"]
+        params:
+            zone_or_output_id: the zone or output to browse for
+            path: a list of titles leading to the level, eg ["Library", "Artists"]
+                  leave blank to iterate the top level
+            count: optional maximum number of items to yield
+            multi_session_key: the browse session to use - leave blank to use one from the pool
+            compact: yield BrowseItem records instead of dicts, to save memory when
+                     keeping many items (use as_dict() to convert one back)
+            page_size: optional fixed number of items to load per page, the page size
+                       adapts to the response time of the core if not set
+        returns: a generator of item dicts (title, subtitle, image_key, item_key, hint)
+        """
+        with self.browse_session(multi_session_key) as session_key:
+            cursor = self._browse_cursor(session_key)
+            if not cursor.navigate(zone_or_output_id, path or [], False):
+                return
+            for item in cursor.items(zone_or_output_id, count, page_size=page_size):
+                yield BrowseItem.from_dict(item) if compact else item
 
-            load_opts["offset"] = 0
-            items = self.browse_load(load_opts)["items"]
+    # pylint: disable=too-many-arguments
+    def iter_media(
+        self,
+        zone_or_output_id,
+        path,
+        count=None,
+        multi_session_key=None,
+        compact=False,
+    ):
+        """
+        Iterate over the media specified.
 
-        LOGGER.debug("Searching for %s", searchterm)
-        load_opts["offset"] = 0
-        searched = 0
-        matched = []
-        while searched < total_count:
-            items = self.browse_load(load_opts)["items"]
-
-            if searchterm == "__all__":
-                for item in items:
-                    searched += 1
-                    matched.append(item["title"])
-            else:
-                for item in items:
-                    searched += 1
-                    if searchterm in item["title"]:
-                        matched.append(item["title"])
+        params:
+            zone_or_output_id: where to play the media
+            path: a list allowing roon to find the media, the last element is matched
+                  against the titles of the level above it (use "__all__" to match all)
+                  eg ["Library", "Artists", "Neil"] or ["Library", "Artists", "__all__"]
+            count: optional maximum number of matching items to yield
+            multi_session_key: the browse session to use - leave blank to use one from the pool,
+                               which is held until the generator is exhausted or closed
+            compact: yield BrowseItem records instead of dicts
+        returns: a generator of the full item dicts that match
+        """
+        *parents, searchterm = path
+        with self.browse_session(multi_session_key) as session_key:
+            cursor = self._browse_cursor(session_key)
+            if not cursor.navigate(zone_or_output_id, parents, False):
+                return
+            for item in self._browse_matches(
+                cursor, zone_or_output_id, searchterm, count
+            ):
+                yield BrowseItem.from_dict(item) if compact else item
 
-            load_opts["offset"] += PAGE_SIZE
+    def list_media(self, zone_or_output_id, path):
+        """
+        List the media specified.
 
-        return matched
+        params:
+            zone_or_output_id: where to play the media
+            path: a list allowing roon to find the media
+                  eg ["Library", "Artists", "Neil Young", "Harvest"] or ["My Live Radio", "BBC Radio 4"]
+        returns: a list of the matching titles, or None if the path could not be found
+        """
+        *parents, searchterm = path
+        with self.browse_session() as session_key:
+            cursor = self._browse_cursor(session_key)
+            if not cursor.navigate(zone_or_output_id, parents, False):
+                return None
+            return [
+                item["title"]
+                for item in self._browse_matches(cursor, zone_or_output_id, searchterm)
+            ]
 
-    def play_media(self, zone_or_output_id, path, action=None, report_error=True):
-        # pylint: disable=too-many-locals,too-many-branches,too-many-return-statements,too-many-statements
+    # pylint: disable=too-many-arguments
+    def play_media(
+        self, zone_or_output_id, path, action=None, report_error=True, search=False
+    ):
         """
         Play the media specified.
 
@@ -585,65 +992,108 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
                   eg ["Library", "Artists", "Neil Young", "Harvest"] or ["My Live Radio", "BBC Radio 4"]
             action: the roon action to take to play the media - leave blank to choose the roon default
                     eg "Play Now", "Queue" or "Start Radio"
+            search: look the media up with the roon search first, the path is only walked
+                    if the search does not find an exact match in the category of the
+                    path (eg Albums for ["Library", "Artists", "Neil Young", "Harvest"])
         """
+        with self.browse_session() as session_key:
+            if search and path:
+                played = self._play_search(zone_or_output_id, path, action, session_key)
+                if played is not None:
+                    return played
+                LOGGER.debug("Search did not find %s, browsing the path", path)
+            cursor = self._browse_cursor(session_key)
+            if not cursor.navigate(zone_or_output_id, path, report_error):
+                return None
+            return self._play_level(cursor, zone_or_output_id, action)
 
-        opts = {
-            "zone_or_output_id": zone_or_output_id,
-            "hierarchy": "browse",
-            "count": PAGE_SIZE,
-            "pop_all": True,
-        }
+    def search_media(
+        self, zone_or_output_id, text, category=None, count=10, multi_session_key=None
+    ):
+        """
+        Search for media with the roon search and rank the results by title.
 
-        total_count = self.browse_browse(opts)["list"]["count"]
-        del opts["pop_all"]
+        params:
+            zone_or_output_id: the zone or output to search for
+            text: the title to search for, eg "Neil Young"
+            category: only return results of this category, eg "Artists", "Albums" or "Tracks"
+            count: the maximum number of results to rank per category
+            multi_session_key: the browse session to use - leave blank to use one from the pool
+        returns: a list of the matching item dicts, best match first
+        """
+        with self.browse_session(multi_session_key) as session_key:
+            cursor = self._browse_cursor(session_key, "search")
+            if not cursor.search(zone_or_output_id, text):
+                return []
+            top_items = list(cursor.items(zone_or_output_id, PAGE_SIZE))
+            ranked = [] if category else rank_items(top_items, text)
+            for item in top_items:
+                if item.get("hint") != "list" or category not in (None, item["title"]):
+                    continue
+                if not cursor.navigate(zone_or_output_id, [item["title"]], False):
+                    break
+                ranked.extend(rank_items(cursor.items(zone_or_output_id, count), text))
+            ranked.sort(key=lambda match: -match[0])
+            return [item for _, item in ranked]
 
-        load_opts = {
-            "zone_or_output_id": zone_or_output_id,
-            "hierarchy": "browse",
-            "count": PAGE_SIZE,
-            "offset": 0,
-        }
-        items = []
-        for element in path:
-            load_opts["offset"] = 0
-            found = None
-            searched = 0
-
-            LOGGER.debug("Looking for %s", element)
-            while searched < total_count and found is None:
-                items = self.browse_load(load_opts)["items"]
-
-                for item in items:
-                    searched += 1
-                    if item["title"] == element:
-                        found = item
-                        break
-
-                load_opts["offset"] += PAGE_SIZE
-            if searched >= total_count and found is None:
-                if report_error:
-                    LOGGER.error(
-                        "Could not find media path element '%s' in %s",
-                        element,
-                        [item["title"] for item in items],
-                    )
-                return None
+    def _play_search(self, zone_or_output_id, path, action, multi_session_key):
+        """
+        Play the media at path by searching for its title.
 
-            opts["item_key"] = found["item_key"]
-            load_opts["item_key"] = found["item_key"]
+        Only matches in the search category the path implies are played, when the
+        path gives context (eg the artist of an album) the subtitle of the match must
+        contain it as well.
 
-            try:
-                total_count = self.browse_browse(opts)["list"]["count"]
-            except TypeError:
-                LOGGER.error("Exception trying to play media")
+        returns: the play result, or None if the search did not find an exact match
+        """
+        title = path[-1]
+        category, context = search_terms(path)
+        if category is None:
+            LOGGER.debug("No search category for %s, walking the path", path)
+            return None
+        required = EXACT_MATCH + CONTEXT_MATCH if context else EXACT_MATCH
+        cursor = self._browse_cursor(multi_session_key, "search")
+        if not cursor.search(zone_or_output_id, title):
+            return None
+        categories = [
+            item["title"]
+            for item in cursor.items(zone_or_output_id, PAGE_SIZE)
+            if item.get("hint") == "list" and item["title"] == category
+        ]
+        best = None
+        for category_title in categories:
+            if best is not None and best[0] >= required:
+                break
+            if not cursor.navigate(zone_or_output_id, [category_title], False):
                 return None
+            ranked = rank_items(
+                cursor.items(zone_or_output_id, PAGE_SIZE), title, context
+            )
+            if ranked and (best is None or ranked[0][0] > best[0]):
+                best = ranked[0]
+        if best is None or best[0] < required:
+            return None
 
-            load_opts["offset"] = 0
-            items = self.browse_load(load_opts)["items"]
-
-            if found["hint"] == "action":
-                # Loading item we found already started playing
-                return True
+        # The loop stops at the first good enough match, so it is in the current level
+        found = best[1]
+        LOGGER.debug("Search found %s for %s", found, path)
+        if cursor.browse_item(zone_or_output_id, found) is None:
+            return None
+        if found.get("hint") == "action":
+            return True
+        return self._play_level(cursor, zone_or_output_id, action)
+
+    def _play_level(self, cursor, zone_or_output_id, action):
+        # pylint: disable=too-many-branches,too-many-return-statements
+        """Take the play action of the media at the current level of a browse cursor."""
+        if cursor.item is not None and cursor.item.get("hint") == "action":
+            # Loading item we found already started playing
+            return True
+
+        items = list(cursor.items(zone_or_output_id, PAGE_SIZE))
+        if not items:
+            LOGGER.error("Found media has no items to play '%s'", cursor.path)
+            return False
 
         # First item shoule be the action/action_list for playing this item (eg Play Genre, Play Artist, Play Album)
         if items[0].get("hint") not in ["action_list", "action"]:
@@ -656,10 +1106,8 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
 
         play_header = items[0]["title"]
         if items[0].get("hint") == "action_list":
-            opts["item_key"] = items[0]["item_key"]
-            load_opts["item_key"] = items[0]["item_key"]
-            self.browse_browse(opts)
-            items = self.browse_load(load_opts)["items"]
+            cursor.browse_item(zone_or_output_id, items[0])
+            items = list(cursor.items(zone_or_output_id, PAGE_SIZE))
 
         # We should now have play actions (eg Play Now, Add Next, Queue action, Start Radio)
         # So pick the one to use - the default is the first one
@@ -690,20 +1138,63 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
                 # so for now just ignore - and hope it's OK
                 pass
 
-        opts["item_key"] = take_action["item_key"]
-        load_opts["item_key"] = take_action["item_key"]
         LOGGER.info("Play action was '%s' / '%s'", play_header, take_action["title"])
-        self.browse_browse(opts)
+        cursor.browse_item(zone_or_output_id, take_action)
         return True
 
+    def add_preset(self, name, path, action=None):
+        """
+        Add a preset that can be played by name with play_preset.
+
+        The play action of the preset is looked up and kept ready in the background,
+        so playing it usually takes a single call to the roon server.
+
+        params:
+            name: the name of the preset
+            path: a list allowing roon to find the media, as for play_media
+            action: the roon action to take to play the media - leave blank to choose the roon default
+        """
+        if self._presets is None:
+            self._presets = PresetRegistry(self)
+            self._presets.start()
+        self._presets.add(name, path, action)
+
+    def remove_preset(self, name):
+        """Remove a preset."""
+        if self._presets is not None:
+            self._presets.remove(name)
+
+    def play_preset(self, zone_or_output_id, name):
+        """
+        Play a preset added with add_preset.
+
+        params:
+            zone_or_output_id: where to play the media
+            name: the name of the preset
+        """
+        if self._presets is None:
+            LOGGER.error("Unknown preset '%s'", name)
+            return None
+        return self._presets.play(zone_or_output_id, name)
+
     # pylint: disable=too-many-return-statements
-    def play_id(self, zone_or_output_id, media_id):
-        """Play based on the media_id from the browse api."""
+    def play_id(self, zone_or_output_id, media_id, multi_session_key=None):
+        """
+        Play based on the media_id from the browse api.
+
+        params:
+            zone_or_output_id: where to play the media
+            media_id: the item_key of the media
+            multi_session_key: the browse session the item_key was loaded in
+        """
         opts = {
             "zone_or_output_id": zone_or_output_id,
             "item_key": media_id,
             "hierarchy": "browse",
         }
+        if multi_session_key is not None:
+            opts["multi_session_key"] = multi_session_key
+        self._browse_cursor(multi_session_key).reset()
         header_result = self.browse_browse(opts)
         # For Radio the above load starts play - so catch this and return
         try:
@@ -790,6 +1281,15 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         """
         self._appinfo = appinfo
         self._token = token
+        self._browse_sessions = BrowseSessionPool()
+        self.browse_page_sizer = BrowsePageSizer()
+        self._browse_cursors = {}
+        self._queues = {}
+        self._queue_references = {}
+        self._queue_callbacks = {}
+        self._optimistic = OptimisticState()
+        self._volume_controls = {}
+        self._source_controls = {}
 
         if not appinfo or not isinstance(appinfo, dict):
             raise RoonApiException("Appinfo missing or in incorrect format")
@@ -830,6 +1330,24 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
     def stop(self):
         """Stop socket."""
         self._exit = True
+        if self._presets is not None:
+            self._presets.stop()
+        self.disable_image_prefetch()
+        self.stop_image_proxy()
+        if self._volume_coalescer is not None:
+            self._volume_coalescer.stop()
+        if self._volume_control_updates is not None:
+            self._volume_control_updates.flush()
+            self._volume_control_updates.stop()
+        if self._volume_control_dispatcher is not None:
+            self._volume_control_dispatcher.stop()
+        if self._source_control_updates is not None:
+            self._source_control_updates.flush()
+            self._source_control_updates.stop()
+        if self._source_control_dispatcher is not None:
+            self._source_control_dispatcher.stop()
+        if self._image_client is not None:
+            self._image_client.close()
         if self._roonsocket:
             self._roonsocket.stop()
 
@@ -846,6 +1364,9 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         self._roonsocket.register_volume_controls_callback(
             self._on_volume_control_request
         )
+        self._roonsocket.register_source_controls_callback(
+            self._on_source_control_request
+        )
 
         self._roonsocket.start()
 
@@ -854,11 +1375,20 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         LOGGER.debug("Connection with roon websockets (re)created.")
         self.ready = False
         self._volume_controls_request_id = None
+        self._source_controls_request_id = None
+        for cursor in self._browse_cursors.values():
+            cursor.reset()
+        if self._presets is not None:
+            self._presets.invalidate()
         # authenticate / register
         # warning: at first launch the user has to approve the app in the Roon settings.
         appinfo = self._appinfo.copy()
-        appinfo["required_services"] = [SERVICE_TRANSPORT, SERVICE_BROWSE]
-        appinfo["provided_services"] = [CONTROL_VOLUME]
+        appinfo["required_services"] = [
+            SERVICE_TRANSPORT,
+            SERVICE_BROWSE,
+            SERVICE_IMAGE,
+        ]
+        appinfo["provided_services"] = [CONTROL_VOLUME, CONTROL_SOURCE]
         if self._token:
             appinfo["token"] = self._token
         if not self._token:
@@ -877,6 +1407,8 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
 
         self._roonsocket.subscribe(SERVICE_TRANSPORT, "zones", self._on_state_change)
         self._roonsocket.subscribe(SERVICE_TRANSPORT, "outputs", self._on_state_change)
+        for model in self._queues.values():
+            self._subscribe_queue_model(model)
         # set flag that we're fully initialized (used for blocking init)
         self.ready = True
 
@@ -897,6 +1429,7 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
                 "zones",
             ]:
                 for zone in state_values:
+                    self._optimistic.confirm("zones", zone["zone_id"], zone)
                     if zone["zone_id"] in self._zones:
                         self._zones[zone["zone_id"]].update(zone)
                     else:
@@ -916,6 +1449,7 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
                 events.append((event, changed_ids, filter_keys))
             elif state_key in ["outputs_changed", "outputs_added", "outputs"]:
                 for output in state_values:
+                    self._optimistic.confirm("outputs", output["output_id"], output)
                     if output["output_id"] in self._outputs:
                         self._outputs[output["output_id"]].update(output)
                     else:
@@ -934,20 +1468,123 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             else:
                 LOGGER.warning("unknown state change: %s" % msg)
         for event, changed_ids, filter_keys in events:
-            filter_keys.extend(changed_ids)
-            for item in self._state_callbacks:
-                callback = item[0]
-                event_filter = item[1]
-                id_filter = item[2]
-                if event_filter and (event not in event_filter):
-                    continue
-                if id_filter and set(id_filter).isdisjoint(filter_keys):
-                    continue
-                try:
-                    callback(event, changed_ids)
-                # pylint: disable=broad-except
-                except Exception:
-                    LOGGER.exception("Error while executing callback!")
+            self._notify_state_callbacks(event, changed_ids, filter_keys)
+
+    def _notify_state_callbacks(self, event, changed_ids, filter_keys):
+        """Call the state callbacks that want the event for one of the filter keys."""
+        filter_keys.extend(changed_ids)
+        for item in self._state_callbacks:
+            callback = item[0]
+            event_filter = item[1]
+            id_filter = item[2]
+            if event_filter and (event not in event_filter):
+                continue
+            if id_filter and set(id_filter).isdisjoint(filter_keys):
+                continue
+            try:
+                callback(event, changed_ids)
+            # pylint: disable=broad-except
+            except Exception:
+                LOGGER.exception("Error while executing callback!")
+
+    def _notify_changed(self, kind, obj_id, provisional=False):
+        """Call the state callbacks for a local change to a zone or output."""
+        obj = (self._zones if kind == "zones" else self._outputs).get(obj_id, {})
+        filter_keys = [obj.get("display_name")]
+        if kind == "zones":
+            for output in obj.get("outputs", []):
+                filter_keys.append(output["output_id"])
+                filter_keys.append(output["display_name"])
+        else:
+            filter_keys.append(obj.get("zone_id"))
+        event = kind + "_changed" + ("_provisional" if provisional else "")
+        self._notify_state_callbacks(event, [obj_id], filter_keys)
+
+    def _zone_id(self, zone_or_output_id):
+        """Return the id of the zone of a zone or output id."""
+        if zone_or_output_id in self._outputs:
+            return self._outputs[zone_or_output_id].get("zone_id")
+        return zone_or_output_id
+
+    def _optimistic_zone(self, zone_or_output_id, changes):
+        """Apply the expected changes to a zone, if optimistic updates are on."""
+        changes = {path: value for path, value in changes.items() if value is not None}
+        if not self.optimistic_updates or not changes:
+            return []
+        zone_id = self._zone_id(zone_or_output_id)
+        applied = self._optimistic.apply("zones", self._zones, zone_id, changes)
+        if applied:
+            self._notify_changed("zones", zone_id, True)
+        return applied
+
+    def _optimistic_output(self, output_id, changes):
+        """Apply the expected changes to an output and to its entry in its zone."""
+        changes = {path: value for path, value in changes.items() if value is not None}
+        if not self.optimistic_updates or not changes or output_id not in self._outputs:
+            return []
+        applied = self._optimistic.apply("outputs", self._outputs, output_id, changes)
+        if applied:
+            self._notify_changed("outputs", output_id, True)
+        zone_id = self._outputs[output_id].get("zone_id")
+        for index, output in enumerate(self._zones.get(zone_id, {}).get("outputs", [])):
+            if output.get("output_id") != output_id:
+                continue
+            zone_changes = {
+                ("outputs", index) + path: value for path, value in changes.items()
+            }
+            zone_applied = self._optimistic.apply(
+                "zones", self._zones, zone_id, zone_changes
+            )
+            if zone_applied:
+                self._notify_changed("zones", zone_id, True)
+            applied.extend(zone_applied)
+        return applied
+
+    @staticmethod
+    def _expected_volume(volume_data, value, method):
+        """Return the volume value a change_volume request is expected to result in."""
+        current = volume_data.get("value")
+        if method == "absolute":
+            return value
+        if current is None:
+            return None
+        if method == "relative_step":
+            value = value * volume_data.get("step", 1)
+        return max(volume_data["min"], min(volume_data["max"], current + value))
+
+    def _confirm_optimistic(self, applied, result):
+        """Settle the optimistic changes of a command, roll them back if it failed, returns result."""
+        if not applied:
+            return result
+        if isinstance(result, str) and "Success" in result:
+            self._optimistic.forget(applied)
+        else:
+            LOGGER.debug("Command failed, rolling back optimistic changes: %s", result)
+            for kind, obj_id in self._optimistic.rollback(applied):
+                self._notify_changed(kind, obj_id)
+        return result
+
+    def _browse_cursor(self, multi_session_key, hierarchy="browse"):
+        """Return the cursor that tracks the level of a browse session."""
+        cursor = self._browse_cursors.get((multi_session_key, hierarchy))
+        if cursor is None:
+            cursor = BrowseCursor(
+                self, multi_session_key, hierarchy, self.browse_page_sizer
+            )
+            self._browse_cursors[(multi_session_key, hierarchy)] = cursor
+        return cursor
+
+    @staticmethod
+    def _browse_matches(cursor, zone_or_output_id, searchterm, count=None):
+        """Yield the items of the current level whose title contains searchterm."""
+        LOGGER.debug("Searching for %s", searchterm)
+        matched = 0
+        for item in cursor.items(zone_or_output_id):
+            if count is not None and matched >= count:
+                return
+            if searchterm == "__all__" or searchterm in item["title"]:
+                matched += 1
+                yield item
 
     def _get_outputs(self):
         outputs = {}
@@ -1041,8 +1678,7 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         }
         self._volume_controls[control_key] = (callback, control_data)
         if self._volume_controls_request_id:
-            data = {"controls_added": [control_data]}
-            self._roonsocket.send_continue(self._volume_controls_request_id, data)
+            self._volume_control_buffer().add(control_key, control_data)
 
     def unregister_volume_control(
         self,
@@ -1053,31 +1689,54 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
         if control_key not in self._volume_controls:
             LOGGER.error("source_control %s is not registered!" % control_key)
             return
-        control_data = {
-            "control_key": control_key,
-        }
         del self._volume_controls[control_key]
 
         if self._volume_controls_request_id:
-            data = {"controls_removed": [control_data]}
-            self._roonsocket.send_continue(self._volume_controls_request_id, data)
+            self._volume_control_buffer().remove(control_key)
 
     def update_volume_control(self, control_key, volume=None, mute=None):
-        """Update an existing volume control, report its state to Roon."""
+        """
+        Update an existing volume control, report its state to Roon.
+
+        Updates are collected for CONTROL_UPDATE_INTERVAL seconds and sent together,
+        call flush_volume_controls to send them right away. Before Roon subscribed to
+        the controls the state is kept and reported when it does.
+        """
         if control_key not in self._volume_controls:
             LOGGER.warning("volume_control %s is not (yet) registered!" % control_key)
             return False
-        if not self._volume_controls_request_id:
-            LOGGER.warning("Not yet registered, can not update volume control")
-            return False
         if volume is not None:
             self._volume_controls[control_key][1]["volume_value"] = volume
         if mute is not None:
             self._volume_controls[control_key][1]["is_muted"] = mute
-        data = {"controls_changed": [self._volume_controls[control_key][1]]}
-        self._roonsocket.send_continue(self._volume_controls_request_id, data)
+        if not self._volume_controls_request_id:
+            LOGGER.debug(
+                "Volume controls not subscribed yet, update of %s kept", control_key
+            )
+            return True
+        self._volume_control_buffer().change(
+            control_key, self._volume_controls[control_key][1]
+        )
         return True
 
+    def flush_volume_controls(self):
+        """Send the volume control updates that are waiting to Roon now."""
+        if self._volume_control_updates is not None:
+            self._volume_control_updates.flush()
+
+    def _volume_control_buffer(self):
+        """Return the buffer for volume control updates, starting it when first used."""
+        if self._volume_control_updates is None:
+            self._volume_control_updates = ControlUpdateBuffer(
+                self._send_volume_controls
+            )
+            self._volume_control_updates.start()
+        return self._volume_control_updates
+
+    def _send_volume_controls(self, data):
+        if self._volume_controls_request_id and self._roonsocket:
+            self._roonsocket.send_continue(self._volume_controls_request_id, data)
+
     def _on_volume_control_request(self, event, request_id, data):
         """Got request from roon server for a volume control registered on this endpoint."""
         if event == "subscribe_controls":
@@ -1086,28 +1745,191 @@ class RoonApi:  # pylint: disable=too-many-instance-attributes, too-many-lines
             controls = []
             for _, control_data in self._volume_controls.values():
                 controls.append(control_data)
+            if self._volume_control_updates is not None:
+                self._volume_control_updates.clear()
             self._roonsocket.send_continue(request_id, {"controls_added": controls})
             self._volume_controls_request_id = request_id
-        elif data and data.get("control_key"):
+        elif data and data.get("control_key") in self._volume_controls:
             control_key = data["control_key"]
             if event == "set_volume" and data["mode"] == "absolute":
-                value = data["value"]
+                change = {"event": event, "absolute": data["value"]}
             elif event == "set_volume" and data["mode"] == "relative":
-                value = (
-                    self._volume_controls[control_key][1]["volume_value"]
-                    + data["value"]
-                )
+                change = {"event": event, "relative": data["value"]}
             elif event == "set_volume" and data["mode"] == "relative_step":
-                value = self._volume_controls[control_key][1]["volume_value"] + (
-                    data["value"] * data["volume_step"]
+                step = data.get(
+                    "volume_step", self._volume_controls[control_key][1]["volume_step"]
                 )
+                change = {"event": event, "relative": data["value"] * step}
             elif event == "set_mute":
-                value = data["mode"] == "on"
+                change = {"event": event, "absolute": data["mode"] == "on"}
             else:
                 return
-            try:
-                self._roonsocket.send_complete(request_id, "Success")
-                self._volume_controls[control_key][0](control_key, event, value)
-            except Exception:  # pylint: disable=broad-except
-                LOGGER.exception("Error in volume_control callback")
-                self._roonsocket.send_complete(request_id, "Error")
+            # The callback may talk to slow hardware, so run it on a worker thread
+            self._volume_control_workers().submit(
+                control_key,
+                request_id,
+                lambda change: self._run_volume_control(control_key, change),
+                change,
+                lambda pending, change: self._merge_volume_changes(
+                    control_key, pending, change
+                ),
+            )
+
+    def _volume_control_workers(self):
+        """Return the dispatcher for volume control callbacks, creating it when first used."""
+        if self._volume_control_dispatcher is None:
+            self._volume_control_dispatcher = ControlDispatcher(
+                lambda request_id, name: self._roonsocket.send_complete(
+                    request_id, name
+                )
+            )
+        return self._volume_control_dispatcher
+
+    def _run_volume_control(self, control_key, change):
+        """Call the callback of a volume control with the value a request asks for."""
+        callback, control_data = self._volume_controls[control_key]
+        value = change.get("absolute")
+        if value is None:
+            value = control_data["volume_value"] + change["relative"]
+        callback(control_key, change["event"], value)
+
+    def _merge_volume_changes(self, control_key, pending, change):
+        """Merge two set_volume requests of a control, only the result is sent to the callback."""
+        if pending["event"] != "set_volume" or change["event"] != "set_volume":
+            return None
+        if "absolute" in change:
+            return change
+        if "absolute" in pending:
+            control_data = self._volume_controls[control_key][1]
+            value = pending["absolute"] + change["relative"]
+            value = max(
+                control_data["volume_min"], min(control_data["volume_max"], value)
+            )
+            return {"event": "set_volume", "absolute": value}
+        return {
+            "event": "set_volume",
+            "relative": pending["relative"] + change["relative"],
+        }
+
+    # pylint: disable=too-many-arguments
+    def register_source_control(
+        self,
+        control_key,
+        display_name,
+        callback,
+        supports_standby=True,
+        status="indeterminate",
+    ):
+        """
+        Register a new source control on the api.
+
+        params:
+            control_key: a unique key for the control
+            display_name: the name of the control shown in roon
+            callback: function called with the control_key and the event ("standby" or
+                      "convenience_switch") when roon asks to put the device in standby or to
+                      select this source. It runs on a worker thread, report the new status
+                      with update_source_control.
+            supports_standby: if the device can be put in standby
+            status: "selected", "deselected", "standby" or "indeterminate"
+        """
+        if control_key in self._source_controls:
+            LOGGER.error("source_control %s is already registered!" % control_key)
+            return
+        control_data = {
+            "display_name": display_name,
+            "supports_standby": supports_standby,
+            "status": status,
+            "control_key": control_key,
+        }
+        self._source_controls[control_key] = (callback, control_data)
+        if self._source_controls_request_id:
+            self._source_control_buffer().add(control_key, control_data)
+
+    def unregister_source_control(self, control_key):
+        """Delete a source control on the api."""
+        if control_key not in self._source_controls:
+            LOGGER.error("source_control %s is not registered!" % control_key)
+            return
+        del self._source_controls[control_key]
+        if self._source_controls_request_id:
+            self._source_control_buffer().remove(control_key)
+
+    def update_source_control(self, control_key, status):
+        """
+        Update the status of an existing source control, report it to Roon.
+
+        Updates are collected for CONTROL_UPDATE_INTERVAL seconds and sent together,
+        call flush_source_controls to send them right away. Before Roon subscribed to
+        the controls the state is kept and reported when it does.
+        """
+        if control_key not in self._source_controls:
+            LOGGER.warning("source_control %s is not (yet) registered!" % control_key)
+            return False
+        if status not in ("selected", "deselected", "standby", "indeterminate"):
+            LOGGER.error("Invalid status %s for source_control %s", status, control_key)
+            return False
+        self._source_controls[control_key][1]["status"] = status
+        if not self._source_controls_request_id:
+            LOGGER.debug(
+                "Source controls not subscribed yet, update of %s kept", control_key
+            )
+            return True
+        self._source_control_buffer().change(
+            control_key, self._source_controls[control_key][1]
+        )
+        return True
+
+    def flush_source_controls(self):
+        """Send the source control updates that are waiting to Roon now."""
+        if self._source_control_updates is not None:
+            self._source_control_updates.flush()
+
+    def _source_control_buffer(self):
+        """Return the buffer for source control updates, starting it when first used."""
+        if self._source_control_updates is None:
+            self._source_control_updates = ControlUpdateBuffer(
+                self._send_source_controls
+            )
+            self._source_control_updates.start()
+        return self._source_control_updates
+
+    def _send_source_controls(self, data):
+        if self._source_controls_request_id and self._roonsocket:
+            self._roonsocket.send_continue(self._source_controls_request_id, data)
+
+    def _on_source_control_request(self, event, request_id, data):
+        """Got request from roon server for a source control registered on this endpoint."""
+        if event == "subscribe_controls":
+            LOGGER.debug("found subscription ID for source controls: %s " % request_id)
+            # send all source controls already registered (handle connection loss)
+            controls = [
+                control_data for _, control_data in self._source_controls.values()
+            ]
+            if self._source_control_updates is not None:
+                self._source_control_updates.clear()
+            self._roonsocket.send_continue(request_id, {"controls_added": controls})
+            self._source_controls_request_id = request_id
+        elif data and data.get("control_key") in self._source_controls:
+            if event not in ("standby", "convenience_switch"):
+                return
+            control_key = data["control_key"]
+            callback = self._source_controls[control_key][0]
+            # Repeated requests for the same event while one is waiting are handled once
+            self._source_control_workers().submit(
+                control_key,
+                request_id,
+                lambda event: callback(control_key, event),
+                event,
+                lambda pending, event: event if pending == event else None,
+            )
+
+    def _source_control_workers(self):
+        """Return the dispatcher for source control callbacks, creating it when first used."""
+        if self._source_control_dispatcher is None:
+            self._source_control_dispatcher = ControlDispatcher(
+                lambda request_id, name: self._roonsocket.send_complete(
+                    request_id, name
+                )
+            )
+        return self._source_control_dispatcher
@@ -4,7 +4,13 @@ import threading
 
 import websocket
 
-from .constants import LOGGER, REGISTERED, SERVICE_PING, CONTROL_VOLUME
+from .constants import (
+    LOGGER,
+    REGISTERED,
+    SERVICE_PING,
+    CONTROL_SOURCE,
+    CONTROL_VOLUME,
+)
 
 try:
     import simplejson as json
@@ -17,6 +23,51 @@ except ImportError:
     import _thread as thread
 
 
+def parse_message(message):
+    """
+    Split a MOO message into its first line, headers and body.
+
+    The body is a memoryview of the message, so binary bodies (eg images) are not
+    copied. It is cut to the Content-Length header, if there is one.
+
+    returns: tuple of first line, dict of headers and body
+    """
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    # Roon uses a blank line after the header to indicate body.
+    # See https://github.com/RoonLabs/node-roon-api/blob/master/moomsg.js#L45
+    header_end = message.find(b"\n\n")
+    if header_end < 0:
+        header_end = len(message)
+    lines = message[:header_end].decode("utf-8").split("\n")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip()] = value.strip()
+    body = memoryview(message)[header_end + 2 :]
+    if "Content-Length" in headers:
+        body = body[: int(headers["Content-Length"])]
+    return lines[0], headers, body
+
+
+def decode_body(header, headers, body):
+    """
+    Decode the body of a MOO message by its Content-Type.
+
+    returns: the decoded json, a string for text, or a tuple of content type and
+    memoryview for binary bodies. Without a body the first line is returned.
+    """
+    content_type = headers.get("Content-Type")
+    if content_type is None:
+        return "" if "Logging" in headers else header
+    if content_type == "application/json" or content_type.startswith("text/"):
+        text = str(body, "utf-8")
+        if "{" in text:
+            return json.loads(text)
+        return text
+    return content_type, body
+
+
 class RoonApiWebSocket(
     threading.Thread
 ):  # pylint: disable=too-many-instance-attributes
@@ -56,11 +107,11 @@ class RoonApiWebSocket(
     def stop(self):
         """Stop the socket thread."""
         self._exit = True
-        subscriptions = []
-        for _, value in self._subscriptions.items():
-            subscriptions.append((value["service"], value["endpoint"]))
-        for service, _ in subscriptions:
-            self.unsubscribe(service, subscriptions)
+        subscriptions = set()
+        for value in list(self._subscriptions.values()):
+            subscriptions.add((value["service"], value["endpoint"]))
+        for service, endpoint in subscriptions:
+            self.unsubscribe(service, endpoint)
         self._socket.close()
 
     def __init__(self, host):
@@ -68,10 +119,12 @@ class RoonApiWebSocket(
 
         self._socket = None
         self._results = {}
+        self._request_lock = threading.Lock()
         self._requestid = 10  # initial request_id of 10 to prevent confusion with the requests that are sent by the server at initialization
         self._subkey = 0
         self._exit = False
         self._subscriptions = {}
+        self._subscription_lock = threading.Lock()
         self.connected = False
         self.failed_state = False
 
@@ -91,32 +144,68 @@ class RoonApiWebSocket(
         self.daemon = True
 
     def subscribe(self, service, endpoint, callback, opt_data=None):
-        """Subscribe to events."""
-        subkey = self._subkey
-        self._subkey += 1
-        data = {"subscription_key": subkey}
-        if opt_data and isinstance(opt_data, dict):
+        """
+        Subscribe to events.
+
+        Subscriptions to the same service, endpoint and opt_data share one subscription
+        with the server, the messages are passed to all callbacks. A callback that is
+        added to an existing subscription gets the messages from then on.
+        """
+        if not opt_data or not isinstance(opt_data, dict):
+            opt_data = {}
+        key = (service, endpoint, json.dumps(opt_data, sort_keys=True))
+        with self._subscription_lock:
+            for value in self._subscriptions.values():
+                if value["key"] == key:
+                    value["callbacks"].append(callback)
+                    return
+            subkey = self._subkey
+            self._subkey += 1
+            data = {"subscription_key": subkey}
             data.update(opt_data)
-        request_id = self.send_request(service + "/subscribe_" + endpoint, data)
-        self._subscriptions[request_id] = {
-            "service": service,
-            "endpoint": endpoint,
-            "request_id": request_id,
-            "subkey": subkey,
-            "callback": callback,
-        }
-
-    def unsubscribe(self, service, endpoint):
-        """Subscribe to events."""
+            request_id = self.send_request(service + "/subscribe_" + endpoint, data)
+            if request_id is False:
+                # Not kept, so a later subscribe with the same key is sent again
+                LOGGER.warning("Could not subscribe to %s/%s", service, endpoint)
+                return
+            self._subscriptions[request_id] = {
+                "service": service,
+                "endpoint": endpoint,
+                "key": key,
+                "request_id": request_id,
+                "subkey": subkey,
+                "callbacks": [callback],
+            }
+
+    def unsubscribe(self, service, endpoint, callback=None, opt_data=None):
+        """
+        Unsubscribe from events.
+
+        Without a callback all subscriptions to the endpoint are ended. With a callback
+        only that callback is removed, and the subscription with the server is ended
+        when no callbacks are left.
+        """
+        if not opt_data or not isinstance(opt_data, dict):
+            opt_data = {}
         matches = []
-        for key, value in self._subscriptions.items():
-            if value["service"] == service and value["endpoint"] == endpoint:
+        with self._subscription_lock:
+            for key, value in self._subscriptions.items():
+                if value["service"] != service or value["endpoint"] != endpoint:
+                    continue
+                if callback is not None:
+                    if value["key"][2] != json.dumps(opt_data, sort_keys=True):
+                        continue
+                    if callback in value["callbacks"]:
+                        value["callbacks"].remove(callback)
+                    if value["callbacks"]:
+                        continue
                 matches.append((key, value["subkey"]))
+            for item in matches:
+                del self._subscriptions[item[0]]
         for item in matches:
             self.send_request(
                 service + "/unsubscribe_" + endpoint, {"subscription_key": item[1]}
             )
-            del self._subscriptions[item[0]]
 
     # pylint: disable=too-many-branches
     def on_message(self, w_socket, message=None):
@@ -124,26 +213,11 @@ class RoonApiWebSocket(
         if not message:
             message = w_socket  # compatability fix because of change in websocket-client v0.49
         try:
-            message = message.decode("utf-8")
-            lines = message.split("\n")
-            header = lines[0]
-            body = ""
-
+            header, headers, body = parse_message(message)
             request_id = None
-            line_with_request_id = [
-                line for line in lines if line.startswith("Request-Id")
-            ]
-            if line_with_request_id:
-                request_id = int(line_with_request_id[0].split("Request-Id: ")[1])
-
-            if "Content-Type:" in message:
-                # Roon uses a blank line after the header to indicate body.
-                # See https://github.com/RoonLabs/node-roon-api/blob/master/moomsg.js#L45
-                body = "".join(message.split("\n\n")[1:])
-            elif "Logging:" not in message:
-                body = header
-            if body and "{" in body:
-                body = json.loads(body)
+            if "Request-Id" in headers:
+                request_id = int(headers["Request-Id"])
+            body = decode_body(header, headers, body)
             # handle message
             if SERVICE_PING in header:
                 # reply to incoming ping from server
@@ -156,9 +230,19 @@ class RoonApiWebSocket(
                 LOGGER.debug("CONTROL_VOLUME endpoint %s", event)
                 if self._volume_controls_callback:
                     self._volume_controls_callback(event, request_id, body)
+            elif CONTROL_SOURCE in header:
+                # incoming message for source_control endpoint
+                event = header.split("/")[-1]
+                LOGGER.debug("CONTROL_SOURCE endpoint %s", event)
+                if self._source_controls_callback:
+                    self._source_controls_callback(event, request_id, body)
             elif request_id in self._subscriptions:
                 # this is callback for one of our subscriptions
-                self._subscriptions[request_id]["callback"](body)
+                for callback in list(self._subscriptions[request_id]["callbacks"]):
+                    try:
+                        callback(body)
+                    except Exception:  # pylint: disable=broad-except
+                        LOGGER.exception("Error in subscription callback")
             else:
                 # this is just a result for one of our requests
                 self._results[request_id] = body
@@ -196,30 +280,14 @@ class RoonApiWebSocket(
         if not self.connected:
             LOGGER.error("Connection is not (yet) ready!")
             return
-        body = json.dumps(body)
-        msg = (
-            "MOO/1 CONTINUE Changed\nRequest-Id: %s\nContent-Length: %s\nContent-Type: application/json\n\n%s"
-            % (request_id, len(body), body)
-        )
-        msg = bytes(msg, "utf-8")
-        self._socket.send(msg, 0x2)
+        self._send("MOO/1 CONTINUE Changed", request_id, body)
 
     def send_complete(self, request_id, name, body=""):
         """Send complete message if socket open."""
         if not self.connected:
             LOGGER.error("Connection is not (yet) ready!")
             return
-        msg = "MOO/1 COMPLETE %s\nRequest-Id: %s" % (name, request_id)
-        if body:
-            body = json.dumps(body)
-            msg += "\nContent-Length: %s\nContent-Type: application/json\n\n%s" % (
-                len(body),
-                body,
-            )
-        else:
-            msg += "\n\n"
-        msg = bytes(msg, "utf-8")
-        self._socket.send(msg, 0x2)
+        self._send("MOO/1 COMPLETE %s" % name, request_id, body or None)
 
     def send_request(
         self, command, body=None, content_type="application/json", header_type="REQUEST"
@@ -228,17 +296,19 @@ class RoonApiWebSocket(
         if not self.connected:
             LOGGER.error("Connection is not (yet) ready!")
             return False
-        request_id = self._requestid
-        self._requestid += 1
-        self._results[request_id] = None
+        with self._request_lock:
+            request_id = self._requestid
+            self._requestid += 1
+            self._results[request_id] = None
+        self._send("MOO/1 REQUEST %s" % command, request_id, body, content_type)
+        return request_id
+
+    def _send(self, first_line, request_id, body=None, content_type="application/json"):
+        """Send a MOO message, with the Content-Length of the body in bytes."""
+        msg = "%s\nRequest-Id: %s" % (first_line, request_id)
         if body is None:
-            msg = "MOO/1 REQUEST %s\nRequest-Id: %s\n\n" % (command, request_id)
+            data = b""
         else:
-            body = json.dumps(body)
-            msg = (
-                "MOO/1 REQUEST %s\nRequest-Id: %s\nContent-Length: %s\nContent-Type: %s\n\n%s"
-                % (command, request_id, len(body), content_type, body)
-            )
-        msg = bytes(msg, "utf-8")
-        self._socket.send(msg, 0x2)
-        return request_id
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            msg += "\nContent-Length: %s\nContent-Type: %s" % (len(data), content_type)
+        self._socket.send(bytes(msg + "\n\n", "utf-8") + data, 0x2)
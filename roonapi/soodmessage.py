@@ -18,25 +18,34 @@ SOOD\x02Q<1bytelen>query_service_id<2bytelen>00720724-5143-4a9b-abac-0e50cba674b
 
 Response format:
 SOOD\x02R<1bytelen>name<2bytelen><the_name><1bytelen>display_version<2bytelen><the_version><1bytelen>unique_id<2bytelen><the_id><1bytelen>service_id<twobytelen>00720724-5143-4a9b-abac-0e50cba674bb<1bytelen>tcp_port<twobytelen><the_port><1bytelen>http_port<twobytelen><the_port><1bytelen>_tid<twobytelen>c64e3888-f2f2-4c4a-9f89-2093ae4217a6
+
+A response repeats the _tid of the query it answers, so query creates a new one
+for every query. decode parses a message in place, from a memoryview.
 """
 
 
+import uuid
 from enum import Enum, auto
 
+SERVICE_ID = "00720724-5143-4a9b-abac-0e50cba674bb"
+
+_PREFIX = b"SOOD\x02"
+_TYPES = {ord("Q"): "QUERY", ord("R"): "RESPONSE"}
+
 
 class FormatException(Exception):
     """Exception to be raised on errors in a binary SOOD message."""
 
     def __init__(self, message):
         """Init with the message that causes the error."""
-        Exception.__init__()
+        Exception.__init__(self, message)
         self.message = message
 
 
 class SOODMessage:  # pylint: disable=too-few-public-methods
     """Class for parsing SOOD messages."""
 
-    __MESSAGE_PREFIX__ = b"SOOD\x02"
+    __MESSAGE_PREFIX__ = _PREFIX
 
     class SOODMessageType(Enum):
         """Symbolic names for the message types."""
@@ -50,63 +59,97 @@ class SOODMessage:  # pylint: disable=too-few-public-methods
 
     def __init__(self, message):
         """Init with the message to parse."""
-        if not message.startswith(self.__MESSAGE_PREFIX__):
+        if memoryview(message)[: len(_PREFIX)] != _PREFIX:
             raise FormatException("Error in message header")
         self._message = message
-        self._current_position = len(self.__MESSAGE_PREFIX__)
-
-    def _parse_property(self, size_of_size):
-        length = int.from_bytes(
-            self._message[
-                self._current_position : self._current_position + size_of_size
-            ],
-            "big",
-        )
-        self._current_position += size_of_size
-        if self._current_position + length > len(self._message):
-            return None
-        part_string = self._message[
-            self._current_position : self._current_position + length
-        ].decode()
-        self._current_position += len(part_string)
-        return part_string
-
-    def _parse_properties(self):
-        properties = {}
-        while self._current_position < len(self._message):
-            part_key = self._parse_property(1)
-            if part_key is None:
-                return None
-            part_value = self._parse_property(2)
-            if part_value is None:
-                return None
-            properties[part_key] = part_value
-        return properties
-
-    def _parse_type(self):
-        type_letter = chr(self._message[self._current_position])
-        self._current_position += 1
-        if type_letter not in ["Q", "R"]:
-            return None
-        return (
-            self.SOODMessageType.QUERY
-            if type_letter == "Q"
-            else self.SOODMessageType.RESPONSE
-        )
 
     @property
     def as_dictionary(self):
         """Expose the message as a dictionary."""
-        message_type = self._parse_type()
-        if message_type is None:
-            raise FormatException("Error in message type")
-
-        message_properties = self._parse_properties()
-        if message_properties is None:
-            raise FormatException("Error in property")
-
-        message = {
+        message_type, message_properties = decode(self._message)
+        return {
             "type": message_type,
             "properties": message_properties,
         }
-        return message
+
+
+def decode(message):
+    """
+    Parse a SOOD message without copying it.
+
+    params:
+        message: bytes, bytearray or memoryview with the received message
+    returns: tuple of the SOODMessage.SOODMessageType and a dict of the properties
+    """
+    view = memoryview(message)
+    end = len(view)
+    if view[: len(_PREFIX)] != _PREFIX:
+        raise FormatException("Error in message header")
+    position = len(_PREFIX)
+    if position >= end or view[position] not in _TYPES:
+        raise FormatException("Error in message type")
+    message_type = SOODMessage.SOODMessageType[_TYPES[view[position]]]
+    position += 1
+
+    properties = {}
+    while position < end:
+        key, position = _decode_string(view, position, 1)
+        value, position = _decode_string(view, position, 2)
+        properties[key] = value
+    return message_type, properties
+
+
+def _decode_string(view, position, size_of_size):
+    """Return the string at position, preceded by its length, and the position after it."""
+    start = position + size_of_size
+    if start > len(view):
+        raise FormatException("Error in property")
+    length = int.from_bytes(view[position:start], "big")
+    end = start + length
+    if end > len(view):
+        raise FormatException("Error in property")
+    try:
+        return str(view[start:end], "utf-8"), end
+    except UnicodeDecodeError as exc:
+        raise FormatException("Error in property: %s" % exc) from exc
+
+
+def encode(message_type, properties):
+    """
+    Build a SOOD message.
+
+    params:
+        message_type: SOODMessage.SOODMessageType of the message
+        properties: dict of the string properties
+    returns: the message as bytes
+    """
+    message = bytearray(_PREFIX)
+    message += b"Q" if message_type == SOODMessage.SOODMessageType.QUERY else b"R"
+    for key, value in properties.items():
+        key, value = key.encode(), value.encode()
+        if len(key) > 0xFF or len(value) > 0xFFFF:
+            raise FormatException("Property %r is too long" % key)
+        message += len(key).to_bytes(1, "big") + key
+        message += len(value).to_bytes(2, "big") + value
+    return bytes(message)
+
+
+def query(tid=None):
+    """
+    Build a query for roon cores.
+
+    params:
+        tid: the transaction id to send, a new one if not set
+    returns: tuple of the message and its transaction id, which the answers repeat
+    """
+    tid = tid or str(uuid.uuid4())
+    message = encode(
+        SOODMessage.SOODMessageType.QUERY, {"query_service_id": SERVICE_ID, "_tid": tid}
+    )
+    return message, tid
+
+
+def answers(properties, tids):
+    """Return whether a response with properties answers one of the queries with tids."""
+    tid = properties.get("_tid")
+    return tid is None or tid in tids
@@ -0,0 +1,136 @@
+"""
+Module defining a sender that coalesces volume changes.
+
+Volume knobs send many small changes a second. Sending each of them as a
+request makes the caller wait and lets the core work through steps that are
+already stale, so pending changes of an output are merged and sent at a
+limited rate from a background thread instead.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import LOGGER
+
+
+class VolumeCoalescer(threading.Thread):
+    """Class to merge volume changes per output and send them at a limited rate."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, send, max_rate=10, max_workers=4, clock=time.monotonic):
+        """
+        Create the sender, call start to begin sending.
+
+        send: function called with output_id, value, method and the joined contexts of
+              the merged changes, to send a change
+        max_rate: the maximum number of volume changes sent per second for an output
+        max_workers: the number of outputs sent to at the same time, so a slow output
+                     does not hold up the others
+        clock: function returning the time in seconds, to control the rate in tests
+        """
+        self._send = send
+        self._interval = 1 / max_rate
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._pending = {}
+        self._sent_at = {}
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._exit = False
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    # pylint: disable=too-many-arguments
+    def change(
+        self, output_id, value, method="absolute", volume_data=None, context=None
+    ):
+        """
+        Queue a volume change, merged with the change still pending for the output.
+
+        A new absolute volume replaces the pending change, relative changes are added
+        to it. Returns at once.
+
+        params:
+            output_id: the id of the output
+            value: the new raw volume value, or the raw increment
+            method: how to interpret the volume ('absolute'|'relative')
+            volume_data: the volume dict of the output, to keep merged values in range
+            context: optional list passed to send with the change, the lists of merged
+                     changes are joined (eg the optimistic changes to settle)
+        """
+        with self._condition:
+            pending = self._pending.get(output_id)
+            contexts = list(context or [])
+            if pending is not None:
+                contexts = pending[2] + contexts
+            if pending is None or method == "absolute":
+                self._pending[output_id] = (method, value, contexts)
+            else:
+                pending_method, pending_value, _ = pending
+                value = pending_value + value
+                if pending_method == "absolute" and volume_data:
+                    value = max(volume_data["min"], min(volume_data["max"], value))
+                self._pending[output_id] = (pending_method, value, contexts)
+            self._condition.notify()
+
+    @property
+    def pending(self):
+        """Return a dict of output id to the (method, value) change waiting to be sent."""
+        with self._condition:
+            return {
+                output_id: (method, value)
+                for output_id, (method, value, _) in self._pending.items()
+            }
+
+    def run(self):
+        """Send the pending changes until stopped."""
+        with self._condition:
+            while not self._exit:
+                self._condition.wait(self._send_ready())
+
+    def stop(self):
+        """Stop sending, pending changes are dropped."""
+        with self._condition:
+            self._exit = True
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+
+    def wake(self):
+        """Check for changes that can be sent, eg after the clock was moved on."""
+        with self._condition:
+            self._condition.notify()
+
+    def _send_ready(self):
+        """
+        Start sending the changes of the outputs that are not sent to or rate limited.
+
+        returns: seconds until the next output can be sent to, None to wait for a change
+        """
+        now = self._clock()
+        wait = None
+        for output_id in list(self._pending):
+            if output_id in self._in_flight:
+                # Sent when the change in flight is done
+                continue
+            sent_at = self._sent_at.get(output_id)
+            ready_in = 0 if sent_at is None else sent_at + self._interval - now
+            if ready_in > 0:
+                wait = ready_in if wait is None else min(wait, ready_in)
+                continue
+            method, value, context = self._pending.pop(output_id)
+            self._sent_at[output_id] = now
+            self._in_flight.add(output_id)
+            self._executor.submit(self._send_change, output_id, method, value, context)
+        return wait
+
+    def _send_change(self, output_id, method, value, context):
+        LOGGER.debug("Sending volume %s %s for %s", method, value, output_id)
+        try:
+            self._send(output_id, value, method, context)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Could not change the volume of %s", output_id)
+        finally:
+            with self._condition:
+                self._in_flight.discard(output_id)
+                self._condition.notify()
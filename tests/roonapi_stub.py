@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A RoonApi that talks to a fake socket instead of a roon core, for the tests."""
+
+import threading
+
+from roonapi import RoonApi
+
+APPINFO = {
+    "extension_id": "python_roon_test",
+    "display_name": "Python library for Roon",
+    "display_version": "1.0.0",
+    "publisher": "pyroon",
+    "email": "test@example.com",
+}
+
+
+class StubSocket(threading.Thread):
+    """
+    Answer requests with a handler instead of sending them to a core.
+
+    Like the websocket it is a thread, set run and start it to run code as a callback.
+    """
+
+    failed_state = False
+    connected = True
+
+    def __init__(self, handler):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.results = {}
+        self.requests = []
+        self.subscriptions = []
+        self.sent = []
+        self._handler = handler
+
+    def send_request(self, command, body=None):
+        request_id = len(self.requests)
+        self.requests.append((command, body))
+        self.results[request_id] = self._handler(command, body)
+        return request_id
+
+    def subscribe(self, service, endpoint, callback, opt_data=None):
+        self.subscriptions.append((service, endpoint, callback, opt_data))
+
+    def unsubscribe(self, service, endpoint, callback=None, opt_data=None):
+        self.subscriptions = [
+            subscription
+            for subscription in self.subscriptions
+            if subscription[:2] != (service, endpoint)
+            or callback not in (None, subscription[2])
+        ]
+
+    def send_continue(self, request_id, body):
+        self.sent.append(("CONTINUE", request_id, body))
+
+    def send_complete(self, request_id, name, body=""):
+        self.sent.append(("COMPLETE", request_id, name))
+
+    def stop(self):
+        pass
+
+
+class StubRoonApi(RoonApi):
+    """RoonApi connected to a StubSocket, handler(command, body) returns the results."""
+
+    def __init__(self, handler, zones=None, outputs=None):
+        self._handler = handler
+        self._state_callbacks = []
+        super().__init__(APPINFO, None, "stub", 9330, blocking_init=False)
+        self._zones = zones if zones is not None else {}
+        self._outputs = outputs if outputs is not None else {}
+
+    @property
+    def socket(self):
+        """Return the stub socket."""
+        return self._roonsocket
+
+    def _server_setup(self, host, port):
+        self._host = host
+        self._port = port
+        self._roonsocket = StubSocket(self._handler)
+        self.ready = True
+
+
+def level(title, *items, subtitle=None, hint="list"):
+    return {"title": title, "subtitle": subtitle, "hint": hint, "items": list(items)}
+
+
+def album(title, artist):
+    return level(
+        title,
+        level("Play Album", level("Play Now", hint="action"), hint="action_list"),
+        level("Track 1", hint="action_list"),
+        subtitle=artist,
+    )
+
+
+TREE = level(
+    "Explore",
+    level(
+        "Library",
+        level(
+            "Artists",
+            level(
+                "Neil Young",
+                album("Harvest", "Neil Young"),
+                album("Greatest Hits", "Neil Young"),
+            ),
+            level("Nick Drake", album("Pink Moon", "Nick Drake")),
+        ),
+        level(
+            "Albums", album("Harvest", "Neil Young"), album("Pink Moon", "Nick Drake")
+        ),
+    ),
+    level("Genres", level("Folk")),
+    level(
+        "My Live Radio",
+        level("BBC Radio 4", level("Play Radio", hint="action"), hint="action_list"),
+    ),
+)
+
+
+def _label(item):
+    if item["subtitle"]:
+        return "%s (%s)" % (item["title"], item["subtitle"])
+    return item["title"]
+
+
+class FakeBrowseService:
+    """
+    The browse levels of the sessions of a core, searches return search_results.
+
+    The levels start at tree, loads are recorded as (title, offset, count) in loads.
+
+    Item keys are "<generation>:<index>", increase generation to make the keys
+    that were loaded before stale. Stale keys are answered with stale_reply.
+    """
+
+    def __init__(self, search_results=None, tree=TREE):
+        self.tree = tree
+        self.generation = 0
+        self.stale_reply = {"action": "message", "is_error": True, "message": "Stale"}
+        self.stacks = {}
+        self.search_results = search_results or {}
+        self.calls = []
+        self.loads = []
+        self.played = []
+
+    def __call__(self, command, body):
+        """Answer a request like the browse service of the core."""
+        if command.endswith("/browse"):
+            return self.browse_browse(body)
+        return self.browse_load(body)
+
+    def _stack(self, opts):
+        key = (opts["hierarchy"], opts.get("multi_session_key"))
+        return self.stacks.setdefault(key, [self.tree])
+
+    def _list(self, stack):
+        return {
+            "action": "list",
+            "list": {
+                "title": stack[-1]["title"],
+                "level": len(stack) - 1,
+                "count": len(stack[-1]["items"]),
+            },
+        }
+
+    def browse_browse(self, opts):
+        stack = self._stack(opts)
+        action = [
+            key
+            for key in opts
+            if key not in ("hierarchy", "zone_or_output_id", "multi_session_key")
+        ]
+        self.calls.append((action[0], opts[action[0]]))
+        if "input" in opts:
+            stack[:] = [self.search_results[opts["input"]]]
+        elif opts.get("pop_all"):
+            stack[:] = [self.tree]
+        elif "pop_levels" in opts:
+            del stack[max(1, len(stack) - opts["pop_levels"]) :]
+        elif "item_key" in opts:
+            generation, index = opts["item_key"].split(":")
+            if int(generation) != self.generation:
+                return self.stale_reply
+            child = stack[-1]["items"][int(index)]
+            if child["hint"] == "action":
+                self.played.append([_label(item) for item in stack[1:] + [child]])
+                return {"action": "none"}
+            stack.append(child)
+        return self._list(stack)
+
+    def browse_load(self, opts):
+        current = self._stack(opts)[-1]
+        self.loads.append((current["title"], opts["offset"], opts["count"]))
+        items = current["items"]
+        return {
+            "items": [
+                {
+                    "title": item["title"],
+                    "subtitle": item["subtitle"],
+                    "item_key": "%d:%d" % (self.generation, index),
+                    "hint": item["hint"],
+                }
+                for index, item in enumerate(items)
+            ][opts["offset"] : opts["offset"] + opts["count"]]
+        }
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of the browse helpers."""
+
+import json
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+from roonapi_stub import TREE, FakeBrowseService, StubRoonApi, album, level
+from roonapi.browse import (
+    BrowsePageSizer,
+    EXACT_MATCH,
+    BrowseCursor,
+    BrowseItem,
+    BrowsePageSizer,
+    BrowseSessionPool,
+    BrowseSessionTimeout,
+    rank_items,
+    search_terms,
+)
+
+
+def test_search_terms():
+    assert search_terms(["Library", "Artists", "Neil Young"]) == ("Artists", [])
+    assert search_terms(["Library", "Artists", "Neil Young", "Harvest"]) == (
+        "Albums",
+        ["Neil Young"],
+    )
+    assert search_terms(["My Live Radio", "BBC Radio 4"]) == (None, [])
+
+
+def test_rank_items():
+    items = [
+        {"title": "Harvest Moon", "subtitle": "Neil Young"},
+        {"title": "The Harvest"},
+        {"title": "Harvest", "subtitle": "Someone Else"},
+        {"title": "harvest", "subtitle": "Neil  Young"},
+        {"title": "Tonight's the Night"},
+    ]
+    ranked = rank_items(items, "Harvest", ["Neil Young"])
+    assert [item for _, item in ranked] == [
+        items[3],
+        items[2],
+        items[0],
+        items[1],
+    ]
+    assert ranked[0][0] > ranked[1][0] >= EXACT_MATCH > ranked[2][0]
+    assert rank_items(items, "Zuma") == []
+
+
+def test_page_sizer():
+    sizer = BrowsePageSizer(min_size=20, max_size=500, target_latency=0.25)
+
+    # Small requests only load what is wanted, and no small last page is left
+    assert sizer.page_size(3) == 3
+    assert sizer.page_size(110) == 110
+    assert sizer.page_size(1000) == 100
+
+    # Looking for an item starts small and grows with every page
+    assert sizer.page_size(10000, find=True, page=0) == 100
+    sizer.record_page(0.01, 100)
+    assert sizer.page_size(10000) == 500
+    assert sizer.page_size(10000, find=True, page=1) == 200
+
+    # Slow pages shrink the page size, within the bounds
+    for _ in range(10):
+        sizer.record_page(1.0, 100)
+    assert sizer.page_size(10000) == 25
+    sizer.record_call(12)
+    assert sizer.stats["pages"] == 11
+    assert sizer.stats["last_call_pages"] == 12
+
+
+def test_browse_item():
+    item = {
+        "title": "Harvest",
+        "subtitle": "Neil Young",
+        "item_key": "12:3",
+        "hint": "list",
+        "unknown": 1,
+    }
+    compact = BrowseItem.from_dict(item)
+    assert compact["title"] == "Harvest"
+    assert compact.get("image_key") is None
+    assert compact.get("unknown") == 1
+    assert compact.as_dict() == item
+    assert compact == item
+    with pytest.raises(KeyError):
+        compact["image_key"]
+
+
+def _load_pages(tracks, page_size=100):
+    """Decode browse pages like the websocket does, one JSON body per page."""
+    for offset in range(0, tracks, page_size):
+        body = json.dumps(
+            {
+                "items": [
+                    {
+                        "title": "Track %d" % index,
+                        "subtitle": "Artist %d" % (index // 100),
+                        "image_key": "image-%d" % (index // 10),
+                        "item_key": "%d:%d" % (offset, index),
+                        "hint": "action_list",
+                    }
+                    for index in range(offset, min(tracks, offset + page_size))
+                ]
+            }
+        )
+        yield json.loads(body)["items"]
+
+
+def test_browse_item_memory():
+    items = [item for page in _load_pages(200) for item in page]
+    compact = [BrowseItem.from_dict(item) for item in items]
+    assert not hasattr(compact[0], "__dict__")
+    assert sys.getsizeof(compact[0]) < sys.getsizeof(items[0])
+    # Strings repeated over items are shared, even when decoded from different pages
+    assert compact[0].subtitle is compact[99].subtitle
+    assert compact[100].image_key is compact[109].image_key
+    assert items[0]["subtitle"] is not items[99]["subtitle"]
+    # Equal to item dicts, so not hashable
+    with pytest.raises(TypeError):
+        hash(compact[0])
+
+
+def _retained_memory(convert, tracks):
+    tracemalloc.start()
+    items = [convert(item) for page in _load_pages(tracks) for item in page]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(items) == tracks
+    return retained
+
+
+@pytest.mark.skipif(
+    not os.environ.get("BROWSE_BENCHMARK"), reason="set BROWSE_BENCHMARK to run"
+)
+def test_browse_item_retained_memory():
+    tracks = 20000
+    as_dicts = _retained_memory(lambda item: item, tracks)
+    as_items = _retained_memory(BrowseItem.from_dict, tracks)
+    assert as_items < as_dicts * 0.7, "dicts: %d bytes, BrowseItems: %d bytes" % (
+        as_dicts,
+        as_items,
+    )
+
+
+def test_session_pool_timeout():
+    pool = BrowseSessionPool(size=1)
+
+    def browse():
+        with pool.session(timeout=0.05) as multi_session_key:
+            yield multi_session_key
+
+    abandoned = browse()
+    assert next(abandoned) == "pyroon-1"
+    with pytest.raises(BrowseSessionTimeout):
+        with pool.session(timeout=0.05):
+            pass
+    abandoned.close()
+    with pool.session(timeout=0.05) as multi_session_key:
+        assert multi_session_key == "pyroon-1"
+
+
+def test_cursor_shared_prefix():
+    service = FakeBrowseService()
+    cursor = BrowseCursor(service)
+    assert cursor.navigate("zone", ["Library", "Artists", "Neil Young"])
+    assert cursor.path == ["Library", "Artists", "Neil Young"]
+    assert service.calls[0] == ("pop_all", True)
+
+    service.calls = []
+    assert cursor.navigate("zone", ["Library", "Artists", "Nick Drake"])
+    assert service.calls == [("pop_levels", 1), ("item_key", "0:1")]
+    assert cursor.path == ["Library", "Artists", "Nick Drake"]
+    assert cursor.count == 1
+
+    service.calls = []
+    assert cursor.navigate("zone", ["Library", "Artists", "Nick Drake"])
+    assert service.calls == [("refresh_list", True)]
+
+
+def test_cursor_diverging_path():
+    service = FakeBrowseService()
+    cursor = BrowseCursor(service)
+    assert cursor.navigate("zone", ["Library", "Artists", "Neil Young"])
+    service.calls = []
+    assert cursor.navigate("zone", ["Genres"])
+    assert service.calls == [("pop_levels", 3), ("item_key", "0:1")]
+    assert cursor.path == ["Genres"]
+    assert [item["title"] for item in cursor.items("zone")] == ["Folk"]
+
+    assert not cursor.navigate("zone", ["Library", "Composers"], report_error=False)
+
+
+def test_cursor_level_mismatch():
+    service = FakeBrowseService()
+    cursor = BrowseCursor(service)
+    assert cursor.navigate("zone", ["Library", "Artists", "Neil Young"])
+
+    # The core lost the session, eg after a restart
+    service.stacks.clear()
+    service.calls = []
+    assert cursor.navigate("zone", ["Library", "Albums"])
+    assert service.calls == [
+        ("pop_levels", 2),
+        ("pop_all", True),
+        ("item_key", "0:0"),
+        ("item_key", "0:1"),
+    ]
+    assert cursor.path == ["Library", "Albums"]
+    assert cursor.count == 2
+
+
+def test_play_search_needs_context():
+    albums = level("Albums", album("Greatest Hits", "ABBA"))
+    service = FakeBrowseService({"Greatest Hits": level("Search", albums)})
+    roonapi = StubRoonApi(service)
+    path = ["Library", "Artists", "Neil Young", "Greatest Hits"]
+
+    # Only another artist's album was found, so the path is walked instead
+    assert roonapi.play_media("zone", path, search=True)
+    assert service.played == [
+        [
+            "Library",
+            "Artists",
+            "Neil Young",
+            "Greatest Hits (Neil Young)",
+            "Play Album",
+            "Play Now",
+        ]
+    ]
+
+    service.played = []
+    albums["items"].append(album("Greatest Hits", "Neil Young"))
+    assert roonapi.play_media("zone", path, search=True)
+    assert service.played == [
+        ["Albums", "Greatest Hits (Neil Young)", "Play Album", "Play Now"]
+    ]
+    roonapi.stop()
+
+
+def test_play_search_without_category():
+    albums = level("Albums", album("BBC Radio 4", "Some Comedian"))
+    service = FakeBrowseService({"BBC Radio 4": level("Search", albums)})
+    roonapi = StubRoonApi(service)
+
+    # The path does not say what the media is, so the album is not played
+    assert roonapi.play_media("zone", ["My Live Radio", "BBC Radio 4"], search=True)
+    assert service.played == [["My Live Radio", "BBC Radio 4", "Play Radio"]]
+    assert ("input", "BBC Radio 4") not in service.calls
+    roonapi.stop()
+
+
+def tracks_api():
+    tracks = level("Tracks", *[level("Track %d" % index) for index in range(250)])
+    service = FakeBrowseService(tree=level("Explore", level("Library", tracks)))
+    roonapi = StubRoonApi(service)
+    roonapi.browse_page_sizer = BrowsePageSizer(min_size=100, max_size=100)
+    roonapi._browse_sessions = BrowseSessionPool(size=1)
+    return roonapi, service
+
+
+def track_loads(service):
+    return [load[1:] for load in service.loads if load[0] == "Tracks"]
+
+
+def session_free(roonapi):
+    with roonapi._browse_sessions.session(timeout=0.05):
+        return True
+
+
+def test_browse_items():
+    roonapi, service = tracks_api()
+    items = roonapi.browse_items("zone", ["Library", "Tracks"])
+    assert next(items)["title"] == "Track 0"
+    assert track_loads(service) == [(0, 100)]
+    items.close()
+    assert session_free(roonapi)
+
+    service.loads = []
+    items = list(roonapi.browse_items("zone", ["Library", "Tracks"]))
+    assert [item["title"] for item in items] == ["Track %d" % i for i in range(250)]
+    assert track_loads(service) == [(0, 100), (100, 100), (200, 50)]
+    assert session_free(roonapi)
+
+    service.loads = []
+    items = list(roonapi.browse_items("zone", ["Library", "Tracks"], count=120))
+    assert len(items) == 120
+    assert track_loads(service) == [(0, 100), (100, 20)]
+    assert list(roonapi.browse_items("zone", ["Library", "Nothing"])) == []
+    assert session_free(roonapi)
+    roonapi.stop()
+
+
+def test_iter_and_list_media():
+    roonapi, service = tracks_api()
+    media = roonapi.iter_media("zone", ["Library", "Tracks", "Track 1"], count=3)
+    assert [item["title"] for item in media] == ["Track 1", "Track 10", "Track 11"]
+    assert track_loads(service) == [(0, 100)]
+    assert session_free(roonapi)
+
+    media = roonapi.iter_media("zone", ["Library", "Tracks", "__all__"], compact=True)
+    assert next(media).title == "Track 0"
+    media.close()
+    assert session_free(roonapi)
+
+    titles = roonapi.list_media("zone", ["Library", "Tracks", "Track 24"])
+    assert titles == ["Track 24"] + ["Track %d" % i for i in range(240, 250)]
+    assert roonapi.list_media("zone", ["Library", "Nothing", "Track 1"]) is None
+    assert session_free(roonapi)
+    roonapi.stop()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of bulk volume commands, without a roon core."""
+
+from roonapi_stub import StubRoonApi
+
+ERROR = {"message": "InvalidRequest"}
+
+
+def make_output(output_id):
+    return {
+        "output_id": output_id,
+        "zone_id": "zone",
+        "display_name": output_id,
+        "volume": {"min": -80, "max": 0, "step": 1, "value": -40, "is_muted": False},
+    }
+
+
+def test_bulk_operations():
+    sent = []
+
+    def handler(command, body):
+        sent.append(body)
+        return ERROR if body["output_id"] == "broken" else "MOO/1 COMPLETE Success"
+
+    outputs = {output_id: make_output(output_id) for output_id in ("out", "broken")}
+    roonapi = StubRoonApi(handler, outputs=outputs)
+    results = roonapi.set_volumes({"out": 50, "broken": 25, "missing": 10})
+    # An error reply of the core is passed on, an exception gives None
+    assert results == {
+        "out": "MOO/1 COMPLETE Success",
+        "broken": ERROR,
+        "missing": None,
+    }
+    assert sorted(data["value"] for data in sent) == [-60, -40]
+
+    assert roonapi.set_volumes({"out": -10}, percent=False) == {
+        "out": "MOO/1 COMPLETE Success"
+    }
+    assert sent[-1]["value"] == -10
+
+    sent.clear()
+    assert roonapi.mute_outputs({"out": True, "broken": False}) == {
+        "out": "MOO/1 COMPLETE Success",
+        "broken": ERROR,
+    }
+    assert {data["how"] for data in sent} == {"mute", "unmute"}
+    assert roonapi.set_volumes({}) == {}
+    roonapi.stop()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of the helpers for provided controls, without a roon core."""
+
+import copy
+import time
+
+from roonapi.controls import ControlDispatcher, ControlUpdateBuffer
+from roonapi_stub import StubRoonApi, StubSocket
+
+
+def test_updates_are_merged():
+    sent = []
+    buffer = ControlUpdateBuffer(sent.append, interval=0.05)
+    buffer.start()
+    amp = {"control_key": "amp", "volume_value": 1}
+    for value in range(50):
+        amp["volume_value"] = value
+        buffer.change("amp", amp)
+    buffer.add("new", {"control_key": "new"})
+    buffer.change("new", {"control_key": "new", "volume_value": 3})
+    buffer.add("gone", {"control_key": "gone"})
+    buffer.remove("gone")
+    buffer.remove("old")
+    time.sleep(0.2)
+    buffer.stop()
+    assert sent == [
+        {
+            "controls_changed": [{"control_key": "amp", "volume_value": 49}],
+            "controls_added": [{"control_key": "new", "volume_value": 3}],
+            "controls_removed": [{"control_key": "old"}],
+        }
+    ]
+
+
+def test_flush():
+    sent = []
+    buffer = ControlUpdateBuffer(sent.append, interval=60)
+    buffer.start()
+    buffer.change("amp", {"control_key": "amp"})
+    buffer.flush()
+    buffer.flush()
+    assert sent == [{"controls_changed": [{"control_key": "amp"}]}]
+    buffer.stop()
+
+
+def test_dispatcher_order_and_merge():
+    completed = []
+    handled = []
+    dispatcher = ControlDispatcher(
+        lambda request_id, name: completed.append(request_id)
+    )
+
+    def slow(data):
+        handled.append(data)
+        time.sleep(0.05)
+
+    def merge(pending, data):
+        return pending + data
+
+    dispatcher.submit("amp", 1, slow, 1, merge)
+    time.sleep(0.01)
+    # Waiting behind the first request, so merged into one
+    for request_id in range(2, 6):
+        dispatcher.submit("amp", request_id, slow, 1, merge)
+    dispatcher.submit("tuner", 6, slow, 100)
+    time.sleep(0.3)
+    dispatcher.stop()
+    assert handled == [1, 100, 4] or handled == [100, 1, 4]
+    assert sorted(completed) == [1, 2, 3, 4, 5, 6]
+    assert completed.index(5) > completed.index(1)
+
+
+def test_dispatcher_reports_errors():
+    completed = []
+    dispatcher = ControlDispatcher(
+        lambda request_id, name: completed.append((request_id, name))
+    )
+    dispatcher.submit("amp", 1, lambda data: 1 / data, 0)
+    time.sleep(0.05)
+    dispatcher.stop()
+    assert completed == [(1, "Error")]
+
+
+class Socket(StubSocket):
+    def send_complete(self, request_id, name, body=""):
+        self.sent.append((request_id, name))
+
+    def send_continue(self, request_id, body):
+        self.sent.append((request_id, copy.deepcopy(body)))
+
+
+def make_api():
+    roonapi = StubRoonApi(None)
+    roonapi._roonsocket = Socket(None)
+    return roonapi
+
+
+def test_source_controls():
+    roonapi = make_api()
+
+    def standby(control_key, event):
+        roonapi.update_source_control(control_key, "standby")
+
+    roonapi.register_source_control("amp", "Amp", standby, status="selected")
+    roonapi._on_source_control_request("subscribe_controls", 20, None)
+    roonapi._on_source_control_request("standby", 21, {"control_key": "amp"})
+    time.sleep(0.05)
+    roonapi.flush_source_controls()
+    assert roonapi._roonsocket.sent == [
+        (
+            20,
+            {
+                "controls_added": [
+                    {
+                        "display_name": "Amp",
+                        "supports_standby": True,
+                        "status": "selected",
+                        "control_key": "amp",
+                    }
+                ]
+            },
+        ),
+        (21, "Success"),
+        (
+            20,
+            {
+                "controls_changed": [
+                    {
+                        "display_name": "Amp",
+                        "supports_standby": True,
+                        "status": "standby",
+                        "control_key": "amp",
+                    }
+                ]
+            },
+        ),
+    ]
+    roonapi.stop()
+
+
+def test_merged_volume_in_range():
+    roonapi = StubRoonApi(None)
+    roonapi.register_volume_control("amp", "Amp", None, volume_min=-80, volume_max=0)
+    absolute = {"event": "set_volume", "absolute": -4}
+    merged = roonapi._merge_volume_changes(
+        "amp", absolute, {"event": "set_volume", "relative": 10}
+    )
+    assert merged == {"event": "set_volume", "absolute": 0}
+    merged = roonapi._merge_volume_changes(
+        "amp", absolute, {"event": "set_volume", "relative": -100}
+    )
+    assert merged == {"event": "set_volume", "absolute": -80}
+    roonapi.stop()
+
+
+def test_updates_before_subscription():
+    roonapi = make_api()
+    roonapi.register_source_control("amp", "Amp", None, status="selected")
+    roonapi.register_volume_control("vol", "Amp", None)
+    assert roonapi.update_source_control("amp", "standby")
+    assert roonapi.update_volume_control("vol", volume=30, mute=True)
+    assert not roonapi.update_source_control("dac", "standby")
+    assert not roonapi.update_volume_control("dac", volume=30)
+
+    roonapi._on_source_control_request("subscribe_controls", 20, None)
+    roonapi._on_volume_control_request("subscribe_controls", 21, None)
+    added = roonapi.socket.sent
+    assert added[0][1]["controls_added"][0]["status"] == "standby"
+    assert added[1][1]["controls_added"][0]["volume_value"] == 30
+    assert added[1][1]["controls_added"][0]["is_muted"] is True
+    # Other instances have their own controls
+    assert not StubRoonApi(None)._source_controls
+    roonapi.stop()
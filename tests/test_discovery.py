@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of discovery, without a roon core."""
+
+import asyncio
+import socket
+import threading
+import time
+
+from roonapi import RoonDiscovery, RoonDiscoveryService, discover_async
+from roonapi.constants import SOOD_PORT
+from roonapi.discovery import core_from_response
+from roonapi.soodmessage import decode
+
+
+def sood(message_type, **properties):
+    message = b"SOOD\x02" + message_type
+    for key, value in properties.items():
+        key, value = key.encode(), value.encode()
+        message += len(key).to_bytes(1, "big") + key
+        message += len(value).to_bytes(2, "big") + value
+    return message
+
+
+RESPONSE = sood(
+    b"R",
+    name="Core",
+    display_version="2.0",
+    unique_id="core-1",
+    service_id="00720724-5143-4a9b-abac-0e50cba674bb",
+    http_port="9330",
+)
+
+
+def test_core_from_response():
+    core = core_from_response(RESPONSE, ("10.0.0.2", SOOD_PORT))
+    assert core.address == ("10.0.0.2", "9330")
+    assert core.unique_id == "core-1" and core.name == "Core"
+    assert core_from_response(sood(b"Q", query_service_id="x"), ("h", 1)) is None
+    assert core_from_response(b"SOOD\x02R\x05abc", ("h", 1)) is None
+    assert core_from_response(b"HTTP/1.1", ("h", 1)) is None
+
+
+def test_cache_and_wait():
+    service = RoonDiscoveryService(ttl=0.2)
+    assert service.get() is None
+    threading.Timer(
+        0.05, service._seen, (core_from_response(RESPONSE, ("10.0.0.2", 1)),)
+    ).start()
+    assert service.wait_for("core-1", timeout=1).host == "10.0.0.2"
+    assert service.wait_for("core-2", timeout=0.05) is None
+    assert list(service.cores) == ["core-1"]
+    time.sleep(0.25)
+    assert service.cores == {}
+
+
+class QuerySocket:
+    def __init__(self):
+        self.sent = []
+
+    def setsockopt(self, *args):
+        pass
+
+    def sendto(self, data, address):
+        self.sent.append(data)
+
+
+def test_service_checks_tid(monkeypatch):
+    monkeypatch.setattr(
+        "roonapi.discovery.interfaces", lambda: [("127.0.0.1", "127.0.0.1")]
+    )
+    service = RoonDiscoveryService()
+    sock = QuerySocket()
+    service._send_query(sock)
+    tid = decode(sock.sent[0])[1]["_tid"]
+    service._answered(sood(b"R", _tid="other") + RESPONSE[6:], ("10.0.0.2", 1))
+    assert service.cores == {}
+    service._answered(sood(b"R", _tid=tid) + RESPONSE[6:], ("10.0.0.2", 1))
+    assert list(service.cores) == ["core-1"]
+
+
+def respond(sock, *responses):
+    data, address = sock.recvfrom(1024)
+    for response in responses:
+        sock.sendto(response, address)
+
+
+def test_discover_all_interfaces(monkeypatch):
+    monkeypatch.setattr(
+        "roonapi.discovery.interfaces", lambda: [("127.0.0.1", "127.0.0.1")]
+    )
+    other = RESPONSE.replace(b"core-1", b"core-2").replace(b"9330", b"9331")
+    responder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    responder.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    responder.bind(("127.0.0.1", SOOD_PORT))
+    try:
+        threading.Thread(
+            target=respond, args=(responder, RESPONSE, other, RESPONSE)
+        ).start()
+        start = time.monotonic()
+        found = RoonDiscovery(timeout=2, settle=0.1).all()
+        assert sorted(found) == [("127.0.0.1", "9330"), ("127.0.0.1", "9331")]
+        assert time.monotonic() - start < 1
+
+        threading.Thread(target=respond, args=(responder, RESPONSE, other)).start()
+        assert RoonDiscovery("core-2", timeout=2).all() == [("127.0.0.1", "9331")]
+    finally:
+        responder.close()
+
+
+def test_discover_async(monkeypatch):
+    monkeypatch.setattr(
+        "roonapi.discovery.interfaces", lambda: [("127.0.0.1", "127.0.0.1")]
+    )
+    other = RESPONSE.replace(b"core-1", b"core-2").replace(b"9330", b"9331")
+    responder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    responder.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    responder.bind(("127.0.0.1", SOOD_PORT))
+
+    async def collect(core_id=None, timeout=0.3):
+        return [core async for core in discover_async(core_id, timeout)]
+
+    try:
+        threading.Thread(
+            target=respond, args=(responder, RESPONSE, RESPONSE, other)
+        ).start()
+        cores = asyncio.run(collect())
+        assert [core.unique_id for core in cores] == ["core-1", "core-2"]
+
+        threading.Thread(target=respond, args=(responder, RESPONSE, other)).start()
+        start = time.monotonic()
+        cores = asyncio.run(collect("core-2", timeout=2))
+        assert [core.address for core in cores] == [("127.0.0.1", "9331")]
+        assert time.monotonic() - start < 1
+    finally:
+        responder.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of the image client, against a local http server."""
+
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from roonapi import ImageClient, ImageProxy
+from roonapi.images import ImagePrefetcher
+from roonapi.playqueue import QueueModel
+
+requests_seen = []
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        requests_seen.append((self.path, self.headers.get("If-None-Match")))
+        if self.path.startswith("/api/image/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path.startswith("/api/image/slow"):
+            time.sleep(0.2)
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Core:
+    def __init__(self, port):
+        self.port = port
+        self.zones = {}
+        self.state_callbacks = []
+        self.queue_callbacks = {}
+        self.queue_windows = {}
+
+    def register_state_callback(self, callback, event_filter=None):
+        self.state_callbacks.append(callback)
+
+    def unregister_state_callback(self, callback):
+        self.state_callbacks.remove(callback)
+
+    def subscribe_queue(self, zone_or_output_id, callback=None, max_item_count=None):
+        self.queue_windows[zone_or_output_id] = max_item_count
+        model = QueueModel(zone_or_output_id, max_item_count)
+        model.register_callback(callback)
+        self.queue_callbacks[zone_or_output_id] = model.apply
+        return model
+
+    def unsubscribe_queue(self, zone_or_output_id, callback=None):
+        del self.queue_callbacks[zone_or_output_id]
+
+    def get_image(self, image_key, scale="fit", width=500, height=500):
+        return "http://127.0.0.1:%s/api/image/%s?scale=%s&width=%s&height=%s" % (
+            self.port,
+            image_key,
+            scale,
+            width,
+            height,
+        )
+
+
+@pytest.fixture()
+def core():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    requests_seen.clear()
+    yield Core(server.server_address[1])
+    server.shutdown()
+
+
+def test_memory_cache(core):
+    client = ImageClient(core)
+    assert client.get("abc") == b"/api/image/abc?scale=fit&width=500&height=500"
+    assert client.get("abc") == client.get("abc")
+    assert client.get("abc", width=100, height=100).endswith(b"width=100&height=100")
+    assert len(requests_seen) == 2
+    assert client.get("missing") is None
+    client.close()
+
+
+def test_disk_cache_and_revalidation(core, tmp_path):
+    client = ImageClient(core, cache_dir=str(tmp_path))
+    client.get("abc")
+    client.close()
+
+    # A new client finds the image on disk
+    client = ImageClient(core, cache_dir=str(tmp_path), max_age=0)
+    assert client.is_cached("abc")
+    image = client.get_image("abc")
+    assert image.content_type == "image/jpeg"
+    assert image.data == b"/api/image/abc?scale=fit&width=500&height=500"
+    assert requests_seen[-1][1] == '"v1"'
+    client.close()
+
+
+def test_disk_cache_size(core, tmp_path):
+    # Each image is 46 bytes, two fit
+    client = ImageClient(core, cache_dir=str(tmp_path), disk_size=100)
+    client.get("a")
+    client.get("b")
+    client.close()
+
+    client = ImageClient(core, cache_dir=str(tmp_path), disk_size=100)
+    client.get("a")
+    client.get("c")
+    client.close()
+    assert len(requests_seen) == 3
+
+    # b was used least recently
+    client = ImageClient(core, cache_dir=str(tmp_path), disk_size=100)
+    assert client.is_cached("a") and client.is_cached("c")
+    assert not client.is_cached("b")
+    assert len(os.listdir(str(tmp_path))) == 4
+    client.close()
+
+
+def test_fetch_many(core):
+    client = ImageClient(core, memory_size=100)
+    images = client.fetch_many(["a", "b", "c", "a"])
+    assert sorted(images) == ["a", "b", "c"]
+    assert images["b"].startswith(b"/api/image/b")
+    assert len(requests_seen) == 3
+    client.close()
+
+
+def wait_for(client, *image_keys):
+    for _ in range(100):
+        if all(client.is_cached(image_key) for image_key in image_keys):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_prefetch(core):
+    client = ImageClient(core)
+    core.zones["z1"] = {"now_playing": {"image_key": "playing"}}
+    prefetcher = ImagePrefetcher(core, client, queue_items=2)
+    prefetcher.start()
+    assert wait_for(client, "playing")
+    assert core.queue_windows == {"z1": 2}
+
+    core.queue_callbacks["z1"](
+        {
+            "items": [
+                {"image_key": "next"},
+                {"image_key": "after"},
+                {"image_key": "later"},
+            ]
+        }
+    )
+    assert wait_for(client, "next", "after")
+    core.queue_callbacks["z1"](
+        {
+            "changes": [
+                {"operation": "insert", "index": 0, "items": [{"image_key": "new"}]}
+            ]
+        }
+    )
+    assert wait_for(client, "new")
+    assert not client.is_cached("later")
+
+    # Zone changes for a cached image do not fetch it again
+    core.state_callbacks[0]("zones_changed", ["z1"])
+    prefetcher.stop()
+    assert core.state_callbacks == []
+    assert core.queue_callbacks == {}
+    assert sorted(path.split("?")[0] for path, _ in requests_seen) == [
+        "/api/image/after",
+        "/api/image/new",
+        "/api/image/next",
+        "/api/image/playing",
+    ]
+    client.close()
+
+
+def test_coalescing(core):
+    client = ImageClient(core, max_workers=8)
+    with ThreadPoolExecutor(8) as executor:
+        images = list(executor.map(lambda _: client.get("slow"), range(8)))
+    assert len(set(images)) == 1 and images[0].startswith(b"/api/image/slow")
+    assert len(requests_seen) == 1
+    stats = client.stats
+    assert stats["misses"] == 1 and stats["hits"] + stats["coalesced"] == 7
+    client.close()
+
+
+def test_proxy(core):
+    client = ImageClient(core)
+    proxy = ImageProxy(client, "127.0.0.1")
+    proxy.start()
+    url = "http://127.0.0.1:%s/api/image/%%s?scale=fit&width=100&height=100" % (
+        proxy.port
+    )
+    for _ in range(3):
+        with urllib.request.urlopen(url % "abc") as response:
+            assert response.headers["Content-Type"] == "image/jpeg"
+            assert response.read().endswith(b"/abc?scale=fit&width=100&height=100")
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(url % "missing")
+    assert len(requests_seen) == 2
+    stats = proxy.stats
+    assert stats["requests"] == 4 and stats["not_found"] == 1
+    assert stats["hits"] == 2 and stats["misses"] == 2
+    proxy.stop()
+    client.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of the library index."""
+
+from roonapi import LibraryCrawler, LibraryIndex
+from roonapi_stub import FakeBrowseService, StubRoonApi, level
+
+
+def make_index():
+    index = LibraryIndex()
+    index.update(
+        "Artists",
+        ["Library", "Artists"],
+        [
+            {"title": "Neil Young", "item_key": "1:1", "hint": "list"},
+            {"title": "Nick Drake", "item_key": "1:2", "hint": "list"},
+            {"title": "Joni Mitchell", "item_key": "1:3", "hint": "list"},
+        ],
+        generation=1,
+    )
+    index.update(
+        "Albums",
+        ["Library", "Albums"],
+        [{"title": "Harvest", "subtitle": "Neil Young", "item_key": "2:1"}],
+        generation=1,
+    )
+    return index
+
+
+def test_prefix_search():
+    index = make_index()
+    assert len(index) == 4
+
+    results = index.search("neil yo")
+    assert [result["title"] for result in results] == ["Neil Young", "Harvest"]
+    assert results[0]["path"] == ["Library", "Artists", "Neil Young"]
+    assert results[0]["item_key"] == "1:1"
+
+    results = index.search("n", section="Artists")
+    assert sorted(result["title"] for result in results) == ["Neil Young", "Nick Drake"]
+
+
+def test_close_search():
+    index = make_index()
+    assert [result["title"] for result in index.search("Jonny Mitchel")] == [
+        "Joni Mitchell"
+    ]
+    assert index.search("xyz") == []
+
+
+def test_incremental_update():
+    index = make_index()
+    index.update(
+        "Artists",
+        ["Library", "Artists"],
+        [{"title": "Neil Young", "item_key": "3:1", "subtitle": "Canada"}],
+        generation=2,
+    )
+    assert index.prune("Artists", 2) == 2
+    assert len(index) == 2
+    assert index.search("canada")[0]["item_key"] == "3:1"
+    assert index.search("drake") == []
+
+
+ALBUMS = [
+    {"title": "Greatest Hits", "subtitle": "ABBA", "item_key": "4:0"},
+    {"title": "Greatest Hits", "subtitle": "Neil Young", "item_key": "4:1"},
+    {"title": "Greatest Hits", "subtitle": "Neil Young", "item_key": "4:2"},
+]
+
+
+class FakeRoonApi:
+    def __init__(self, items):
+        self.items = items
+
+    def browse_items(self, zone_or_output_id, path, count, multi_session_key):
+        assert path == ["Library", "Albums"]
+        return iter(self.items)
+
+
+def test_duplicate_titles():
+    index = LibraryIndex()
+    index.update("Albums", ["Library", "Albums"], ALBUMS[:1], generation=1)
+    index.update("Albums", ["Library", "Albums"], ALBUMS[1:], generation=1, offset=1)
+    assert len(index) == 3
+
+    results = index.search("greatest neil")
+    assert sorted(result["position"] for result in results) == [1, 2]
+    assert {result["subtitle"] for result in results} == {"Neil Young"}
+
+    entry = [result for result in results if result["position"] == 2][0]
+    crawler = LibraryCrawler(FakeRoonApi(ALBUMS), "zone")
+    assert crawler.resolve(entry, 1) == "4:2"
+
+    # the library changed: the album moved, so the first one of the artist is used
+    crawler = LibraryCrawler(FakeRoonApi(ALBUMS[1:]), "zone")
+    assert crawler.resolve(entry, 1) == "4:1"
+    crawler = LibraryCrawler(FakeRoonApi(ALBUMS[:1]), "zone")
+    assert crawler.resolve(entry, 1) is None
+
+
+def test_crawl_waits_per_page():
+    tracks = level("Tracks", *[level("Track %d" % index) for index in range(250)])
+    service = FakeBrowseService(tree=level("Explore", level("Library", tracks)))
+    roonapi = StubRoonApi(service)
+    crawler = LibraryCrawler(roonapi, "zone", delay=0)
+    waits = []
+    crawler._exit.wait = waits.append
+    assert crawler._crawl("Tracks", ["Library", "Tracks"], 1, 1)
+    loads = [load for load in service.loads if load[0] == "Tracks"]
+    assert [load[1:] for load in loads] == [(0, 100), (100, 100), (200, 50)]
+    assert len(waits) == len(loads)
+    assert len(crawler.index) == 250
+    roonapi.stop()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of parsing MOO messages, without a roon core."""
+
+from roonapi.roonapisocket import RoonApiWebSocket, decode_body, parse_message
+
+
+def test_parse_json():
+    body = '{"title": "Café"}'.encode("utf-8")
+    message = (
+        b"MOO/1 COMPLETE Success\nRequest-Id: 12\nContent-Length: %d\n"
+        b"Content-Type: application/json\n\n%s" % (len(body), body)
+    )
+    header, headers, raw = parse_message(message)
+    assert header == "MOO/1 COMPLETE Success"
+    assert headers["Request-Id"] == "12"
+    assert decode_body(header, headers, raw) == {"title": "Café"}
+
+
+def test_parse_binary():
+    image = bytes(range(256)) + b"\n\n\xff\xd8"
+    message = (
+        b"MOO/1 COMPLETE Success\nRequest-Id: 13\nContent-Type: image/jpeg\n"
+        b"Content-Length: %d\n\n%s" % (len(image), image)
+    )
+    header, headers, raw = parse_message(message)
+    content_type, data = decode_body(header, headers, raw)
+    assert content_type == "image/jpeg"
+    assert isinstance(data, memoryview) and data.obj is message
+    assert data == image
+
+
+def test_parse_without_body():
+    header, headers, raw = parse_message(b"MOO/1 COMPLETE Success\nRequest-Id: 14\n\n")
+    assert decode_body(header, headers, raw) == "MOO/1 COMPLETE Success"
+
+
+def test_on_message_result():
+    socket = RoonApiWebSocket("ws://127.0.0.1:1/api")
+    image = b"\x89PNG\r\n\x1a\n\x00\x00"
+    socket.on_message(
+        None,
+        b"MOO/1 COMPLETE Success\nRequest-Id: 15\nContent-Type: image/png\n"
+        b"Content-Length: %d\n\n%s" % (len(image), image),
+    )
+    content_type, data = socket.results[15]
+    assert content_type == "image/png" and bytes(data) == image
+
+
+class SentMessages(list):
+    def send(self, message, opcode):
+        self.append(message.decode("utf-8"))
+
+    def close(self):
+        pass
+
+
+def connected_socket():
+    socket = RoonApiWebSocket("ws://127.0.0.1:1/api")
+    socket._socket = SentMessages()
+    socket.connected = True
+    return socket
+
+
+def test_shared_subscriptions():
+    socket = connected_socket()
+    first, second = [], []
+    socket.subscribe("queue:1", "queue", first.append, {"zone_or_output_id": "z"})
+    socket.subscribe("queue:1", "queue", second.append, {"zone_or_output_id": "z"})
+    socket.subscribe("queue:1", "queue", second.append, {"zone_or_output_id": "y"})
+    assert len(socket._socket) == 2
+
+    body = b'{"changes": []}'
+    socket.on_message(
+        None,
+        b"MOO/1 CONTINUE Changed\nRequest-Id: 10\nContent-Length: %d\n"
+        b"Content-Type: application/json\n\n%s" % (len(body), body),
+    )
+    assert first == second == [{"changes": []}]
+
+    socket.unsubscribe("queue:1", "queue", first.append, {"zone_or_output_id": "z"})
+    assert len(socket._socket) == 2
+    socket.unsubscribe("queue:1", "queue", second.append, {"zone_or_output_id": "z"})
+    assert socket._socket[-1].startswith("MOO/1 REQUEST queue:1/unsubscribe_queue")
+    socket.stop()
+    assert socket._socket[-1].startswith("MOO/1 REQUEST queue:1/unsubscribe_queue")
+    assert not socket._subscriptions
+
+
+def test_subscribe_not_connected():
+    socket = connected_socket()
+    socket.connected = False
+    callbacks = []
+    socket.subscribe("queue:1", "queue", callbacks.append, {"zone_or_output_id": "z"})
+    socket.subscribe("queue:1", "queue", callbacks.append, {"zone_or_output_id": "y"})
+    assert not socket._subscriptions
+
+    socket.connected = True
+    socket.subscribe("queue:1", "queue", callbacks.append, {"zone_or_output_id": "z"})
+    assert socket._socket[-1].startswith("MOO/1 REQUEST queue:1/subscribe_queue")
+    assert [value["callbacks"] for value in socket._subscriptions.values()] == [
+        [callbacks.append]
+    ]
+    socket.stop()
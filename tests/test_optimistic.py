@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of optimistic updates, without a roon core."""
+
+import copy
+import time
+
+from roonapi.optimistic import OptimisticState
+from roonapi_stub import StubRoonApi
+
+OUTPUT = {
+    "output_id": "out",
+    "zone_id": "zone",
+    "display_name": "Kitchen",
+    "volume": {"min": 0, "max": 100, "step": 1, "value": 20, "is_muted": False},
+}
+ZONE = {
+    "zone_id": "zone",
+    "display_name": "Kitchen",
+    "state": "paused",
+    "settings": {"shuffle": False, "loop": "disabled"},
+    "outputs": [OUTPUT],
+}
+
+
+def make_api(result):
+    def handler(command, body):
+        roonapi.events.append(("request", roonapi._zones["zone"]["state"]))
+        return result
+
+    roonapi = StubRoonApi(
+        handler,
+        zones={"zone": copy.deepcopy(ZONE)},
+        outputs={"out": copy.deepcopy(OUTPUT)},
+    )
+    roonapi.optimistic_updates = True
+    roonapi.events = []
+    roonapi.register_state_callback(
+        lambda event, ids: roonapi.events.append((event, ids))
+    )
+    return roonapi
+
+
+def wait_settled(roonapi):
+    deadline = time.monotonic() + 5
+    while roonapi._optimistic.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return roonapi._optimistic.pending == 0
+
+
+def test_applied_before_request():
+    roonapi = make_api("MOO/1 COMPLETE Success")
+    roonapi.playback_control("out", "playpause")
+    assert roonapi.events == [
+        ("zones_changed_provisional", ["zone"]),
+        ("request", "playing"),
+    ]
+    roonapi.change_volume_raw("out", 5, "relative")
+    assert roonapi._outputs["out"]["volume"]["value"] == 25
+    assert roonapi._zones["zone"]["outputs"][0]["volume"]["value"] == 25
+    roonapi.shuffle("zone", True)
+    assert roonapi._zones["zone"]["settings"]["shuffle"] is True
+
+    # The core reports another volume, that wins
+    output = copy.deepcopy(OUTPUT)
+    output["volume"]["value"] = 24
+    roonapi._on_state_change({"outputs_changed": [output]})
+    assert roonapi._outputs["out"]["volume"]["value"] == 24
+    assert roonapi.events[-1] == ("outputs_changed", ["out"])
+
+
+def test_rolled_back_on_failure():
+    roonapi = make_api({"message": "InvalidRequest"})
+    roonapi.mute("out", True)
+    assert roonapi.events[0] == ("outputs_changed_provisional", ["out"])
+    assert sorted(roonapi.events[-2:]) == [
+        ("outputs_changed", ["out"]),
+        ("zones_changed", ["zone"]),
+    ]
+    assert roonapi._outputs["out"]["volume"]["is_muted"] is False
+    assert roonapi._zones["zone"]["outputs"][0]["volume"]["is_muted"] is False
+    roonapi.repeat("zone", "loop_one")
+    assert roonapi._zones["zone"]["settings"]["loop"] == "disabled"
+    assert roonapi._optimistic.pending == 0
+
+
+def test_settled_without_change_event():
+    roonapi = make_api("MOO/1 COMPLETE Success")
+    roonapi.change_volume_raw("out", 25)
+    assert roonapi._optimistic.pending == 0
+    assert roonapi._outputs["out"]["volume"]["value"] == 25
+
+
+def test_coalesced_volume():
+    roonapi = make_api("MOO/1 COMPLETE Success")
+    roonapi.change_volume_raw("out", 5, "relative", coalesce=True)
+    roonapi.change_volume_raw("out", 5, "relative", coalesce=True)
+    assert roonapi._outputs["out"]["volume"]["value"] == 30
+    assert wait_settled(roonapi)
+    sent = [body for command, body in roonapi.socket.requests]
+    # The steps are not applied again when sent
+    assert sum(body["value"] for body in sent) == 10
+    assert roonapi._outputs["out"]["volume"]["value"] == 30
+    roonapi.stop()
+
+    roonapi = make_api({"message": "InvalidRequest"})
+    roonapi.change_volume_raw("out", 5, "relative", coalesce=True)
+    roonapi.change_volume_raw("out", 5, "relative", coalesce=True)
+    assert wait_settled(roonapi)
+    assert roonapi._outputs["out"]["volume"]["value"] == 20
+    assert roonapi._zones["zone"]["outputs"][0]["volume"]["value"] == 20
+    roonapi.stop()
+
+
+def test_expired():
+    now = [0]
+    optimistic = OptimisticState(max_age=30, clock=lambda: now[0])
+    outputs = {"out": copy.deepcopy(OUTPUT)}
+    optimistic.apply("outputs", outputs, "out", {("volume", "value"): 25})
+    now[0] = 31
+    optimistic.apply("outputs", outputs, "out", {("volume", "is_muted"): True})
+    assert optimistic.pending == 1
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of the queue model, against a plain list."""
+
+import random
+import threading
+import time
+
+from roonapi_stub import StubRoonApi
+from roonapi.playqueue import ChunkedList, QueueModel
+
+
+def test_chunked_list_matches_list():
+    rand = random.Random(1)
+    expected = list(range(1000))
+    chunked = ChunkedList(expected, chunk_size=16)
+    for step in range(2000):
+        index = rand.randrange(len(expected) + 1)
+        if rand.random() < 0.5:
+            items = ["%s-%s" % (step, i) for i in range(rand.randrange(1, 40))]
+            expected[index:index] = items
+            chunked.insert(index, items)
+        else:
+            count = rand.randrange(1, 40)
+            del expected[index : index + count]
+            chunked.remove(index, count)
+        assert len(chunked) == len(expected)
+    assert list(chunked) == expected
+    assert chunked[-1] == expected[-1]
+    assert chunked[10:75] == expected[10:75]
+    assert chunked.range(len(expected) - 5, 10) == expected[-5:]
+
+
+def test_queue_model():
+    model = QueueModel("zone")
+    seen = []
+    model.register_callback(lambda queue, operations: seen.append(operations))
+    model.apply({"items": [{"queue_item_id": i} for i in range(5)]})
+    model.apply(
+        {
+            "changes": [
+                {"operation": "remove", "index": 1, "count": 2},
+                {"operation": "insert", "index": 0, "items": [{"queue_item_id": 9}]},
+            ]
+        }
+    )
+    assert [item["queue_item_id"] for item in model.items()] == [9, 0, 3, 4]
+    assert model[1] == {"queue_item_id": 0}
+    assert model.items(2, 5) == [{"queue_item_id": 3}, {"queue_item_id": 4}]
+    assert [operation["operation"] for operation in seen[1]] == ["remove", "insert"]
+    assert seen[0][0]["operation"] == "reset"
+
+
+def test_late_callback_gets_current_items():
+    model = QueueModel("zone")
+    model.apply({"items": [{"queue_item_id": 1}]})
+    model.apply(
+        {
+            "changes": [
+                {"operation": "insert", "index": 1, "items": [{"queue_item_id": 2}]}
+            ]
+        }
+    )
+    seen = []
+    model.register_callback(lambda queue, operations: seen.append(operations), True)
+    assert seen == [
+        [
+            {
+                "operation": "reset",
+                "index": 0,
+                "items": [{"queue_item_id": 1}, {"queue_item_id": 2}],
+            }
+        ]
+    ]
+
+
+def test_window():
+    model = QueueModel("zone", max_item_count=3)
+    resets = model.resets
+    model.apply({"items": [{"queue_item_id": i} for i in range(3)]})
+    assert model.wait_for_reset(resets, 0)
+    model.apply(
+        {
+            "changes": [
+                {"operation": "insert", "index": 0, "items": [{"queue_item_id": 9}]}
+            ]
+        }
+    )
+    assert [item["queue_item_id"] for item in model.items()] == [9, 0, 1]
+    assert not model.wait_for_reset(model.resets, 0.01)
+
+
+def queue_reset(count):
+    return {"items": [{"queue_item_id": index} for index in range(count)]}
+
+
+def test_queue_window():
+    roonapi = StubRoonApi(lambda command, body: None)
+    model = roonapi.subscribe_queue("zone", max_item_count=100)
+    model.apply(queue_reset(100))
+    assert roonapi.socket.subscriptions[-1][3]["max_item_count"] == 100
+
+    # The core sends the items of the new window
+    threading.Timer(0.05, model.apply, (queue_reset(200),)).start()
+    items = roonapi.queue_items("zone", 150, 20)
+    assert [item["queue_item_id"] for item in items] == list(range(150, 170))
+    assert model.max_item_count == 200
+    assert len(roonapi.socket.subscriptions) == 1
+    assert roonapi.socket.subscriptions[0][3]["max_item_count"] == 200
+
+    # Within the window nothing is subscribed again
+    assert len(roonapi.queue_items("zone", 0, 200)) == 200
+    assert roonapi.set_queue_window("zone", 200)
+    assert roonapi.set_queue_window("other", 10) is False
+    roonapi.stop()
+
+
+def test_queue_window_in_callback():
+    roonapi = StubRoonApi(lambda command, body: None)
+    model = roonapi.subscribe_queue("zone", max_item_count=10)
+    model.apply(queue_reset(10))
+    results = []
+    roonapi.socket.run = lambda: results.append(
+        roonapi.set_queue_window("zone", 50, timeout=5)
+    )
+    started = time.monotonic()
+    roonapi.socket.start()
+    roonapi.socket.join()
+    assert results == [False]
+    assert time.monotonic() - started < 1
+    assert roonapi.socket.subscriptions[0][3]["max_item_count"] == 50
+    roonapi.stop()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of presets, against a fake browse service."""
+
+import time
+
+import pytest
+
+from roonapi_stub import FakeBrowseService, StubRoonApi
+from roonapi.presets import PresetRegistry
+
+HARVEST = ["Library", "Artists", "Neil Young", "Harvest"]
+PLAYED = ["Library", "Artists", "Neil Young", "Harvest (Neil Young)", "Play Album"]
+
+
+def wait_resolved(registry, name, timeout=2):
+    deadline = time.monotonic() + timeout
+    while registry._presets[name].action_item is None:
+        assert time.monotonic() < deadline, "preset was not resolved"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def registry():
+    service = FakeBrowseService()
+    roonapi = StubRoonApi(service)
+    registry = PresetRegistry(roonapi, delay=0)
+    registry.service = service
+    registry.start()
+    yield registry
+    registry.stop()
+    roonapi.stop()
+
+
+def test_resolved_in_background(registry):
+    registry.add("harvest", HARVEST)
+    wait_resolved(registry, "harvest")
+    assert registry.names == ["harvest"]
+    assert registry.service.played == []
+
+
+def test_cache_hit(registry):
+    registry.add("harvest", HARVEST, "Play Now")
+    wait_resolved(registry, "harvest")
+    for _ in range(2):
+        registry.service.calls = []
+        assert registry.play("zone", "harvest") is True
+        assert registry.service.calls == [("item_key", "0:0")]
+    assert registry.service.played == [PLAYED + ["Play Now"]] * 2
+
+
+def test_resolved_again_on_failure(registry):
+    registry.add("harvest", HARVEST)
+    wait_resolved(registry, "harvest")
+
+    # The cached item key is no longer valid
+    registry.service.generation += 1
+    assert registry.play("zone", "harvest") is True
+    assert registry.service.played == [PLAYED + ["Play Now"]]
+    registry.service.calls = []
+    assert registry.play("zone", "harvest") is True
+    assert registry.service.calls == [("item_key", "1:0")]
+
+    # An error without a body is answered with the header
+    registry.service.stale_reply = "MOO/1 COMPLETE InvalidItemKey"
+    registry.service.generation += 1
+    registry.service.calls = []
+    assert registry.play("zone", "harvest") is True
+    assert registry.service.calls[0] == ("item_key", "1:0")
+    assert registry.service.calls[-1] == ("item_key", "2:0")
+    assert len(registry.service.played) == 3
+
+    registry.add("missing", ["Library", "Artists", "Nobody"])
+    assert registry.play("zone", "missing") is False
+
+
+def test_remove(registry):
+    registry.add("harvest", HARVEST)
+    registry.remove("harvest")
+    assert registry.names == []
+    assert registry.play("zone", "harvest") is None
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests of the SOOD codec, including fuzzing and a rough benchmark."""
+
+import os
+import random
+import time
+
+import pytest
+
+from roonapi.discovery import core_from_response
+from roonapi.soodmessage import (
+    SERVICE_ID,
+    FormatException,
+    SOODMessage,
+    answers,
+    decode,
+    encode,
+    query,
+)
+
+RESPONSE = SOODMessage.SOODMessageType.RESPONSE
+PROPERTIES = {
+    "name": "Küche Cöre ♫",
+    "display_version": "2.0 (build 1234)",
+    "unique_id": "core-1",
+    "service_id": SERVICE_ID,
+    "http_port": "9330",
+}
+
+
+def test_round_trip():
+    message = encode(RESPONSE, PROPERTIES)
+    assert decode(message) == (RESPONSE, PROPERTIES)
+    assert decode(memoryview(bytearray(message))) == (RESPONSE, PROPERTIES)
+    assert SOODMessage(message).as_dictionary == {
+        "type": RESPONSE,
+        "properties": PROPERTIES,
+    }
+
+
+def test_multi_byte_values_keep_their_neighbours():
+    # the length prefixes count bytes, not characters
+    properties = {"name": "ééé", "unique_id": "core-1", "http_port": "9330"}
+    assert decode(encode(RESPONSE, properties))[1] == properties
+
+
+def test_query_has_fresh_tid():
+    message, tid = query()
+    other, other_tid = query()
+    assert tid != other_tid
+    assert decode(message) == (
+        SOODMessage.SOODMessageType.QUERY,
+        {"query_service_id": SERVICE_ID, "_tid": tid},
+    )
+    assert other.endswith(other_tid.encode())
+    assert query("my-tid")[1] == "my-tid"
+
+
+def test_match_answers_to_queries():
+    _, tid = query()
+    assert answers(dict(PROPERTIES, _tid=tid), {tid})
+    assert not answers(dict(PROPERTIES, _tid="stale"), {tid})
+    assert answers(PROPERTIES, {tid})
+    response = encode(RESPONSE, dict(PROPERTIES, _tid="stale"))
+    assert core_from_response(response, ("h", 1)) is not None
+    assert core_from_response(response, ("h", 1), {tid}) is None
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b"",
+        b"SOOD",
+        b"SOOD\x02",
+        b"SOOD\x02X",
+        b"SOOD\x01R",
+        b"SOOD\x02R\x05abc",
+        b"SOOD\x02R\x01a\x00",
+        b"SOOD\x02R\x01a\x00\x05abc",
+        b"SOOD\x02R\x01\xff\x00\x00",
+    ],
+)
+def test_invalid_messages(message):
+    with pytest.raises(FormatException):
+        decode(message)
+
+
+def test_fuzz():
+    rng = random.Random(90)
+    message = encode(RESPONSE, dict(PROPERTIES, _tid=query()[1]))
+    for length in range(len(message)):
+        try:
+            decode(message[:length])
+        except FormatException:
+            pass
+    for _ in range(5000):
+        mutated = bytearray(message)
+        for _ in range(rng.randint(1, 4)):
+            mutated[rng.randrange(len(mutated))] = rng.randrange(256)
+        try:
+            message_type, properties = decode(mutated)
+        except FormatException:
+            continue
+        assert message_type in SOODMessage.SOODMessageType
+        assert all(isinstance(key, str) for key in properties)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("SOOD_BENCHMARK"), reason="set SOOD_BENCHMARK to run"
+)
+def test_benchmark():
+    message = encode(RESPONSE, dict(PROPERTIES, _tid=query()[1]))
+    count = 20000
+    start = time.perf_counter()
+    for _ in range(count):
+        decode(message)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 10, "decoded %d messages/s" % (count / elapsed)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Some tests of coalescing volume changes, without a roon core."""
+
+import threading
+
+from roonapi.volume import VolumeCoalescer
+
+VOLUME = {"min": 0, "max": 100, "step": 1}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Core:
+    """Record the changes sent, changes of outputs in blocked wait for unblock."""
+
+    def __init__(self):
+        self.sent = []
+        self.blocked = {}
+        self.condition = threading.Condition()
+
+    def send(self, output_id, value, method, context):
+        with self.condition:
+            self.sent.append((output_id, method, value))
+            self.condition.notify_all()
+        if output_id in self.blocked:
+            self.blocked[output_id].wait(5)
+
+    def wait_sent(self, count):
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self.sent) >= count, 5)
+            return list(self.sent)
+
+
+def test_merges_changes_while_in_flight():
+    core = Core()
+    core.blocked["slow"] = threading.Event()
+    clock = Clock()
+    coalescer = VolumeCoalescer(core.send, max_rate=10, clock=clock)
+    coalescer.start()
+    coalescer.change("slow", 10, "relative", VOLUME)
+    core.wait_sent(1)
+
+    # The first change is in flight, these are merged without blocking
+    for _ in range(20):
+        coalescer.change("slow", 1, "relative", VOLUME)
+    # Other outputs are not held up by the slow one
+    coalescer.change("fast", 30, "absolute", VOLUME)
+    assert core.wait_sent(2)[1] == ("fast", "absolute", 30)
+    coalescer.change("fast", 40, "absolute", VOLUME)
+    coalescer.change("fast", 80, "relative", VOLUME)
+    assert coalescer.pending == {
+        "slow": ("relative", 20),
+        "fast": ("absolute", 100),
+    }
+
+    clock.now = 1
+    coalescer.wake()
+    assert core.wait_sent(3)[2] == ("fast", "absolute", 100)
+    core.blocked["slow"].set()
+    assert core.wait_sent(4)[3] == ("slow", "relative", 20)
+    coalescer.stop()
+
+
+def test_max_rate():
+    core = Core()
+    clock = Clock()
+    coalescer = VolumeCoalescer(core.send, max_rate=10, clock=clock)
+    coalescer.start()
+    coalescer.change("out", 1)
+    core.wait_sent(1)
+    coalescer.change("out", 2)
+    coalescer.change("out", 3)
+
+    clock.now = 0.05
+    coalescer.wake()
+    assert coalescer.pending == {"out": ("absolute", 3)}
+    clock.now = 0.1
+    coalescer.wake()
+    assert core.wait_sent(2) == [("out", "absolute", 1), ("out", "absolute", 3)]
+    assert coalescer.pending == {}
+    coalescer.stop()